@@ -1,8 +1,16 @@
+import argparse
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import pandas as pd
 import os
 import platform
+import sys
+
+# Make the shared sources package importable when run from this directory
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')))
+from sources.bulk_load import add_foreign_keys, load_tables, upsert_tables
+from sources.cache import invalidate_source
+from sources.entity_resolution import run_linkage, update_linkage
+from sources.indexes import create_indexes
 
 # Set dynamic paths for different operating systems
 def get_library_path():
@@ -31,19 +39,23 @@ def get_file_path(*paths):
         raise FileNotFoundError(f"File not found: {file_path}")
     return file_path
 
-# Create Database Function
-def create_database(conn, dbname):
+# Create Database Function; returns True when the database was (re)created and needs its tables
+def create_database(conn, dbname, replace=True, confirm=True):
     with conn.cursor() as cur:
         cur.execute(f"SELECT 1 FROM pg_database WHERE datname = '{dbname}'")
         exists = cur.fetchone()
         if exists:
             print(f"Database '{dbname}' already exists.")
-            for _ in range(5):
-                input("Press Enter to continue...")
+            if not replace:
+                return False
+            if confirm:
+                for _ in range(5):
+                    input("Press Enter to continue...")
             cur.execute(f"DROP DATABASE {dbname}")
             print(f"Database '{dbname}' dropped.")
         cur.execute(f"CREATE DATABASE {dbname}")
         print(f"Database '{dbname}' created.")
+        return True
 
 # Create Tables Function
 def create_tables(conn):
@@ -51,26 +63,29 @@ def create_tables(conn):
         cur.execute("""
             CREATE TABLE cities (
                 city VARCHAR(255),
-                city_id SERIAL PRIMARY KEY
+                city_id SERIAL PRIMARY KEY,
+                row_hash BIGINT
             );
         """)
         cur.execute("""
             CREATE TABLE locations (
                 location_id SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Location VARCHAR(255),
-                city_id INT,
-                FOREIGN KEY (city_id) REFERENCES cities(city_id)
+                city_id INT
             );
         """)
         cur.execute("""
             CREATE TABLE property_types (
                 property_type_id SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 property_type VARCHAR(255)
             );
         """)
         cur.execute("""
             CREATE TABLE rooms (
                 room_config_id SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Total_Rooms INT,
                 BHK INT
             );
@@ -78,6 +93,7 @@ def create_tables(conn):
         cur.execute("""
             CREATE TABLE properties (
                 property_id SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Property_Name VARCHAR(255),
                 Property_Title VARCHAR(255),
                 Price NUMERIC,
@@ -88,75 +104,73 @@ def create_tables(conn):
                 room_config_id INT,
                 Location VARCHAR(255),
                 Description TEXT,
-                Balcony BOOLEAN,
-                FOREIGN KEY (property_type_id) REFERENCES property_types(property_type_id),
-                FOREIGN KEY (location_id) REFERENCES locations(location_id),
-                FOREIGN KEY (room_config_id) REFERENCES rooms(room_config_id)
+                Balcony BOOLEAN
             );
         """)
         conn.commit()
 
+# Normalised files and how their columns load into each table, parents first
+TABLE_SPECS = [
+    {
+        'table': 'cities', 'file': 'cities.csv', 'key': 'city_id',
+        'columns': {'city': 'city', 'city_id': 'city_id'},
+        'integer': ['city_id']
+    },
+    {
+        'table': 'locations', 'file': 'locations.csv', 'key': 'location_id',
+        'columns': {'location_id': 'location_id', 'Location': 'location', 'city_id': 'city_id'},
+        'integer': ['location_id', 'city_id']
+    },
+    {
+        'table': 'property_types', 'file': 'property_types.csv', 'key': 'property_type_id',
+        'columns': {'property_type_id': 'property_type_id', 'property_type': 'property_type'},
+        'integer': ['property_type_id']
+    },
+    {
+        'table': 'rooms', 'file': 'rooms.csv', 'key': 'room_config_id',
+        'columns': {'room_config_id': 'room_config_id', 'Total_Rooms': 'total_rooms', 'BHK': 'bhk'},
+        'integer': ['room_config_id', 'total_rooms', 'bhk']
+    },
+    {
+        'table': 'properties', 'file': 'properties.csv', 'key': 'property_id',
+        'columns': {
+            'property_id': 'property_id',
+            'Property_Name': 'property_name',
+            'Property Title': 'property_title',
+            'Price': 'price',
+            'Total_Area(SQFT)': 'total_area_sqft',
+            'Price_per_SQFT': 'price_per_sqft',
+            'property_type_id': 'property_type_id',
+            'location_id': 'location_id',
+            'room_config_id': 'room_config_id',
+            'Location': 'location',
+            'Description': 'description',
+            'Balcony': 'balcony'
+        },
+        'integer': ['property_id', 'property_type_id', 'location_id', 'room_config_id'],
+        'numeric': ['price', 'total_area_sqft', 'price_per_sqft'],
+        'boolean': ['balcony']
+    }
+]
+
+# Foreign keys, added once the tables are loaded so COPY does not check every row (see
+# sources.bulk_load.add_foreign_keys)
+FOREIGN_KEYS = [
+    {'table': 'locations', 'column': 'city_id', 'parent': 'cities', 'key': 'city_id'},
+    {'table': 'properties', 'column': 'property_type_id', 'parent': 'property_types', 'key': 'property_type_id'},
+    {'table': 'properties', 'column': 'location_id', 'parent': 'locations', 'key': 'location_id'},
+    {'table': 'properties', 'column': 'room_config_id', 'parent': 'rooms', 'key': 'room_config_id'}
+]
+
 # Populate Data Function
 def populate_source_2(conn):
-    # Using get_file_path to construct paths dynamically and validate their existence
-    cities_path = get_file_path('normalized', 'cities.csv')
-    locations_path = get_file_path( 'normalized', 'locations.csv')
-    property_types_path = get_file_path('normalized', 'property_types.csv')
-    rooms_path = get_file_path('normalized', 'rooms.csv')
-    properties_path = get_file_path('normalized', 'properties.csv')
-
-    # Load data from CSV files
-    cities_df = pd.read_csv(cities_path)
-    locations_df = pd.read_csv(locations_path)
-    property_types_df = pd.read_csv(property_types_path)
-    rooms_df = pd.read_csv(rooms_path)
-    properties_df = pd.read_csv(properties_path)
+    # Using get_file_path to construct paths dynamically and validate their existence,
+    # then stream each table in with COPY
+    return load_tables(conn, TABLE_SPECS, lambda file_name: get_file_path('normalized', file_name))
 
-    with conn.cursor() as cur:
-        for _, row in cities_df.iterrows():
-            cur.execute("INSERT INTO cities (city, city_id) VALUES (%s, %s)", 
-                      (row['city'], int(row['city_id']) if not pd.isna(row['city_id']) else None))
-
-        for _, row in locations_df.iterrows():
-            cur.execute("INSERT INTO locations (location_id, Location, city_id) VALUES (%s, %s, %s)", 
-                      (int(row['location_id']) if not pd.isna(row['location_id']) else None, 
-                       row['Location'], 
-                       int(row['city_id']) if not pd.isna(row['city_id']) else None))
-
-        for _, row in property_types_df.iterrows():
-            cur.execute("INSERT INTO property_types (property_type_id, property_type) VALUES (%s, %s)", 
-                      (int(row['property_type_id']) if not pd.isna(row['property_type_id']) else None, 
-                       row['property_type']))
-
-        for _, row in rooms_df.iterrows():
-            cur.execute("INSERT INTO rooms (room_config_id, Total_Rooms, BHK) VALUES (%s, %s, %s)", 
-                      (int(row['room_config_id']) if not pd.isna(row['room_config_id']) else None,
-                       int(row['Total_Rooms']) if not pd.isna(row['Total_Rooms']) else None,
-                       int(row['BHK']) if not pd.isna(row['BHK']) else None))
-
-        for _, row in properties_df.iterrows():
-            cur.execute("""
-                INSERT INTO properties (
-                    property_id, Property_Name, Property_Title, Price, Total_Area_SQFT, 
-                    Price_per_SQFT, property_type_id, location_id, room_config_id, 
-                    Location, Description, Balcony
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                int(row['property_id']) if not pd.isna(row['property_id']) else None,
-                row['Property_Name'],
-                row['Property Title'],
-                float(row['Price']) if not pd.isna(row['Price']) else None,
-                float(row['Total_Area(SQFT)']) if not pd.isna(row['Total_Area(SQFT)']) else None,
-                float(row['Price_per_SQFT']) if not pd.isna(row['Price_per_SQFT']) else None,
-                int(row['property_type_id']) if not pd.isna(row['property_type_id']) else None,
-                int(row['location_id']) if not pd.isna(row['location_id']) else None,
-                int(row['room_config_id']) if not pd.isna(row['room_config_id']) else None,
-                row['Location'],
-                row.get('Description', None),
-                bool(row['Balcony']) if not pd.isna(row['Balcony']) else None
-            ))
-        conn.commit()
+# Refresh Data Function: apply only the rows that were added, changed or removed since the last load
+def refresh_source_2(conn):
+    return upsert_tables(conn, TABLE_SPECS, lambda file_name: get_file_path('normalized', file_name))
 
 # Database connection details
 dbname = "real_estate_db_source_2"
@@ -165,32 +179,54 @@ password = "admin"
 host = "localhost"
 port = "5432"
 
-# Connect to default postgres database to create new database
-conn = psycopg2.connect(
-    dbname="postgres",
-    user=user,
-    password=password,
-    host=host,
-    port=port
-)
-conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-
-try:
-    create_database(conn, dbname)
-finally:
-    conn.close()
-
-# Connect to newly created database
-conn = psycopg2.connect(
-    dbname=dbname,
-    user=user,
-    password=password,
-    host=host,
-    port=port
-)
-
-try:
-    create_tables(conn)
-    populate_source_2(conn)
-finally:
-    conn.close()
+def connect(database):
+    return psycopg2.connect(
+        dbname=database,
+        user=user,
+        password=password,
+        host=host,
+        port=port
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the normalised source 2 tables into PostgreSQL")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Upsert the normalised files into the existing database instead of recreating it")
+    parser.add_argument('--yes', action='store_true',
+                        help="Drop an existing database without asking for confirmation")
+    args = parser.parse_args()
+
+    # Connect to default postgres database to create new database
+    conn = connect("postgres")
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+    try:
+        created = create_database(conn, dbname, replace=not args.incremental, confirm=not args.yes)
+    finally:
+        conn.close()
+
+    # Connect to newly created database
+    conn = connect(dbname)
+
+    try:
+        if created:
+            create_tables(conn)
+            populate_source_2(conn)
+            add_foreign_keys(conn, FOREIGN_KEYS)
+        else:
+            # The mediator keeps serving the previous rows until the refresh commits
+            refresh_source_2(conn)
+        # Secondary indexes are built once the data is in, which is faster than maintaining them row by row
+        create_indexes(conn, 'source_2')
+        # Searches cached by the mediator still hold the old rows
+        invalidate_source('source_2')
+        # Re-cluster listings across sources so the mediator's duplicate lookup sees the new data
+        try:
+            run_linkage() if created else update_linkage()
+        except Exception as e:
+            print(f"Entity resolution skipped: {e}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
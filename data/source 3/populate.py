@@ -1,8 +1,17 @@
+import argparse
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import pandas as pd
 import os
 import platform
+import sys
+
+# Make the shared sources package importable when run from this directory
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')))
+from sources.bulk_load import add_foreign_keys, load_tables, upsert_tables
+from sources.cache import invalidate_source
+from sources.entity_resolution import run_linkage, update_linkage
+from sources.indexes import create_indexes
+from sources.price_parsing import parse_price_inr
 
 # Set dynamic paths for different operating systems
 def get_library_path():
@@ -31,19 +40,23 @@ def get_file_path(*paths):
         raise FileNotFoundError(f"File not found: {file_path}")
     return file_path
 
-# Create Database Function
-def create_database(conn, dbname):
+# Create Database Function; returns True when the database was (re)created and needs its tables
+def create_database(conn, dbname, replace=True, confirm=True):
     with conn.cursor() as cur:
         cur.execute(f"SELECT 1 FROM pg_database WHERE datname = '{dbname}'")
         exists = cur.fetchone()
         if exists:
             print(f"Database '{dbname}' already exists.")
-            for _ in range(5):
-                input("Press Enter to continue...")
+            if not replace:
+                return False
+            if confirm:
+                for _ in range(5):
+                    input("Press Enter to continue...")
             cur.execute(f"DROP DATABASE {dbname}")
             print(f"Database '{dbname}' dropped.")
         cur.execute(f"CREATE DATABASE {dbname}")
         print(f"Database '{dbname}' created.")
+        return True
 
 # Create Tables Function
 def create_tables(conn):
@@ -51,71 +64,106 @@ def create_tables(conn):
         cur.execute("""
             CREATE TABLE location (
                 LocationID SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Location VARCHAR(255)
             );
         """)
         cur.execute("""
             CREATE TABLE properties (
                 PropertyID SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Name VARCHAR(255),
                 Title VARCHAR(255),
                 Description TEXT,
                 LocationID INT,
-                Total_Area NUMERIC,
-                FOREIGN KEY (LocationID) REFERENCES location(LocationID)
+                Total_Area NUMERIC
             );
         """)
         cur.execute("""
             CREATE TABLE features (
                 FeatureID SERIAL PRIMARY KEY,
-                Baths INT,
+                row_hash BIGINT,
+                Baths SMALLINT,
                 Balcony BOOLEAN,
-                PropertyID INT,
-                FOREIGN KEY (PropertyID) REFERENCES properties(PropertyID)
+                PropertyID INT
             );
         """)
         cur.execute("""
             CREATE TABLE pricing (
                 PriceID SERIAL PRIMARY KEY,
+                row_hash BIGINT,
                 Price TEXT,
+                Price_INR NUMERIC,
                 Price_per_SQFT NUMERIC,
-                PropertyID INT,
-                FOREIGN KEY (PropertyID) REFERENCES properties(PropertyID)
+                PropertyID INT
             );
         """)
         conn.commit()
 
+# Normalised files written before Price_INR existed only carry the raw text; newer ones carry
+# it as whole rupees typed by the normaliser
+def add_price_inr(df):
+    if 'Price_INR' not in df.columns:
+        df = df.assign(Price_INR=parse_price_inr(df['Price']))
+    return df
+
+# Normalised files and how their columns load into each table, parents first
+TABLE_SPECS = [
+    {
+        'table': 'location', 'file': 'location.csv', 'key': 'locationid',
+        'columns': {'LocationID': 'locationid', 'Location': 'location'},
+        'integer': ['locationid']
+    },
+    {
+        'table': 'properties', 'file': 'properties.csv', 'key': 'propertyid',
+        'columns': {
+            'PropertyID': 'propertyid',
+            'Name': 'name',
+            'Title': 'title',
+            'Description': 'description',
+            'LocationID': 'locationid',
+            'Total_Area': 'total_area'
+        },
+        'integer': ['propertyid', 'locationid'],
+        'numeric': ['total_area']
+    },
+    {
+        'table': 'features', 'file': 'features.csv', 'key': 'featureid',
+        'columns': {'FeatureID': 'featureid', 'Baths': 'baths', 'Balcony': 'balcony', 'PropertyID': 'propertyid'},
+        'integer': ['featureid', 'baths', 'propertyid'],
+        'boolean': ['balcony']
+    },
+    {
+        'table': 'pricing', 'file': 'pricing.csv', 'key': 'priceid', 'prepare': add_price_inr,
+        'columns': {
+            'PriceID': 'priceid',
+            'Price': 'price',
+            'Price_INR': 'price_inr',
+            'Price_per_SQFT': 'price_per_sqft',
+            'PropertyID': 'propertyid'
+        },
+        'integer': ['priceid', 'price_inr', 'propertyid'],
+        'numeric': ['price_per_sqft']
+    }
+]
+
+# Foreign keys, added once the tables are loaded so COPY does not check every row (see
+# sources.bulk_load.add_foreign_keys)
+FOREIGN_KEYS = [
+    {'table': 'properties', 'column': 'locationid', 'parent': 'location', 'key': 'locationid'},
+    {'table': 'features', 'column': 'propertyid', 'parent': 'properties', 'key': 'propertyid'},
+    {'table': 'pricing', 'column': 'propertyid', 'parent': 'properties', 'key': 'propertyid'}
+]
+
 # Populate Data Function
 def populate_source_3(conn):
-    # Using get_file_path to construct paths dynamically and validate their existence
-    features_path = get_file_path( 'normalized', 'features.csv')
-    location_path = get_file_path('normalized', 'location.csv')
-    pricing_path = get_file_path( 'normalized', 'pricing.csv')
-    properties_path = get_file_path('normalized', 'properties.csv')
-    
-    # Load data from CSV files
-    features_df = pd.read_csv(features_path)
-    location_df = pd.read_csv(location_path)
-    pricing_df = pd.read_csv(pricing_path)
-    properties_df = pd.read_csv(properties_path)
-
-    with conn.cursor() as cur:
-        for _, row in location_df.iterrows():
-            cur.execute("INSERT INTO location (LocationID, Location) VALUES (%s, %s)", (int(row['LocationID']) if not pd.isna(row['LocationID']) else None, row['Location']))
+    # Using get_file_path to construct paths dynamically and validate their existence,
+    # then stream each table in with COPY
+    return load_tables(conn, TABLE_SPECS, lambda file_name: get_file_path('normalized', file_name))
 
-        for _, row in properties_df.iterrows():
-            cur.execute("""
-                INSERT INTO properties (PropertyID, Name, Title, Description, LocationID, Total_Area)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (int(row['PropertyID']) if not pd.isna(row['PropertyID']) else None, row['Name'], row['Title'], row['Description'], int(row['LocationID']) if not pd.isna(row['LocationID']) else None, float(row['Total_Area']) if not pd.isna(row['Total_Area']) else None))
-
-        for _, row in features_df.iterrows():
-            cur.execute("INSERT INTO features (FeatureID, Baths, Balcony, PropertyID) VALUES (%s, %s, %s, %s)", (int(row['FeatureID']) if not pd.isna(row['FeatureID']) else None, int(row['Baths']) if not pd.isna(row['Baths']) else None, bool(row['Balcony']) if not pd.isna(row['Balcony']) else None, int(row['PropertyID']) if not pd.isna(row['PropertyID']) else None))
-
-        for _, row in pricing_df.iterrows():
-            cur.execute("INSERT INTO pricing (PriceID, Price, Price_per_SQFT, PropertyID) VALUES (%s, %s, %s, %s)", (int(row['PriceID']) if not pd.isna(row['PriceID']) else None, row['Price'], float(row['Price_per_SQFT']) if not pd.isna(row['Price_per_SQFT']) else None, int(row['PropertyID']) if not pd.isna(row['PropertyID']) else None))
-
-        conn.commit()
+# Refresh Data Function: apply only the rows that were added, changed or removed since the last load
+def refresh_source_3(conn):
+    return upsert_tables(conn, TABLE_SPECS, lambda file_name: get_file_path('normalized', file_name))
 
 # Database connection details
 dbname = "real_estate_db_source_3"
@@ -124,32 +172,54 @@ password = "admin"
 host = "localhost"
 port = "5432"
 
-# Connect to default postgres database to create new database
-conn = psycopg2.connect(
-    dbname="postgres",
-    user=user,
-    password=password,
-    host=host,
-    port=port
-)
-conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-
-try:
-    create_database(conn, dbname)
-finally:
-    conn.close()
-
-# Connect to newly created database
-conn = psycopg2.connect(
-    dbname=dbname,
-    user=user,
-    password=password,
-    host=host,
-    port=port
-)
-
-try:
-    create_tables(conn)
-    populate_source_3(conn)
-finally:
-    conn.close()
+def connect(database):
+    return psycopg2.connect(
+        dbname=database,
+        user=user,
+        password=password,
+        host=host,
+        port=port
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the normalised source 3 tables into PostgreSQL")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Upsert the normalised files into the existing database instead of recreating it")
+    parser.add_argument('--yes', action='store_true',
+                        help="Drop an existing database without asking for confirmation")
+    args = parser.parse_args()
+
+    # Connect to default postgres database to create new database
+    conn = connect("postgres")
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+    try:
+        created = create_database(conn, dbname, replace=not args.incremental, confirm=not args.yes)
+    finally:
+        conn.close()
+
+    # Connect to newly created database
+    conn = connect(dbname)
+
+    try:
+        if created:
+            create_tables(conn)
+            populate_source_3(conn)
+            add_foreign_keys(conn, FOREIGN_KEYS)
+        else:
+            # The mediator keeps serving the previous rows until the refresh commits
+            refresh_source_3(conn)
+        # Secondary indexes are built once the data is in, which is faster than maintaining them row by row
+        create_indexes(conn, 'source_3')
+        # Searches cached by the mediator still hold the old rows
+        invalidate_source('source_3')
+        # Re-cluster listings across sources so the mediator's duplicate lookup sees the new data
+        try:
+            run_linkage() if created else update_linkage()
+        except Exception as e:
+            print(f"Entity resolution skipped: {e}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from sources.bulk_load import add_foreign_keys, load_tables_parallel, upsert_tables
+from sources.cache import STATE_DIR, invalidate_source
+from sources.columnar import columnar_dir, has_table
+from sources.entity_resolution import run_linkage, update_linkage
+from sources.indexes import create_indexes
+
+ROOT = Path(__file__).resolve().parent
+
+# Key of every stage's last successful run; a stage whose key is unchanged is skipped
+STATE_PATH = os.path.join(STATE_DIR, 'ingest_state.json')
+
+# Raw feed, normaliser and database loader of each source
+SOURCES = {
+    'source_2': {
+        'raw': 'data/source 2/Indian_Real_Estate_Clean_Data.csv',
+        'normaliser': 'normalise_source_2.py',
+        'directory': 'data/source 2'
+    },
+    'source_3': {
+        'raw': 'data/source 3/Real Estate Data V21.csv',
+        'normaliser': 'normalise_source_3.py',
+        'directory': 'data/source 3'
+    }
+}
+
+# Shared code each stage runs, so changing it reruns the stage
+STAGE_CODE = {
+    'normalise': ['sources/keymaps.py', 'sources/field_types.py', 'sources/price_parsing.py',
+                  'sources/columnar.py', 'sources/verification.py'],
+    'load': ['sources/bulk_load.py', 'sources/columnar.py', 'sources/field_types.py'],
+    'index': ['sources/indexes.py'],
+    'analyse': [],
+    'linkage': ['sources/entity_resolution.py', 'sources/comparison.py', 'sources/blocking.py']
+}
+
+# Per-source stages in dependency order
+SOURCE_STAGES = ['normalise', 'load', 'index', 'analyse']
+
+
+def populate_module(source_name):
+    # The populate scripts live in directories with spaces in their names, so import them by path
+    path = ROOT / SOURCES[source_name]['directory'] / 'populate.py'
+    spec = importlib.util.spec_from_file_location(f'populate_{source_name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def normalized_path(source_name, file_name):
+    return ROOT / SOURCES[source_name]['directory'] / 'normalized' / file_name
+
+
+def database_exists(populate):
+    conn = populate.connect('postgres')
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (populate.dbname,))
+            return cur.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def normalise(source_name, options):
+    command = [sys.executable, SOURCES[source_name]['normaliser'], '--format', options['format']]
+    if options['chunk_rows']:
+        command += ['--chunk-rows', str(options['chunk_rows'])]
+    if options['skip_verify']:
+        command.append('--skip-verify')
+    # The normalisers resolve their data paths relative to the repository root
+    subprocess.run(command, cwd=ROOT, check=True)
+    return options['format']
+
+
+def load(source_name, options):
+    populate = populate_module(source_name)
+    path_for = lambda file_name: normalized_path(source_name, file_name)
+
+    if options['incremental'] and database_exists(populate):
+        conn = populate.connect(populate.dbname)
+        try:
+            upsert_tables(conn, populate.TABLE_SPECS, path_for)
+        finally:
+            conn.close()
+        invalidate_source(source_name)
+        return 'incremental'
+
+    admin = populate.connect('postgres')
+    admin.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        populate.create_database(admin, populate.dbname, replace=True, confirm=False)
+    finally:
+        admin.close()
+    conn = populate.connect(populate.dbname)
+    try:
+        populate.create_tables(conn)
+        # Without foreign keys no table waits for another, so every table loads at once
+        load_tables_parallel(lambda: populate.connect(populate.dbname), populate.TABLE_SPECS, path_for,
+                             workers=options['table_workers'])
+        add_foreign_keys(conn, populate.FOREIGN_KEYS)
+    finally:
+        conn.close()
+    invalidate_source(source_name)
+    return 'full'
+
+
+def index(source_name, options):
+    populate = populate_module(source_name)
+    conn = populate.connect(populate.dbname)
+    try:
+        create_indexes(conn, source_name)
+    finally:
+        conn.close()
+    return None
+
+
+def analyse(source_name, options):
+    # VACUUM sets the visibility map after the bulk load, so index-only scans need no heap visits
+    populate = populate_module(source_name)
+    conn = populate.connect(populate.dbname)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cur:
+            for spec in populate.TABLE_SPECS:
+                cur.execute(sql.SQL("VACUUM (ANALYZE) {}").format(sql.Identifier(spec['table'])))
+    finally:
+        conn.close()
+    return None
+
+
+def linkage(source_name, options):
+    if options['incremental']:
+        update_linkage()
+        return 'incremental'
+    run_linkage()
+    return 'full'
+
+
+STAGES = {
+    'normalise': normalise,
+    'load': load,
+    'index': index,
+    'analyse': analyse,
+    'linkage': linkage
+}
+
+
+def run_stage(stage, source_name, options):
+    """Run one stage in a worker process; returns (seconds, detail, error)."""
+    started = time.monotonic()
+    try:
+        detail = STAGES[stage](source_name, options)
+        return time.monotonic() - started, detail, None
+    except Exception:
+        return time.monotonic() - started, None, traceback.format_exc()
+
+
+def stage_inputs(stage, source_name):
+    # Files whose content decides whether a stage has to run again
+    paths = [ROOT / path for path in STAGE_CODE[stage]]
+    if stage == 'normalise':
+        paths += [ROOT / SOURCES[source_name]['raw'], ROOT / SOURCES[source_name]['normaliser']]
+    elif stage == 'load':
+        directory = ROOT / SOURCES[source_name]['directory']
+        paths += [directory / 'normalized', directory / 'populate.py']
+    return paths
+
+
+def content_hash(paths, upstream, settings):
+    digest = hashlib.sha256(json.dumps([upstream, settings], sort_keys=True).encode())
+    for path in paths:
+        files = sorted(file for file in path.rglob('*') if file.is_file()) if path.is_dir() else [path]
+        for file in files:
+            digest.update(str(file.relative_to(ROOT)).encode())
+            if not file.exists():
+                digest.update(b'missing')
+                continue
+            with open(file, 'rb') as content:
+                for block in iter(lambda: content.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def outputs_present(stage, source_name):
+    # A stage is only skipped when what it produced is still there
+    if stage == 'linkage':
+        return True
+    populate = populate_module(source_name)
+    if stage == 'normalise':
+        return all(
+            normalized_path(source_name, spec['file']).exists()
+            or has_table(columnar_dir(normalized_path(source_name, spec['file'])))
+            for spec in populate.TABLE_SPECS
+        )
+    return database_exists(populate)
+
+
+def build_tasks(source_names):
+    """The ingestion DAG: normalise -> load -> index -> analyse per source, then cross-source linkage."""
+    tasks = {}
+    for source_name in source_names:
+        previous = None
+        for stage in SOURCE_STAGES:
+            name = f'{source_name}:{stage}'
+            tasks[name] = {'stage': stage, 'source': source_name, 'needs': [previous] if previous else []}
+            previous = name
+    tasks['linkage'] = {'stage': 'linkage', 'source': None,
+                        'needs': [f'{source_name}:analyse' for source_name in source_names]}
+    return tasks
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as state_file:
+        return json.load(state_file)
+
+
+def save_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(STATE_PATH + '.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(STATE_PATH + '.tmp', STATE_PATH)
+
+
+def run(tasks, options, workers):
+    """Run every task once its dependencies are done, independent ones in parallel processes.
+
+    Returns ``{task: (status, seconds, detail)}``.
+    """
+    state = load_state()
+    keys, results = {}, {}
+    pending, running = dict(tasks), {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name, task in list(pending.items()):
+                    needs = task['needs']
+                    if any(results.get(need, ('',))[0] in ('failed', 'blocked') for need in needs):
+                        results[name] = ('blocked', 0.0, None)
+                    elif all(results.get(need, ('',))[0] in ('ran', 'unchanged') for need in needs):
+                        settings = {key: options[key] for key in ('format', 'chunk_rows')} \
+                            if task['stage'] == 'normalise' else {}
+                        keys[name] = content_hash(stage_inputs(task['stage'], task['source']),
+                                                  [keys[need] for need in needs], settings)
+                        if (not options['force'] and state.get(name) == keys[name]
+                                and outputs_present(task['stage'], task['source'])):
+                            results[name] = ('unchanged', 0.0, None)
+                            print(f"[{name}] inputs unchanged, skipped")
+                        else:
+                            print(f"[{name}] started")
+                            running[executor.submit(run_stage, task['stage'], task['source'], options)] = name
+                    else:
+                        continue
+                    del pending[name]
+                    progressed = True
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                seconds, detail, error = future.result()
+                if error:
+                    results[name] = ('failed', seconds, None)
+                    print(f"[{name}] failed after {seconds:.2f}s\n{error}")
+                    continue
+                results[name] = ('ran', seconds, detail)
+                state[name] = keys[name]
+                save_state(state)
+                print(f"[{name}] done in {seconds:.2f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Normalise, load, index and analyse every source, independent stages in parallel")
+    parser.add_argument('--sources', default=','.join(SOURCES),
+                        help="Comma-separated sources to ingest")
+    parser.add_argument('--format', choices=['csv', 'columnar', 'both'], default='csv',
+                        help="Output format of the normalisers")
+    parser.add_argument('--chunk-rows', type=int,
+                        help="Stream the raw feeds through the normalisers in chunks of this many rows")
+    parser.add_argument('--skip-verify', action='store_true',
+                        help="Do not verify the normalised tables against the raw feeds")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Upsert into the existing databases instead of recreating them")
+    parser.add_argument('--force', action='store_true',
+                        help="Run every stage, even those whose inputs are unchanged")
+    parser.add_argument('--workers', type=int,
+                        help="Stages run at the same time (default: one per source)")
+    parser.add_argument('--table-workers', type=int,
+                        help="Tables of one source loaded at the same time (default: all)")
+    args = parser.parse_args()
+
+    source_names = [name for name in args.sources.split(',') if name]
+    unknown = [name for name in source_names if name not in SOURCES]
+    if unknown:
+        parser.error(f"unknown sources: {', '.join(unknown)}")
+
+    options = {
+        'format': args.format,
+        'chunk_rows': args.chunk_rows,
+        'skip_verify': args.skip_verify,
+        'incremental': args.incremental,
+        'force': args.force,
+        'table_workers': args.table_workers
+    }
+    started = time.monotonic()
+    results = run(build_tasks(source_names), options, args.workers or len(source_names))
+
+    print("\nStage timings:")
+    print("-" * 30)
+    for name, (status, seconds, detail) in results.items():
+        print(f"{name:<20} {status:<10} {seconds:8.2f}s{f'  ({detail})' if detail else ''}")
+    print(f"Total: {time.monotonic() - started:.2f}s")
+    if any(status in ('failed', 'blocked') for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
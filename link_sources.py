@@ -0,0 +1,20 @@
+import argparse
+
+from sources.entity_resolution import run_linkage, update_linkage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Link listings across sources and store their clusters")
+    parser.add_argument('--full', action='store_true',
+                        help="Relink every listing instead of only those added or removed since the last run")
+    args = parser.parse_args()
+
+    if args.full:
+        run_linkage()
+    else:
+        # Falls back to a full run when there is no usable linkage index yet
+        update_linkage()
+
+
+if __name__ == "__main__":
+    main()
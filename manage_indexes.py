@@ -0,0 +1,42 @@
+import argparse
+
+import psycopg2
+
+from sources import CONNECTION_PARAMS
+from sources.indexes import KEYSET_INDEXES, create_indexes, drop_indexes, verify_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, drop or verify the secondary indexes of each source")
+    parser.add_argument('command', choices=['create', 'drop', 'verify'])
+    parser.add_argument('--source', choices=sorted(CONNECTION_PARAMS), action='append',
+                        help="Source to work on (repeatable, defaults to all)")
+    args = parser.parse_args()
+
+    for source_name in args.source or sorted(CONNECTION_PARAMS):
+        conn = psycopg2.connect(**CONNECTION_PARAMS[source_name])
+        try:
+            print(f"\n{source_name}")
+            print("-" * 30)
+            if args.command == 'create':
+                create_indexes(conn, source_name)
+            elif args.command == 'drop':
+                drop_indexes(conn, source_name)
+                print("Indexes dropped.")
+            else:
+                report = verify_indexes(conn, source_name)
+                if report['missing']:
+                    print(f"Missing indexes: {', '.join(report['missing'])}")
+                for shape_name, plan in report['query_shapes'].items():
+                    indexes = ', '.join(plan['indexes']) or 'none'
+                    seq_scans = ', '.join(plan['seq_scans']) or 'none'
+                    print(f"{shape_name}: indexes={indexes}; seq scans={seq_scans}")
+                if not report['keyset_index_used']:
+                    print(f"Warning: keyset pages do not use {KEYSET_INDEXES[source_name]}; "
+                          f"deep pages sort every matching row")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
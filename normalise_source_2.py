@@ -1,82 +1,104 @@
+import argparse
+import os
 import pandas as pd
-import numpy as np
 from pathlib import Path
+from sources.cache import STATE_DIR
+from sources.columnar import columnar_dir, write_table
+from sources.keymaps import CHUNK_ROWS, KeyMapStore, RowIdStore, append_csv, build_dimension
+from sources.verification import print_report, verify
+
+# Columns kept from the raw feed
+REQUIRED_COLUMNS = [
+    'Property_Name',
+    'Property Title',
+    'Price',
+    'Location',
+    'Total_Area(SQFT)',
+    'Price_per_SQFT',
+    'Description',
+    'Total_Rooms',
+    'Balcony',
+    'city',
+    'property_type',
+    'BHK'
+]
+
+# Columns of the fact table: ALL original attributes plus the generated IDs
+FACT_COLUMNS = [
+    'Property_Name',
+    'Property Title',
+    'Price',
+    'Total_Area(SQFT)',
+    'Price_per_SQFT',
+    'property_type_id',
+    'location_id',
+    'room_config_id',
+    'Location',
+    'Balcony',
+    'Description',
+    'Total_Rooms',
+    'BHK',
+    'city',
+    'property_type'
+]
+
+# Repeated text columns, held as pandas categories in memory
+CATEGORY_COLUMNS = ['Location', 'city', 'property_type']
+
+# Whole counts with missing values, read as nullable integers rather than float64
+INTEGER_COLUMNS = ['Total_Rooms', 'BHK']
+
+# Dtypes the raw feed is read with
+READ_DTYPES = {**{column: 'category' for column in CATEGORY_COLUMNS},
+               **{column: 'Int64' for column in INTEGER_COLUMNS}}
+
+# Key maps and row counters of the streaming normaliser, kept for --append runs
+KEYMAP_STATE = os.path.join(STATE_DIR, 'normalise_source_2.pickle')
+
+# property_id of every listing by name and location (not its title or price, which a listing can
+# change). Kept across every run, so a listing keeps its id when the feed is reordered and
+# incremental loads and linkage match rows by identity; on disk, so memory stays bounded
+PROPERTY_KEY = ['Property_Name', 'Location', 'city']
+PROPERTY_ID_STATE = os.path.join(STATE_DIR, 'source_2_property_ids.sqlite')
+
+def property_id_store():
+    return RowIdStore(PROPERTY_ID_STATE, PROPERTY_KEY)
 
 def create_directory_structure(base_dir):
     (base_dir / "normalized").mkdir(parents=True, exist_ok=True)
 
-def normalize_real_estate_data(input_file_path):
-    # Read data
-    df = pd.read_csv(input_file_path)
+def normalize_real_estate_data(input_file_path, listing_ids):
+    # Read data, with the repeated text columns as categories and the room counts as Int64
+    df = pd.read_csv(input_file_path, usecols=REQUIRED_COLUMNS, dtype=READ_DTYPES)
     print(f"Initial data rows: {len(df)}")
     
     # Keep ALL original columns
-    required_columns = [
-        'Property_Name',
-        'Property Title',
-        'Price',
-        'Location',
-        'Total_Area(SQFT)',
-        'Price_per_SQFT',
-        'Description',
-        'Total_Rooms',
-        'Balcony',
-        'city',
-        'property_type',
-        'BHK'
-    ]
-    
-    df_cleaned = df[required_columns]
-    print(f"After selecting required columns: {len(df_cleaned)} rows")
-    
-    # Create dimension tables
-    dim_property_types = df_cleaned[['property_type']].drop_duplicates()
-    dim_property_types['property_type_id'] = range(1, len(dim_property_types) + 1)
+    df_cleaned = df[REQUIRED_COLUMNS]
     
-    dim_cities = df_cleaned[['city']].drop_duplicates()
-    dim_cities['city_id'] = range(1, len(dim_cities) + 1)
+    # Create dimension tables: one factorize pass per (composite) natural key
+    # yields both the dimension rows and every fact row's surrogate id
+    property_type_ids, dim_property_types = build_dimension(df_cleaned, ['property_type'], 'property_type_id')
+    city_ids, dim_cities = build_dimension(df_cleaned, ['city'], 'city_id')
     
-    dim_locations = df_cleaned[['Location', 'city']].drop_duplicates()
-    dim_locations = dim_locations.merge(dim_cities, on='city', how='left')
-    dim_locations['location_id'] = range(1, len(dim_locations) + 1)
+    # A location is a name within a city; the same name in two cities is two locations
+    location_ids, dim_locations = build_dimension(
+        df_cleaned[['Location']].assign(city_id=city_ids), ['Location', 'city_id'], 'location_id')
     dim_locations = dim_locations[['location_id', 'Location', 'city_id']]
     
-    dim_rooms = df_cleaned[['Total_Rooms', 'BHK']].drop_duplicates()
-    dim_rooms['room_config_id'] = range(1, len(dim_rooms) + 1)
+    room_config_ids, dim_rooms = build_dimension(df_cleaned, ['Total_Rooms', 'BHK'], 'room_config_id')
     
     # Create fact table with ALL original attributes
-    fact_properties = df_cleaned.merge(
-        dim_property_types, on='property_type', how='left'
-    ).merge(
-        dim_locations[['location_id', 'Location']], on='Location', how='left'
-    ).merge(
-        dim_rooms, on=['Total_Rooms', 'BHK'], how='left'
+    fact_properties = df_cleaned.assign(
+        property_type_id=property_type_ids,
+        location_id=location_ids,
+        room_config_id=room_config_ids
     )
     
     # Include ALL original columns plus the generated IDs
-    fact_columns = [
-        'Property_Name',
-        'Property Title',
-        'Price',
-        'Total_Area(SQFT)',
-        'Price_per_SQFT',
-        'property_type_id',
-        'location_id',
-        'room_config_id',
-        'Location',
-        'Balcony',
-        'Description',
-        'Total_Rooms',
-        'BHK',
-        'city',
-        'property_type'
-    ]
-    
-    fact_properties = fact_properties[fact_columns]
-    fact_properties['property_id'] = range(1, len(fact_properties) + 1)
+    fact_properties = fact_properties[FACT_COLUMNS]
+    fact_properties['property_id'] = listing_ids.assign(df_cleaned)
     
     return {
-        'original_data': df_cleaned,
         'dim_property_types': dim_property_types,
         'dim_cities': dim_cities,
         'dim_locations': dim_locations,
@@ -84,131 +106,186 @@ def normalize_real_estate_data(input_file_path):
         'fact_properties': fact_properties
     }
 
-def test_normalization(tables):
-    test_results = {}
-    
-    # Basic validation tests
-    test_results['row_count_match'] = len(tables['original_data']) == len(tables['fact_properties'])
-    test_results['no_missing_foreign_keys'] = not any([
-        tables['fact_properties']['property_type_id'].isnull().any(),
-        tables['fact_properties']['location_id'].isnull().any(),
-        tables['fact_properties']['room_config_id'].isnull().any()
-    ])
-    test_results['no_duplicate_keys'] = all([
-        len(tables['dim_property_types']['property_type_id']) == 
-            len(tables['dim_property_types']['property_type_id'].unique()),
-        len(tables['dim_cities']['city_id']) == 
-            len(tables['dim_cities']['city_id'].unique()),
-        len(tables['dim_locations']['location_id']) == 
-            len(tables['dim_locations']['location_id'].unique()),
-        len(tables['dim_rooms']['room_config_id']) == 
-            len(tables['dim_rooms']['room_config_id'].unique())
-    ])
-    
-    try:
-        # Use fact_properties directly since it already contains all needed columns
-        reconstructed_data = tables['fact_properties']
-        
-        compare_columns = [
-            'Property_Name',
-            'Property Title',
-            'Price',
-            'Location',
-            'Total_Area(SQFT)',
-            'Price_per_SQFT',
-            'Description',
-            'Total_Rooms',
-            'Balcony',
-            'city',
-            'property_type',
-            'BHK'
-        ]
-        
-        # Sample with consistent indices
-        sample_size = min(10, len(tables['original_data']))
-        sample_properties = np.random.choice(
-            tables['original_data']['Property_Name'].unique(), 
-            sample_size, 
-            replace=False
-        )
-        
-        original_samples = tables['original_data'][
-            tables['original_data']['Property_Name'].isin(sample_properties)
-        ].sort_values('Property_Name')[compare_columns]
-        
-        reconstructed_samples = reconstructed_data[
-            reconstructed_data['Property_Name'].isin(sample_properties)
-        ].sort_values('Property_Name')[compare_columns]
-        
-        # Compare attributes with aligned samples
-        attributes_match = all([
-            set(original_samples['Property_Name']) == set(reconstructed_samples['Property_Name']),
-            set(original_samples['Location']) == set(reconstructed_samples['Location']),
-            set(original_samples['property_type']) == set(reconstructed_samples['property_type']),
-            np.array_equal(
-                original_samples['Price'].fillna(0).values,
-                reconstructed_samples['Price'].fillna(0).values
-            )
-        ])
-        
-        test_results['data_consistency'] = attributes_match
-        
-    except Exception as e:
-        print(f"Error during reconstruction: {str(e)}")
-        print("Original shape:", original_samples.shape if 'original_samples' in locals() else 'Not created')
-        print("Reconstructed shape:", reconstructed_samples.shape if 'reconstructed_samples' in locals() else 'Not created')
-        test_results['data_consistency'] = False
-    
-    return test_results
+# Content and foreign key checks run against the saved tables (see sources.verification).
+# The fact table keeps a copy of every raw column, and its dimension ids must lead
+# back to the same property type, location, city and room configuration.
+VERIFY_CHECKS = {
+    'tables': [
+        {
+            'table': 'properties', 'file': 'properties.csv', 'key': 'property_id', 'raw_key': 'property_id',
+            'joins': [
+                {'file': 'property_types.csv', 'on': 'property_type_id',
+                 'columns': {'property_type': 'dim_property_type'}},
+                {'file': 'locations.csv', 'on': 'location_id',
+                 'columns': {'Location': 'dim_location', 'city_id': 'dim_city_id'}},
+                {'file': 'cities.csv', 'on': 'dim_city_id', 'key': 'city_id', 'columns': {'city': 'dim_city'}},
+                {'file': 'rooms.csv', 'on': 'room_config_id',
+                 'columns': {'Total_Rooms': 'dim_total_rooms', 'BHK': 'dim_bhk'}}
+            ],
+            'compare': [(column, column) for column in REQUIRED_COLUMNS] + [
+                ('property_type', 'dim_property_type'),
+                ('Location', 'dim_location'),
+                ('city', 'dim_city'),
+                ('Total_Rooms', 'dim_total_rooms'),
+                ('BHK', 'dim_bhk')
+            ],
+            'numeric': ['Price', 'Total_Area(SQFT)', 'Price_per_SQFT', 'Total_Rooms', 'BHK']
+        }
+    ],
+    'foreign_keys': [
+        {'table': 'properties', 'file': 'properties.csv', 'column': 'property_type_id',
+         'parent': 'property_types.csv', 'key': 'property_type_id'},
+        {'table': 'properties', 'file': 'properties.csv', 'column': 'location_id',
+         'parent': 'locations.csv', 'key': 'location_id'},
+        {'table': 'properties', 'file': 'properties.csv', 'column': 'room_config_id',
+         'parent': 'rooms.csv', 'key': 'room_config_id'},
+        {'table': 'locations', 'file': 'locations.csv', 'column': 'city_id',
+         'parent': 'cities.csv', 'key': 'city_id'}
+    ]
+}
+
+def verify_normalization(input_file_path, base_dir, chunk_rows=CHUNK_ROWS):
+    """Stream the raw feed and the saved tables through every check; returns True when all pass"""
+    def raw_chunks():
+        # Each raw row with the property_id it was saved under
+        listing_ids = property_id_store()
+        try:
+            listing_ids.start_feed()
+            for chunk in pd.read_csv(input_file_path, usecols=REQUIRED_COLUMNS, chunksize=chunk_rows,
+                                     dtype={column: 'Int64' for column in INTEGER_COLUMNS}):
+                chunk['property_id'] = listing_ids.assign(chunk)
+                yield chunk
+        finally:
+            listing_ids.close()
+
+    report = verify(VERIFY_CHECKS, raw_chunks, lambda file_name: base_dir / "normalized" / file_name, chunk_rows)
+    return print_report(report)
     
-def save_normalized_tables(tables, base_dir):
-    """Save normalized tables to CSV files"""
+# Output file of each table
+TABLE_FILES = {
+    'dim_property_types': 'property_types.csv',
+    'dim_cities': 'cities.csv',
+    'dim_locations': 'locations.csv',
+    'dim_rooms': 'rooms.csv',
+    'fact_properties': 'properties.csv'
+}
+
+def save_normalized_tables(tables, base_dir, output_format='csv'):
+    """Save normalized tables as CSV files, typed columnar tables (normalized/columnar/), or both"""
     # Create directory if it doesn't exist
     normalized_dir = base_dir / "normalized"
     normalized_dir.mkdir(parents=True, exist_ok=True)
     
-    # Save dimension tables
-    tables['dim_property_types'].to_csv(normalized_dir / 'property_types.csv', index=False)
-    tables['dim_cities'].to_csv(normalized_dir / 'cities.csv', index=False)
-    tables['dim_locations'].to_csv(normalized_dir / 'locations.csv', index=False)
-    tables['dim_rooms'].to_csv(normalized_dir / 'rooms.csv', index=False)
-    
-    # Save fact table
-    tables['fact_properties'].to_csv(normalized_dir / 'properties.csv', index=False)
-    
     print("\nTables saved successfully:")
     print("-" * 30)
-    print("property_types.csv")
-    print("cities.csv") 
-    print("locations.csv")
-    print("rooms.csv")
-    print("properties.csv")
+    for table_name, file_name in TABLE_FILES.items():
+        if output_format in ('csv', 'both'):
+            tables[table_name].to_csv(normalized_dir / file_name, index=False)
+            print(file_name)
+        if output_format in ('columnar', 'both'):
+            write_table(tables[table_name], columnar_dir(normalized_dir / file_name))
+            print(f"columnar/{columnar_dir(normalized_dir / file_name).name}/")
+
+def normalize_in_chunks(input_file_path, base_dir, chunk_rows=CHUNK_ROWS, append=False):
+    """Normalise a feed of any size, chunk_rows raw rows at a time.
+
+    Surrogate keys come from persistent key maps (property ids from the
+    on-disk listing id store, see property_id_store), and each chunk's fact
+    rows and newly seen dimension rows are appended to the output files, so
+    memory is bounded by the chunk size plus the dimension key maps, one
+    entry per distinct property type, city, location and room
+    configuration. Locations are keyed on
+    (Location, city). With append=True the key maps of the previous run are
+    reused and its output files are extended instead of replaced.
+    """
+    normalized_dir = base_dir / "normalized"
+    normalized_dir.mkdir(parents=True, exist_ok=True)
+    files = {
+        'property_types': normalized_dir / 'property_types.csv',
+        'cities': normalized_dir / 'cities.csv',
+        'locations': normalized_dir / 'locations.csv',
+        'rooms': normalized_dir / 'rooms.csv',
+        'properties': normalized_dir / 'properties.csv'
+    }
+    if not append:
+        for path in files.values():
+            path.unlink(missing_ok=True)
+        if os.path.exists(KEYMAP_STATE):
+            os.remove(KEYMAP_STATE)
+
+    store = KeyMapStore.load(KEYMAP_STATE)
+    property_types = store.keymap('property_types', ['property_type'], 'property_type_id')
+    cities = store.keymap('cities', ['city'], 'city_id')
+    locations = store.keymap('locations', ['Location', 'city_id'], 'location_id')
+    rooms = store.keymap('rooms', ['Total_Rooms', 'BHK'], 'room_config_id')
+    listing_ids = property_id_store()
+    if not append:
+        listing_ids.start_feed()
+
+    total = 0
+    for chunk in pd.read_csv(input_file_path, usecols=REQUIRED_COLUMNS, chunksize=chunk_rows,
+                             dtype={column: 'Int64' for column in INTEGER_COLUMNS}):
+        chunk = chunk[REQUIRED_COLUMNS].copy()
+        chunk['property_type_id'], new_property_types = property_types.assign(chunk)
+        chunk['city_id'], new_cities = cities.assign(chunk)
+        chunk['location_id'], new_locations = locations.assign(chunk)
+        chunk['room_config_id'], new_rooms = rooms.assign(chunk)
+        chunk['property_id'] = listing_ids.assign(chunk)
+
+        append_csv(new_property_types, files['property_types'])
+        append_csv(new_cities, files['cities'])
+        append_csv(new_locations[['location_id', 'Location', 'city_id']], files['locations'])
+        append_csv(new_rooms, files['rooms'])
+        append_csv(chunk[FACT_COLUMNS + ['property_id']], files['properties'])
+        total += len(chunk)
+        print(f"Normalised {total} rows")
+
+    # Saved last, so an interrupted run can simply be repeated without --append
+    store.save()
+    listing_ids.close()
+    print("\nData Statistics:")
+    print("-" * 30)
+    for name, keymap in store.maps.items():
+        print(f"{name}: {len(keymap)} rows")
+    print(f"properties: {total} rows")
 
 def main():
+    parser = argparse.ArgumentParser(description="Normalise the source 2 feed into dimension and fact tables")
+    parser.add_argument('--chunk-rows', type=int,
+                        help="Stream the feed in chunks of this many rows instead of loading it whole")
+    parser.add_argument('--append', action='store_true',
+                        help="With --chunk-rows, extend the previous output instead of replacing it")
+    parser.add_argument('--format', choices=['csv', 'columnar', 'both'], default='csv',
+                        help="Output format of the in-memory normaliser (chunked runs always write CSV)")
+    parser.add_argument('--skip-verify', action='store_true',
+                        help="Do not verify the saved tables against the raw feed")
+    args = parser.parse_args()
+
     base_dir = Path("data/source 2")
     input_file_path = base_dir / "Indian_Real_Estate_Clean_Data.csv"
-    
-    # Run normalization
-    tables = normalize_real_estate_data(input_file_path)
-    
-    # Run tests
-    test_results = test_normalization(tables)
-    save_normalized_tables(tables, base_dir)
 
-    
-    # Display results
-    print("\nNormalization Test Results:")
-    print("-" * 30)
-    for test_name, result in test_results.items():
-        print(f"{test_name}: {'✓ Passed' if result else '✗ Failed'}")
-    
-    if not all(test_results.values()):
-        print("\nWarning: Some tests failed. Please review the normalization process.")
-    
-    print("\nData Statistics:")
-    print("-" * 30)
-    for table_name, table in tables.items():
-        print(f"{table_name}: {len(table)} rows")
+    if args.chunk_rows:
+        normalize_in_chunks(input_file_path, base_dir, args.chunk_rows, args.append)
+    else:
+        # Run normalization
+        listing_ids = property_id_store()
+        listing_ids.start_feed()
+        tables = normalize_real_estate_data(input_file_path, listing_ids)
+        save_normalized_tables(tables, base_dir, args.format)
+        listing_ids.close()
+
+        print("\nData Statistics:")
+        print("-" * 30)
+        for table_name, table in tables.items():
+            print(f"{table_name}: {len(table)} rows")
+        # The saved tables are verified from disk, so the frames can go first
+        del tables
+
+    # Appended output also holds earlier feeds, which this feed cannot account for
+    if args.skip_verify or args.append:
+        return
+    if not verify_normalization(input_file_path, base_dir, args.chunk_rows or CHUNK_ROWS):
+        print("\nWarning: Some checks failed. Please review the normalization process.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
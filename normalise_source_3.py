@@ -1,68 +1,274 @@
+import argparse
 import pandas as pd
 import os
 from pathlib import Path
+from sources.cache import STATE_DIR
+from sources.columnar import columnar_dir, write_table
+from sources.field_types import parse_failures, to_nullable_bool, to_small_int
+from sources.keymaps import CHUNK_ROWS, KeyMapStore, RowIdStore, append_csv, build_dimension
+from sources.price_parsing import parse_price_inr
+from sources.verification import print_report, verify
 
 # Define the base directory
 base_dir = Path('data/source 3')
+csv_file = base_dir / 'Real Estate Data V21.csv'
 
-# Ensure the directory exists
-output_dir = base_dir / 'normalized'
-output_dir.mkdir(parents=True, exist_ok=True)
+# Output file of each table
+TABLE_FILES = {
+    'properties': 'properties.csv',
+    'pricing': 'pricing.csv',
+    'location': 'location.csv',
+    'features': 'features.csv'
+}
 
-# Read the CSV file
-csv_file = base_dir / 'Real Estate Data V21.csv'
-df = pd.read_csv(csv_file)
-
-# Create Properties DataFrame
-properties_df = df[['Name', 'Property Title', 'Description', 'Location', 'Total_Area']].copy()
-properties_df['PropertyID'] = properties_df.index + 1
-
-# Create Pricing DataFrame
-pricing_df = df[['Price', 'Price_per_SQFT']].copy()
-pricing_df['PropertyID'] = properties_df['PropertyID']
-pricing_df['PriceID'] = pricing_df.index + 1
-
-# Create Location DataFrame
-location_df = df[['Location']].drop_duplicates().copy()
-location_df['LocationID'] = location_df.index + 1
-
-# Merge LocationID into Properties DataFrame
-properties_df = properties_df.merge(location_df, on='Location')
-properties_df = properties_df[['PropertyID', 'Name', 'Property Title', 'Description', 'LocationID', 'Total_Area']]
-
-# Create Features DataFrame
-features_df = df[['Baths', 'Balcony']].copy()
-features_df['PropertyID'] = properties_df['PropertyID']
-features_df['FeatureID'] = features_df.index + 1
-
-# Rename columns
-properties_df.columns = ['PropertyID', 'Name', 'Title', 'Description', 'LocationID', 'Total_Area']
-pricing_df.columns = ['Price', 'Price_per_SQFT', 'PropertyID', 'PriceID']
-location_df.columns = ['Location', 'LocationID']
-features_df.columns = ['Baths', 'Balcony', 'PropertyID', 'FeatureID']
-
-# Save to CSV files
-properties_df.to_csv(output_dir / 'properties.csv', index=False)
-pricing_df.to_csv(output_dir / 'pricing.csv', index=False)
-location_df.to_csv(output_dir / 'location.csv', index=False)
-features_df.to_csv(output_dir / 'features.csv', index=False)
-
-# Reconstruct the original table for verification
-reconstructed_df = properties_df.merge(location_df, on='LocationID')
-reconstructed_df = reconstructed_df.merge(pricing_df[['Price', 'Price_per_SQFT', 'PropertyID']], on='PropertyID')
-reconstructed_df = reconstructed_df.merge(features_df[['Baths', 'Balcony', 'PropertyID']], on='PropertyID')
-reconstructed_df = reconstructed_df[['Name', 'Title', 'Price', 'Location', 'Total_Area', 'Price_per_SQFT', 'Description', 'Baths', 'Balcony']]
-
-# Verify if the reconstruction matches the original DataFrame
-reconstructed_df.columns = ['Name', 'Property Title', 'Price', 'Location', 'Total_Area', 'Price_per_SQFT', 'Description', 'Baths', 'Balcony']
-if df.equals(reconstructed_df):
-    print("The conversion was correct.")
-else:
-    print("The conversion was incorrect.")
-    for column in df.columns:
-        if not df[column].equals(reconstructed_df[column]):
-            print(f"Mismatch found in column: {column}")
-            print("Original DataFrame:")
-            print(df[column].head())
-            print("Reconstructed DataFrame:")
-            print(reconstructed_df[column].head())
\ No newline at end of file
+# Raw values that failed typing, one row per (PropertyID, Column, Value)
+REJECT_FILE = 'rejects.csv'
+
+# Key maps and row counters of the streaming normaliser, kept for --append runs
+KEYMAP_STATE = os.path.join(STATE_DIR, 'normalise_source_3.pickle')
+
+# PropertyID of every listing by name and location (not its title or price, which a listing can
+# change). Kept across every run, so a listing keeps its id when the feed is reordered and
+# incremental loads and linkage match rows by identity; on disk, so memory stays bounded
+PROPERTY_KEY = ['Name', 'Location']
+PROPERTY_ID_STATE = os.path.join(STATE_DIR, 'source_3_property_ids.sqlite')
+
+def property_id_store():
+    return RowIdStore(PROPERTY_ID_STATE, PROPERTY_KEY)
+
+def type_fields(df):
+    """Type the text fields of the raw feed in vectorised passes.
+
+    Adds Price_INR (whole rupees, Int64) parsed from the Price text, which is
+    kept for display, maps Balcony Yes/No to a nullable boolean and
+    downcasts Baths to a small nullable integer. Returns the typed frame and
+    the values that did not parse (see sources.field_types.parse_failures).
+    """
+    price_inr = parse_price_inr(df['Price'])
+    baths = to_small_int(df['Baths'])
+    balcony = to_nullable_bool(df['Balcony'])
+    rejects = pd.concat([
+        parse_failures(df['Price'], price_inr, 'Price'),
+        parse_failures(df['Baths'], baths, 'Baths'),
+        parse_failures(df['Balcony'], balcony, 'Balcony')
+    ], ignore_index=True)
+    typed = df.assign(Price_INR=price_inr.values, Baths=baths.values, Balcony=balcony.values)
+    return typed, rejects
+
+def reject_rows(rejects, property_ids):
+    # Rows are positions in the frame that was typed
+    return pd.DataFrame({
+        'PropertyID': property_ids[rejects['Row'].to_numpy()],
+        'Column': rejects['Column'].values,
+        'Value': rejects['Value'].values
+    })
+
+def normalize_real_estate_data(df, listing_ids):
+    # Stable listing ids; a listing's pricing and features rows share its id
+    property_ids = listing_ids.assign(df)
+
+    # Create Location DataFrame and every listing's LocationID in one factorize pass
+    location_ids, location_df = build_dimension(df, ['Location'], 'LocationID')
+
+    # Create Properties DataFrame
+    properties_df = pd.DataFrame({
+        'PropertyID': property_ids,
+        'Name': df['Name'].values,
+        'Title': df['Property Title'].values,
+        'Description': df['Description'].values,
+        'LocationID': location_ids,
+        'Total_Area': df['Total_Area'].values
+    })
+
+    # Create Pricing DataFrame
+    pricing_df = pd.DataFrame({
+        'Price': df['Price'].values,
+        'Price_per_SQFT': df['Price_per_SQFT'].values,
+        # Parsed price in rupees, kept next to the raw text so queries can filter and index on it
+        'Price_INR': df['Price_INR'].values,
+        'PropertyID': property_ids,
+        'PriceID': property_ids
+    })
+
+    # Create Features DataFrame
+    features_df = pd.DataFrame({
+        'Baths': df['Baths'].values,
+        'Balcony': df['Balcony'].values,
+        'PropertyID': property_ids,
+        'FeatureID': property_ids
+    })
+
+    return {
+        'properties': properties_df,
+        'pricing': pricing_df,
+        'location': location_df,
+        'features': features_df
+    }
+
+def save_normalized_tables(tables, output_dir, output_format='csv'):
+    # Save to CSV files and/or typed columnar tables under output_dir/columnar/
+    for name, file_name in TABLE_FILES.items():
+        if output_format in ('csv', 'both'):
+            tables[name].to_csv(output_dir / file_name, index=False)
+        if output_format in ('columnar', 'both'):
+            write_table(tables[name], columnar_dir(output_dir / file_name))
+
+# Content and foreign key checks run against the saved tables (see sources.verification).
+# Each table holds its share of a raw row under that row's PropertyID; prices,
+# baths and balconies are compared in their typed form.
+VERIFY_CHECKS = {
+    'tables': [
+        {
+            'table': 'properties', 'file': 'properties.csv', 'key': 'PropertyID', 'raw_key': 'PropertyID',
+            'joins': [{'file': 'location.csv', 'on': 'LocationID', 'columns': {'Location': 'Location'}}],
+            'compare': [('Name', 'Name'), ('Property Title', 'Title'), ('Description', 'Description'),
+                        ('Location', 'Location'), ('Total_Area', 'Total_Area')],
+            'numeric': ['Total_Area']
+        },
+        {
+            'table': 'pricing', 'file': 'pricing.csv', 'key': 'PropertyID', 'raw_key': 'PropertyID',
+            'compare': [('Price', 'Price'), ('Price_per_SQFT', 'Price_per_SQFT'), ('Price_INR', 'Price_INR')],
+            'numeric': ['Price_per_SQFT', 'Price_INR']
+        },
+        {
+            'table': 'features', 'file': 'features.csv', 'key': 'PropertyID', 'raw_key': 'PropertyID',
+            'compare': [('Baths', 'Baths'), ('Balcony', 'Balcony')],
+            'numeric': ['Baths'],
+            'boolean': ['Balcony']
+        }
+    ],
+    'foreign_keys': [
+        {'table': 'properties', 'file': 'properties.csv', 'column': 'LocationID',
+         'parent': 'location.csv', 'key': 'LocationID'},
+        {'table': 'pricing', 'file': 'pricing.csv', 'column': 'PropertyID',
+         'parent': 'properties.csv', 'key': 'PropertyID'},
+        {'table': 'features', 'file': 'features.csv', 'column': 'PropertyID',
+         'parent': 'properties.csv', 'key': 'PropertyID'}
+    ]
+}
+
+def verify_normalization(input_file_path, output_dir, chunk_rows=CHUNK_ROWS):
+    # Stream the typed raw feed, with the PropertyID each row was saved under, and the saved
+    # tables through every check
+    def raw_chunks():
+        listing_ids = property_id_store()
+        try:
+            listing_ids.start_feed()
+            for chunk in pd.read_csv(input_file_path, chunksize=chunk_rows):
+                chunk = type_fields(chunk)[0]
+                chunk['PropertyID'] = listing_ids.assign(chunk)
+                yield chunk
+        finally:
+            listing_ids.close()
+
+    report = verify(VERIFY_CHECKS, raw_chunks, lambda file_name: output_dir / file_name, chunk_rows)
+    if print_report(report):
+        print("The conversion was correct.")
+    else:
+        print("The conversion was incorrect.")
+
+def normalize_in_chunks(input_file_path, output_dir, chunk_rows=CHUNK_ROWS, append=False):
+    """Normalise a feed of any size, chunk_rows raw rows at a time.
+
+    Location ids come from a persistent key map and property ids from the
+    on-disk listing id store (see property_id_store), which price and
+    feature rows share; each chunk's rows are appended to the output files,
+    so memory is bounded by the chunk size plus one location key map entry
+    per distinct location. With append=True the state of the previous run
+    is reused and its files are extended.
+    """
+    files = {name: output_dir / file_name for name, file_name in TABLE_FILES.items()}
+    files['rejects'] = output_dir / REJECT_FILE
+    if not append:
+        for path in files.values():
+            path.unlink(missing_ok=True)
+        if os.path.exists(KEYMAP_STATE):
+            os.remove(KEYMAP_STATE)
+
+    store = KeyMapStore.load(KEYMAP_STATE)
+    locations = store.keymap('location', ['Location'], 'LocationID')
+    listing_ids = property_id_store()
+    if not append:
+        listing_ids.start_feed()
+
+    total = rejected = 0
+    for chunk in pd.read_csv(input_file_path, chunksize=chunk_rows):
+        chunk, rejects = type_fields(chunk)
+        property_ids = listing_ids.assign(chunk)
+        location_ids, new_locations = locations.assign(chunk)
+
+        properties_df = pd.DataFrame({
+            'PropertyID': property_ids,
+            'Name': chunk['Name'].values,
+            'Title': chunk['Property Title'].values,
+            'Description': chunk['Description'].values,
+            'LocationID': location_ids,
+            'Total_Area': chunk['Total_Area'].values
+        })
+        pricing_df = pd.DataFrame({
+            'Price': chunk['Price'].values,
+            'Price_per_SQFT': chunk['Price_per_SQFT'].values,
+            'Price_INR': chunk['Price_INR'].values,
+            'PropertyID': property_ids,
+            'PriceID': property_ids
+        })
+        features_df = pd.DataFrame({
+            'Baths': chunk['Baths'].values,
+            'Balcony': chunk['Balcony'].values,
+            'PropertyID': property_ids,
+            'FeatureID': property_ids
+        })
+
+        append_csv(properties_df, files['properties'])
+        append_csv(pricing_df, files['pricing'])
+        append_csv(new_locations, files['location'])
+        append_csv(features_df, files['features'])
+        if len(rejects):
+            append_csv(reject_rows(rejects, property_ids), files['rejects'])
+        total += len(chunk)
+        rejected += len(rejects)
+        print(f"Normalised {total} rows")
+
+    # Saved last, so an interrupted run can simply be repeated without --append
+    store.save()
+    listing_ids.close()
+    print(f"properties: {total} rows, location: {len(locations)} rows, {rejected} values rejected")
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalise the source 3 feed into properties, pricing, location and features")
+    parser.add_argument('--chunk-rows', type=int,
+                        help="Stream the feed in chunks of this many rows instead of loading it whole")
+    parser.add_argument('--append', action='store_true',
+                        help="With --chunk-rows, extend the previous output instead of replacing it")
+    parser.add_argument('--format', choices=['csv', 'columnar', 'both'], default='csv',
+                        help="Output format of the in-memory normaliser (chunked runs always write CSV)")
+    parser.add_argument('--skip-verify', action='store_true',
+                        help="Do not verify the saved tables against the raw feed")
+    args = parser.parse_args()
+
+    # Ensure the directory exists
+    output_dir = base_dir / 'normalized'
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.chunk_rows:
+        normalize_in_chunks(csv_file, output_dir, args.chunk_rows, args.append)
+    else:
+        # Read the CSV file, with the repeated location names as a category
+        df = pd.read_csv(csv_file, dtype={'Location': 'category'})
+        df, rejects = type_fields(df)
+        listing_ids = property_id_store()
+        listing_ids.start_feed()
+        tables = normalize_real_estate_data(df, listing_ids)
+        save_normalized_tables(tables, output_dir, args.format)
+        listing_ids.close()
+        reject_rows(rejects, tables['properties']['PropertyID'].values).to_csv(output_dir / REJECT_FILE, index=False)
+        print(f"{len(rejects)} values failed typing, see {output_dir / REJECT_FILE}")
+        # The saved tables are verified from disk, so the frames can go first
+        del df, tables
+
+    # Appended output also holds earlier feeds, which this feed cannot account for
+    if not (args.skip_verify or args.append):
+        verify_normalization(csv_file, output_dir, args.chunk_rows or CHUNK_ROWS)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import glob
+import json
+
+from sources.indexes import walk_plan
+from sources.query_log import LOG_PATH
+
+# Tables a source query should reach through an index, never a sequential scan
+WATCHED_TABLES = ['properties', 'pricing', 'features']
+
+
+def read_entries(path):
+    # The current log plus its rotated files (slow_queries.log.1, .2, ...)
+    for log_file in sorted(glob.glob(path + '*')):
+        if not (log_file == path or log_file[len(path) + 1:].isdigit()):
+            continue
+        with open(log_file) as lines:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def summarise(entries, watched_tables):
+    shapes = {}
+    for entry in entries:
+        shape = shapes.setdefault((entry['source'], entry['shape_id']), {
+            'source': entry['source'],
+            'shape': entry['shape'],
+            'timings': [],
+            'rows': 0,
+            'explained': 0,
+            'seq_scans': set(),
+            'slowest_params': None
+        })
+        if not shape['timings'] or entry['elapsed_ms'] > max(shape['timings']):
+            shape['slowest_params'] = entry['params']
+        shape['timings'].append(entry['elapsed_ms'])
+        shape['rows'] += max(entry.get('rows') or 0, 0)
+        for plan in entry.get('plan') or []:
+            used, seq_scans = [], []
+            walk_plan(plan['Plan'], used, seq_scans)
+            shape['explained'] += 1
+            shape['seq_scans'].update(table for table in seq_scans if table in watched_tables)
+    return shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the slow-query log by query shape")
+    parser.add_argument('--log', default=LOG_PATH, help="Log file to read (rotated files are included)")
+    parser.add_argument('--top', type=int, default=10, help="Number of query shapes to show")
+    parser.add_argument('--tables', default=','.join(WATCHED_TABLES),
+                        help="Comma-separated tables whose sequential scans are flagged")
+    args = parser.parse_args()
+
+    shapes = summarise(read_entries(args.log), set(args.tables.split(',')))
+    if not shapes:
+        print(f"No queries logged in {args.log}. Is SLOW_QUERY_LOG=1 set?")
+        return
+
+    ranked = sorted(shapes.values(), key=lambda shape: sum(shape['timings']), reverse=True)
+    for shape in ranked[:args.top]:
+        timings = sorted(shape['timings'])
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"\n{shape['source']}: {len(timings)} runs, total {sum(timings):.1f} ms, "
+              f"mean {sum(timings) / len(timings):.1f} ms, p95 {p95:.1f} ms, max {timings[-1]:.1f} ms, "
+              f"{shape['rows'] / len(timings):.0f} rows/run")
+        print("-" * 30)
+        print(shape['shape'][:400])
+        print(f"Slowest parameters: {shape['slowest_params']}")
+        if shape['seq_scans']:
+            print(f"SEQ SCAN on {', '.join(sorted(shape['seq_scans']))} "
+                  f"(in {shape['explained']} captured plans)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,92 +1,216 @@
-import psycopg2
-from psycopg2 import sql
-from flask import Flask, request, render_template
+from flask import Flask, Response, request, render_template, stream_template, jsonify
 import requests
-import recordlinkage
-import pandas as pd
-from sources import CONNECTION_PARAMS, QUERY_FUNCTIONS
+import json
+import time
+from functools import partial
+from itertools import chain
+from sources import QUERY_FUNCTIONS, ROW_COLUMNS, metrics, profiling, query_log
+from sources.pool import get_pool, pool_stats
+from sources.blocking import candidate_pairs, normalise_text
+from sources.cache import ResultCache, canonical_search, invalidate_source
+from sources.comparison import ComparisonEngine
+from sources.compiler import compile_page_query, compile_query, parse_search_form
+from sources.entity_resolution import ENTITY_STORE, MATCH_THRESHOLD, ClusterMap, dedupe_by_cluster
+from sources.federation import dispatch, late_sources
+from sources.pagination import (DEFAULT_PAGE_SIZE, EXHAUSTED, MAX_PAGE_SIZE, decode_cursor,
+                                encode_cursor, merge_pages)
+from sources.records import PropertyRecord, records_from_rows, select_columns
 
 app = Flask(__name__)
 
+# REQUEST_PROFILING=1 lets a request ask for a profile with "X-Profile: 1" or "?profile=1"
+profiling.install(app, 'mediator')
 
-import pandas as pd
-import recordlinkage
+# Latency of each stage of a search, exposed with everything else on /metrics
+STAGE_SECONDS = metrics.histogram('search_stage_seconds', "Time spent in each stage of a search", ['stage'])
+SEARCHES = metrics.counter('searches_total', "Searches served", ['endpoint', 'cache'])
+metrics.track_pools()
+
+
+# A single result set is small, so its pairs are compared in-process
+duplicate_engine = ComparisonEngine(numeric_fields=[], workers=1)
 
 def remove_duplicates(results):
-    # Convert the combined data to a pandas DataFrame
-    df = pd.DataFrame(results, columns=[
-        'Property_Name', 'Property_Title', 'Property_Type', 'Price',
-        'Total_Area', 'City', 'Location', 'Price_per_SQFT',
-        'Description', 'Number_Of_Rooms', 'Number_Of_Balconies', 'Source'
-    ])
-    
-    print(f"Original records: {len(df)}")  # Logging original count
+    print(f"Original records: {len(results)}")  # Logging original count
     
-    # Create a temporary copy for matching
-    df_temp = df.copy()
+    # Preprocess the matching fields
+    names = [normalise_text(record.property_name) for record in results]
+    locations = [normalise_text(record.location) for record in results]
     
-    # Preprocess data in the temporary copy
-    df_temp['Property_Name'] = df_temp['Property_Name'].str.lower().str.strip()
-    df_temp['Location'] = df_temp['Location'].str.lower().str.strip()
-    
-    # Indexing
-    indexer = recordlinkage.Index()
-    indexer.block(['Property_Name', 'Location'])
-    candidate_links = indexer.index(df_temp)
+    # Indexing: sorted neighbourhood plus MinHash LSH, so near-identical names
+    # ('Prestige Lakeside' / 'prestige lake side') become candidates without comparing every pair
+    pairs = candidate_pairs(names, locations)
+    if not pairs:
+        print(f"Unique records after removal: {len(results)}")
+        return results
     
     # Comparison
-    compare = recordlinkage.Compare()
-    compare.string('Property_Name', 'Property_Name', method='jarowinkler', threshold=0.85, label='name')
-    compare.string('Location', 'Location', method='jarowinkler', threshold=0.85, label='location')
-    features = compare.compute(candidate_links, df_temp)
+    features = duplicate_engine.compute({'name': names, 'location': locations}, pairs)
     
     # Find duplicates
-    duplicates = features[features.sum(axis=1) > 1].index
-    duplicate_indices = duplicates.get_level_values(1)
+    matched = (features['name_jw'] >= MATCH_THRESHOLD) & (features['location_jw'] >= MATCH_THRESHOLD)
+    duplicate_indices = set(features[matched].index.get_level_values(1))
     
     print(f"Duplicate records to remove: {len(duplicate_indices)}")  # Logging duplicates
     
-    # Drop duplicates from the original DataFrame
-    df_unique = df.drop(duplicate_indices).values.tolist()
-    print(f"Unique records after removal: {len(df_unique)}")  # Logging unique count
+    # Drop duplicates, keeping the first record of each pair
+    unique = [record for position, record in enumerate(results) if position not in duplicate_indices]
+    print(f"Unique records after removal: {len(unique)}")  # Logging unique count
     
-    return df_unique
+    return unique
+
+# Cluster assignments written offline by link_sources.py, cached in memory
+cluster_map = ClusterMap(lambda: get_pool(ENTITY_STORE).connection())
+
+def hide_duplicates(results):
+    # De-duplicate with a lookup in the offline linkage result; link in-request only if it is missing
+    try:
+        mapping = cluster_map.mapping(record.key for record in results)
+    except Exception as e:
+        print("Entity clusters unavailable, linking in-request instead:", e)
+        return remove_duplicates(results)
+    unique = dedupe_by_cluster(results, mapping)
+    print(f"Unique records after removal: {len(unique)} of {len(results)}")
+    return unique
 
     
-# Function to fetch data from System A (Source 2)
-def fetch_data_from_source_2(query_conditions):
+# System A exposes source 2 over HTTP
+SOURCE_2_API_URL = "http://192.168.0.100:5000/get_properties"  # Replace <system_a_ip> with System A's IP
+
+def stream_source_2(params):
+    # Ask System A for newline-delimited JSON. The request and its header line are read here, so a
+    # failure surfaces within the source's deadline; the rows are converted as their lines arrive
+    params = dict(params, format='ndjson')
+    response = requests.get(SOURCE_2_API_URL, params=params, stream=True, timeout=(10,60))
     try:
-        # Create the URL with query conditions to fetch from System A
-        source_2_api_url = "http://192.168.0.100:5000/get_properties"  # Replace <system_a_ip> with System A's IP
-        response = requests.get(source_2_api_url, params={'conditions': query_conditions}, timeout=(10,60))
-        if response.status_code == 200:
-            print("Data received from System A:", response.json())
-        else:
+        if response.status_code != 200:
             print(f"Failed to receive data from System A: {response.status_code} {response.text}")
-
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from source 2:", e)
-        return []
 
-# Function to query global properties from source 3 (local to System B)
-def query_source_3(query_conditions):
-    results = []
+        lines = response.iter_lines()
+        header = json.loads(next(lines))
+        if 'error' in header:
+            raise RuntimeError(f"System A error: {header['error']}")
+        columns = [column.lower() for column in header['columns']]
+        # Positions of our row columns in System A's rows
+        order = [columns.index(column.lower()) for column in ROW_COLUMNS]
+    except Exception:
+        response.close()
+        raise
+    return source_2_records(response, lines, order)
+
+def source_2_records(response, lines, order):
+    # Time spent decoding lines, reported once the stream ends
+    decoding = 0.0
     try:
-        conn_params = CONNECTION_PARAMS.get('source_3')
-        conn = psycopg2.connect(**conn_params)
-        query_func = QUERY_FUNCTIONS.get('source_3')
-        if query_func:
-            query = query_func(query_conditions)
+        for line in lines:
+            if not line:
+                continue
+            started = time.perf_counter()
+            row = json.loads(line)
+            if isinstance(row, dict):
+                raise RuntimeError(f"System A error: {row.get('error')}")
+            record = PropertyRecord(*[row[position] for position in order])
+            decoding += time.perf_counter() - started
+            yield record
+    finally:
+        response.close()
+        STAGE_SECONDS.observe(decoding, stage='decode')
+
+# Function to fetch data from System A (Source 2)
+def fetch_data_from_source_2(filters):
+    # Send the structured filter to System A, which compiles and runs it against source 2;
+    # the rows are returned as a stream, so the page renders them as they arrive
+    return stream_source_2({'filters': json.dumps(filters)})
+
+# Function to fetch one keyset page from System A (Source 2)
+def fetch_page_from_source_2(filters, page_size, after=None):
+    params = {'filters': json.dumps(filters), 'limit': page_size, 'paged': 1}
+    if after is not None:
+        params['after'] = json.dumps([str(after[0]), after[1]])
+    return list(stream_source_2(params))
+
+# Function to query a source whose database is local to System B
+def query_local_source(source_name, filters):
+    results = []
+    with get_pool(source_name).connection() as conn:
+        if source_name in QUERY_FUNCTIONS:
+            query, params = compile_query(source_name, filters)
             with conn.cursor() as cur:
-                cur.execute(query)
-                results += cur.fetchall()
-        conn.close()
-    except Exception as e:
-        print(f"Error executing query for source 3:", e)
+                query_log.execute(cur, source_name, query, params)
+                results += records_from_rows(cur)
     return results
 
+# Function to fetch one keyset page from a local source
+def query_local_page(source_name, filters, page_size, after=None):
+    with get_pool(source_name).connection() as conn:
+        query, params = compile_page_query(source_name, filters, page_size, after)
+        with conn.cursor() as cur:
+            query_log.execute(cur, source_name, query, params)
+            return records_from_rows(cur)
+
+# Sources served by another system; every other registered source is queried locally
+REMOTE_FETCHERS = {
+    'source_2': fetch_data_from_source_2
+}
+REMOTE_PAGE_FETCHERS = {
+    'source_2': fetch_page_from_source_2
+}
+
+# Results of recent searches, shared by every request handled by this process
+result_cache = ResultCache()
+
+CACHE_GAUGE = metrics.gauge('result_cache', "Result cache counters and size", ['stat'])
+
+def collect_cache_stats():
+    for stat, value in result_cache.stats().items():
+        CACHE_GAUGE.set(value, stat=stat)
+
+metrics.REGISTRY.add_collector(collect_cache_stats)
+
+def collect_then(rows, on_complete):
+    # Pass streamed rows on as they arrive and hand the complete list to on_complete at the end;
+    # a stream that fails or is abandoned part-way never reaches it
+    collected = []
+    for row in rows:
+        collected.append(row)
+        yield row
+    on_complete(collected)
+
+def cached_fetcher(source_name, fetch):
+    # Each source's rows are cached under that source's own TTL
+    def fetch_cached(filters):
+        key = ('source', source_name, canonical_search(filters))
+        rows = result_cache.get(key)
+        if rows is None:
+            generations = result_cache.generations([source_name])
+            rows = fetch(filters)
+            if not isinstance(rows, list):
+                # A streamed source is cached once it has been read to the end
+                return collect_then(rows, lambda collected: result_cache.put(
+                    key, collected, [source_name], generations=generations))
+            result_cache.put(key, rows, [source_name], generations=generations)
+        return rows
+    return fetch_cached
+
+def get_source_fetchers():
+    return {
+        source_name: cached_fetcher(
+            source_name, REMOTE_FETCHERS.get(source_name, partial(query_local_source, source_name)))
+        for source_name in QUERY_FUNCTIONS
+    }
+
+def get_page_fetchers(positions, page_size):
+    # One fetcher per source that still has rows, each resuming after its own cursor position
+    fetchers = {}
+    for source_name in QUERY_FUNCTIONS:
+        position = positions.get(source_name)
+        if position == EXHAUSTED:
+            continue
+        fetch = REMOTE_PAGE_FETCHERS.get(source_name, partial(query_local_page, source_name))
+        fetchers[source_name] = partial(fetch, page_size=page_size, after=position)
+    return fetchers
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     print("\napi is running\n")
@@ -119,32 +243,117 @@ def index():
             'hide_duplicates': bool(request.form.get('hide_duplicates', False))
         })
 
-        query_conditions = "1=1"  # Build appropriate conditions string from the form data
+        # Structured filter, compiled into each source's own SQL where it is executed
+        with STAGE_SECONDS.time(stage='parse'):
+            filters = parse_search_form(form_data)
 
-        # Step 1: Fetch data from System A
-        data_source_2 = fetch_data_from_source_2(query_conditions)
+        # Repeated searches are answered from the cache, duplicates already removed
+        search_key = ('search', canonical_search(filters, form_data['hide_duplicates']))
+        cached = result_cache.get(search_key)
+        if cached is not None:
+            SEARCHES.inc(endpoint='index', cache='hit')
+            combined_data, source_status = cached
+            return metrics.timed_iter(
+                stream_template('index.html', data=combined_data, form=form_data,
+                                source_status=source_status, late_sources=[]),
+                STAGE_SECONDS, stage='render')
+        SEARCHES.inc(endpoint='index', cache='miss')
+        generations = result_cache.generations(QUERY_FUNCTIONS)
 
-        print(data_source_2)
+        # Step 1: Query every source at once, each under its own deadline
+        with STAGE_SECONDS.time(stage='fetch'):
+            source_results, source_status = dispatch(get_source_fetchers(), filters)
+        late = late_sources(source_status)
+        if late:
+            print("Sources that missed their deadline:", late)
 
-        print("\n\n\n")
+        # Step 2: Combine the data that arrived in time; a streamed source's rows are chained
+        # on, so they are rendered as they arrive
+        with STAGE_SECONDS.time(stage='combine'):
+            combined_data = chain.from_iterable(
+                source_results.get(source_name, []) for source_name in QUERY_FUNCTIONS)
 
-        # Step 2: Query data from System B (Source 3)
-        data_source_3 = query_source_3(query_conditions)
+        # Step 3: Remove duplicates if requested, which needs every row first
+        if form_data['hide_duplicates']:
+            with STAGE_SECONDS.time(stage='dedup'):
+                combined_data = hide_duplicates(list(combined_data))
 
-        # print(data_source_3)
+        # Only complete answers are cached; a late or failed source is retried next time.
+        # Streamed sources are only complete once the page has rendered all of their rows
+        def cache_search(rows):
+            if all(info['state'] == 'ok' for info in source_status.values()):
+                result_cache.put(search_key, (rows, source_status), list(QUERY_FUNCTIONS),
+                                 generations=generations)
+        combined_data = collect_then(combined_data, cache_search)
 
-        # print("\n\n\n")
+        # Stream the page, so the browser shows the first rows while the rest of the table renders
+        return metrics.timed_iter(
+            stream_template('index.html', data=combined_data, form=form_data,
+                            source_status=source_status, late_sources=late),
+            STAGE_SECONDS, stage='render')
 
-        # Step 3: Combine the data from both sources
-        combined_data = data_source_2 + data_source_3
+    return render_template('index.html', data=[], form=form_data, source_status={}, late_sources=[])
 
-        # Step 4: Remove duplicates if requested
-        if form_data['hide_duplicates']:
-            combined_data = remove_duplicates(combined_data)
+def requested_columns(form):
+    # Columns to return: a list, or a comma-separated string such as "Property_Name,Price"; all when absent
+    fields = form.get('fields')
+    if not fields:
+        return ROW_COLUMNS
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return select_columns(fields)
+
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+    # Paginated JSON search: the search form fields plus an optional cursor, page_size and fields
+    form = request.get_json(silent=True) or request.values
+    SEARCHES.inc(endpoint='search', cache='none')
+    try:
+        with STAGE_SECONDS.time(stage='parse'):
+            filters = parse_search_form(form)
+        columns = requested_columns(form)
+        page_size = min(int(form.get('page_size') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        positions = {source_name: None for source_name in QUERY_FUNCTIONS}
+        positions.update(decode_cursor(form.get('cursor'), filters))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page_size < 1:
+        return jsonify({"error": "page_size must be positive"}), 400
+
+    with STAGE_SECONDS.time(stage='fetch'):
+        source_results, source_status = dispatch(get_page_fetchers(positions, page_size), filters)
+    with STAGE_SECONDS.time(stage='combine'):
+        page, next_positions, has_more = merge_pages(source_results, positions, page_size)
+
+    return jsonify({
+        'rows': [record.as_dict(columns) for record in page],
+        'next_cursor': encode_cursor(filters, next_positions) if has_more else None,
+        'sources': source_status,
+        'late_sources': late_sources(source_status)
+    })
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    # Drop cached results for one source (?source=source_3) or for all of them
+    source_name = request.values.get('source')
+    if source_name and source_name not in QUERY_FUNCTIONS:
+        return jsonify({"error": f"Unknown source: {source_name}"}), 400
+    for name in [source_name] if source_name else QUERY_FUNCTIONS:
+        invalidate_source(name)
+    result_cache.invalidate(source_name)
+    return jsonify(result_cache.stats())
 
-        return render_template('index.html', data=combined_data, form=form_data)
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats())
 
-    return render_template('index.html', data=[], form=form_data)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     app.run(debug=True)
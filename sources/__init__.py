@@ -2,6 +2,17 @@
 
 from psycopg2 import sql
 
+# Columns of the global schema every source query returns, in order
+GLOBAL_COLUMNS = [
+    'Property_Name', 'Property_Title', 'Property_Type', 'Price',
+    'Total_Area', 'City', 'Location', 'Price_per_SQFT',
+    'Description', 'Number_Of_Rooms', 'Number_Of_Balconies', 'Source'
+]
+
+# Rows coming back from a source carry the global columns plus the listing's
+# primary key in that source; (Source, Source_ID) identifies a listing
+ROW_COLUMNS = GLOBAL_COLUMNS + ['Source_ID']
+
 # Connection parameters for each source
 CONNECTION_PARAMS = {
     'source_2': {
@@ -20,8 +31,32 @@ CONNECTION_PARAMS = {
     }
 }
 
-# Query functions for each source
-def query_source_2(conditions):
+# Price of a source 3 listing in rupees, parsed from its text form at load time
+SOURCE_3_PRICE = sql.Identifier('pr', 'price_inr')
+
+# Upper bound on the rows a single source query returns
+RESULT_LIMIT = 100
+
+# Keyset each source is paged on: the price it reports and its own primary key.
+# Together with the source name this gives one stable global order. Both
+# columns come from the table holding the price, so a page is read in order
+# from that table's keyset index (see sources.indexes).
+SORT_KEYS = {
+    'source_2': (sql.SQL("COALESCE(p.price, 0)"), sql.Identifier('p', 'property_id')),
+    'source_3': (sql.SQL("COALESCE({}, 0)").format(SOURCE_3_PRICE), sql.Identifier('pr', 'propertyid'))
+}
+
+
+def _paging(source_name, paged):
+    # Every query returns the source's primary key; paged queries also come back in keyset order
+    price, key = SORT_KEYS[source_name]
+    order = sql.SQL("ORDER BY {}, {}").format(price, key) if paged else sql.SQL("")
+    return sql.SQL(",\n            {} AS Source_ID").format(key), order
+
+# Query functions for each source; conditions is a psycopg2.sql.Composable
+# predicate, usually built by sources.compiler.compile_predicate
+def query_source_2(conditions, limit=RESULT_LIMIT, paged=False):
+    key_column, order = _paging('source_2', paged)
     query = sql.SQL("""
         SELECT 
             COALESCE(p.property_name, 'Unknown') AS Property_Name,
@@ -35,33 +70,36 @@ def query_source_2(conditions):
             COALESCE(p.description, 'No description available') AS Description,
             COALESCE(r.total_rooms, 0) AS Number_Of_Rooms,
             COALESCE(p.balcony, false) AS Number_Of_Balconies,
-            'source_2' as source
+            'source_2' as source{key_column}
         FROM properties p
         LEFT JOIN locations l ON p.location_id = l.location_id
         LEFT JOIN cities c ON l.city_id = c.city_id
         LEFT JOIN property_types pt ON p.property_type_id = pt.property_type_id
         LEFT JOIN rooms r ON p.room_config_id = r.room_config_id
         WHERE {conditions}
-        LIMIT 100
-    """).format(conditions=sql.SQL(conditions))
+        {order}
+        LIMIT {limit}
+    """).format(conditions=conditions, key_column=key_column, order=order, limit=sql.Literal(limit))
     return query
 
-def query_source_3(conditions):
+# Keyset pages drive the join from pricing, so they walk idx_pricing_price_keyset in order
+# instead of sorting every matching row; only listings with a price can be paged by price anyway.
+# Unpaged searches keep properties as the driving table, so listings without a pricing row still match
+SOURCE_3_TABLES = sql.SQL("""
+        FROM properties p
+        LEFT JOIN pricing pr ON p.propertyid = pr.propertyid""")
+SOURCE_3_PAGED_TABLES = sql.SQL("""
+        FROM pricing pr
+        JOIN properties p ON p.propertyid = pr.propertyid""")
+
+def query_source_3(conditions, limit=RESULT_LIMIT, paged=False):
+    key_column, order = _paging('source_3', paged)
     query = sql.SQL("""
         SELECT 
             COALESCE(p.name, 'Unknown') AS Property_Name,
             COALESCE(p.title, 'No title') AS Property_Title,
             'Not Specified' AS Property_Type,
-            COALESCE(
-                CASE 
-                    WHEN position('Cr' in pr.price) > 0 
-                        THEN TRIM(BOTH '₹ ' FROM regexp_replace(pr.price, 'Cr.*$', ''))::numeric * 10000000
-                    WHEN position('L' in pr.price) > 0 
-                        THEN TRIM(BOTH '₹ ' FROM regexp_replace(pr.price, 'L.*$', ''))::numeric * 100000
-                    WHEN position('k' in pr.price) > 0 
-                        THEN TRIM(BOTH '₹ ' FROM regexp_replace(pr.price, 'k.*$', ''))::numeric * 1000
-                    ELSE TRIM(BOTH '₹ ' FROM regexp_replace(pr.price, '[^0-9.]', '', 'g'))::numeric
-                END, 0) AS Price,
+            COALESCE({price}, 0) AS Price,
             COALESCE(p.total_area, 0) AS Total_Area,
             'Unknown' AS City,
             COALESCE(l.location, 'Unknown') AS Location,
@@ -69,14 +107,15 @@ def query_source_3(conditions):
             COALESCE(p.description, 'No description available') AS Description,
             COALESCE(f.baths, 0) AS Number_Of_Rooms,
             COALESCE(f.balcony, false) AS Number_Of_Balconies,
-            'source_3' as source
-        FROM properties p
+            'source_3' as source{key_column}{tables}
         LEFT JOIN location l ON p.locationid = l.locationid
-        LEFT JOIN pricing pr ON p.propertyid = pr.propertyid
         LEFT JOIN features f ON p.propertyid = f.propertyid
         WHERE {conditions}
-        LIMIT 100
-    """).format(conditions=sql.SQL(conditions))
+        {order}
+        LIMIT {limit}
+    """).format(conditions=conditions, price=SOURCE_3_PRICE, key_column=key_column,
+                 tables=SOURCE_3_PAGED_TABLES if paged else SOURCE_3_TABLES,
+                 order=order, limit=sql.Literal(limit))
     return query
 
 # Mapping of source names to query functions
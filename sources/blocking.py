@@ -0,0 +1,162 @@
+# sources/blocking.py
+
+import heapq
+import re
+import zlib
+from bisect import bisect_left, insort
+
+import numpy as np
+
+# Mersenne prime used by the MinHash permutations
+_PRIME = (1 << 31) - 1
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalise_text(value):
+    """Lowercase, drop punctuation and collapse whitespace: 'Prestige  Lake-Side' -> 'prestige lake side'."""
+    if value is None:
+        return ''
+    return ' '.join(_NON_ALNUM.sub(' ', str(value).lower()).split())
+
+
+def compact_text(value):
+    """normalise_text without spaces, so 'lake side' and 'lakeside' agree."""
+    return normalise_text(value).replace(' ', '')
+
+
+def qgrams(value, q=3):
+    padded = f"#{value}#"
+    if len(padded) <= q:
+        return {padded}
+    return {padded[i:i + q] for i in range(len(padded) - q + 1)}
+
+
+class BlockingIndex:
+    """Candidate-pair generator for record linkage on property name and location.
+
+    Two complementary blocking schemes are combined:
+
+    * sorted neighbourhood on the compacted name, pairing each record with
+      its ``window - 1`` neighbours in sort order, and
+    * MinHash LSH over name and location q-grams, pairing records that share
+      a bucket in any of ``bands`` bands of ``rows_per_band`` hashes.
+
+    Recall is tuned with ``window`` and with ``bands``/``rows_per_band``: the
+    LSH similarity threshold is roughly ``(1 / bands) ** (1 / rows_per_band)``.
+    Buckets larger than ``max_bucket_size`` (very common q-gram sets) are not
+    expanded, which keeps the number of pairs near-linear in the number of
+    records.
+
+    Records are added with ``add``, which returns only the pairs that involve
+    the new records, and dropped with ``remove``, so the index can also be
+    maintained incrementally: both find their place in the sort order by
+    bisection, shift the sorted list by one slot (a linear memmove, but no
+    comparisons or re-sorting) and update a few buckets.
+    """
+
+    def __init__(self, window=5, q=3, bands=20, rows_per_band=4, max_bucket_size=50, seed=20241):
+        self.window = window
+        self.q = q
+        self.bands = bands
+        self.rows_per_band = rows_per_band
+        self.max_bucket_size = max_bucket_size
+        rng = np.random.default_rng(seed)
+        permutations = bands * rows_per_band
+        self._a = rng.integers(1, _PRIME, size=permutations, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=permutations, dtype=np.uint64)
+
+        self._sequence = {}     # record id -> insertion order
+        self._next_sequence = 0
+        self._sorted = []       # (compact name, insertion order, record id)
+        self._sort_keys = {}    # record id -> its (compact name, insertion order) in _sorted
+        self._buckets = {}      # (band, band signature) -> {record id: None}, in insertion order
+        self._record_buckets = {}   # record id -> its bucket keys
+
+    @property
+    def threshold(self):
+        return (1 / self.bands) ** (1 / self.rows_per_band)
+
+    def __len__(self):
+        return len(self._sequence)
+
+    def __contains__(self, record_id):
+        return record_id in self._sequence
+
+    def __iter__(self):
+        return iter(self._sequence)
+
+    def signature(self, name, location):
+        shingles = qgrams(compact_text(name), self.q) | {f"@{gram}" for gram in qgrams(compact_text(location), self.q)}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles)) % _PRIME
+        # One row per permutation, minimum over the record's shingles
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _pair(self, first, second):
+        if self._sequence[first] > self._sequence[second]:
+            first, second = second, first
+        return first, second
+
+    def add(self, record_ids, names, locations):
+        """Index new records and return the candidate pairs that involve at least one of them.
+
+        Each pair is ``(earlier_id, later_id)`` in insertion order.
+        """
+        new_ids, names, locations = list(record_ids), list(names), list(locations)
+        for record_id in new_ids:
+            if record_id in self._sequence:
+                raise ValueError(f"Record {record_id!r} is already indexed")
+            self._sequence[record_id] = self._next_sequence
+            self._next_sequence += 1
+        pairs = set()
+
+        # Sorted neighbourhood: insert the new keys into the sort order, then pair each new record
+        # with its window. A batch larger than the index is merged in one linear pass instead
+        items = sorted((compact_text(name), self._sequence[record_id], record_id)
+                       for record_id, name in zip(new_ids, names))
+        for key, sequence, record_id in items:
+            self._sort_keys[record_id] = (key, sequence)
+        if len(items) > len(self._sorted):
+            self._sorted = list(heapq.merge(self._sorted, items))
+        else:
+            for item in items:
+                insort(self._sorted, item)
+        for record_id in new_ids:
+            position = bisect_left(self._sorted, self._sort_keys[record_id])
+            low = max(0, position - self.window + 1)
+            high = min(len(self._sorted), position + self.window)
+            for _, _, other in self._sorted[low:high]:
+                if other != record_id:
+                    pairs.add(self._pair(record_id, other))
+
+        # MinHash LSH buckets
+        for record_id, name, location in zip(new_ids, names, locations):
+            signature = self.signature(name, location)
+            keys = []
+            for band in range(self.bands):
+                start = band * self.rows_per_band
+                key = (band, signature[start:start + self.rows_per_band].tobytes())
+                keys.append(key)
+                bucket = self._buckets.setdefault(key, {})
+                if len(bucket) < self.max_bucket_size:
+                    for other in bucket:
+                        pairs.add(self._pair(record_id, other))
+                bucket[record_id] = None
+            self._record_buckets[record_id] = keys
+        return pairs
+
+    def remove(self, record_id):
+        """Forget a record, e.g. a listing deleted from its source."""
+        del self._sequence[record_id]
+        del self._sorted[bisect_left(self._sorted, self._sort_keys.pop(record_id))]
+        for key in self._record_buckets.pop(record_id, []):
+            del self._buckets[key][record_id]
+            if not self._buckets[key]:
+                del self._buckets[key]
+
+
+def candidate_pairs(names, locations, **options):
+    """Candidate pairs ``(i, j)``, ``i < j``, over positional records."""
+    index = BlockingIndex(**options)
+    return sorted(index.add(range(len(names)), names, locations))
@@ -0,0 +1,294 @@
+# sources/bulk_load.py
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+from sources.columnar import columnar_dir, iter_table, newer_format
+from sources.field_types import to_nullable_bool
+
+# Rows pushed through a single COPY call; bounds memory for large tables
+CHUNK_ROWS = 50000
+
+# Marker COPY reads as NULL
+NULL_MARKER = '\\N'
+
+# Column holding each row's content fingerprint, so refreshes can skip unchanged rows
+FINGERPRINT_COLUMN = 'row_hash'
+
+def to_nullable_int(series):
+    return np.trunc(pd.to_numeric(series, errors='coerce')).astype('Int64')
+
+
+def to_nullable_float(series):
+    return pd.to_numeric(series, errors='coerce').astype('Float64')
+
+
+def prepare_frame(df, spec):
+    """Select, rename and type the columns of a table spec in one vectorised pass.
+
+    Columns listed in the spec but absent from the file are loaded as NULL.
+    """
+    if spec.get('prepare'):
+        df = spec['prepare'](df)
+    frame = pd.DataFrame(index=df.index)
+    for source_column, column in spec['columns'].items():
+        values = df[source_column] if source_column in df.columns else pd.Series(pd.NA, index=df.index)
+        if column in spec.get('integer', ()):
+            values = to_nullable_int(values)
+        elif column in spec.get('numeric', ()):
+            values = to_nullable_float(values)
+        elif column in spec.get('boolean', ()):
+            values = to_nullable_bool(values)
+        frame[column] = values
+    return frame
+
+
+def _column_text(values):
+    # The same value must render the same whether the column was read from a CSV
+    # or a columnar copy: integral floats print as integers and missing values as NULL
+    text = values.astype(str)
+    if pd.api.types.is_float_dtype(values):
+        integral = (values.notna() & (values % 1 == 0)).fillna(False).astype(bool)
+        text[integral] = values[integral].astype('int64').astype(str)
+    return text.where(values.notna(), NULL_MARKER).astype(object)
+
+
+def row_text(content):
+    """One canonical string per row, so fingerprints do not depend on the column dtypes."""
+    text = pd.Series('', index=content.index, dtype=object)
+    for position, column in enumerate(content.columns):
+        separator = '\x1f' if position else ''
+        text = text + separator + _column_text(content[column])
+    return text
+
+
+def add_fingerprints(frame, spec):
+    """Add the 64-bit content fingerprint of every prepared row, over all columns but the key."""
+    content = frame.drop(columns=[spec['key']]) if spec.get('key') else frame
+    hashes = pd.util.hash_pandas_object(row_text(content), index=False).to_numpy()
+    # Stored in a BIGINT column, so reinterpret the unsigned hash as signed
+    return frame.assign(**{FINGERPRINT_COLUMN: hashes.view(np.int64)})
+
+
+def copy_frame(cur, table, frame):
+    """Stream one prepared DataFrame into ``table`` with COPY FROM STDIN."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+    buffer.seek(0)
+    statement = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL {null})").format(
+        table=sql.Identifier(table),
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in frame.columns),
+        null=sql.Literal(NULL_MARKER))
+    cur.copy_expert(statement.as_string(cur), buffer)
+
+
+def reset_sequence(cur, table, column):
+    """Move a SERIAL sequence past the explicit ids loaded by COPY."""
+    cur.execute(sql.SQL(
+        "SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({column}), 0) + 1, false) FROM {table}"
+    ).format(column=sql.Identifier(column), table=sql.Identifier(table)), (table, column))
+
+
+def load_csv(conn, spec, path, chunk_rows=CHUNK_ROWS):
+    """Bulk load one normalised CSV file into its table in bounded chunks.
+
+    Returns the number of rows loaded and the elapsed seconds.
+    """
+    started = time.monotonic()
+    rows = 0
+    with conn.cursor() as cur:
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            frame = add_fingerprints(prepare_frame(chunk, spec), spec)
+            copy_frame(cur, spec['table'], frame)
+            rows += len(frame)
+        if spec.get('key'):
+            reset_sequence(cur, spec['table'], spec['key'])
+    return rows, time.monotonic() - started
+
+
+def load_columnar(conn, spec, directory, chunk_rows=CHUNK_ROWS):
+    """Bulk load one columnar table (see sources.columnar), memory-mapped and in bounded chunks."""
+    started = time.monotonic()
+    rows = 0
+    with conn.cursor() as cur:
+        for chunk in iter_table(directory, chunk_rows, columns=set(spec['columns'])):
+            frame = add_fingerprints(prepare_frame(chunk, spec), spec)
+            copy_frame(cur, spec['table'], frame)
+            rows += len(frame)
+        if spec.get('key'):
+            reset_sequence(cur, spec['table'], spec['key'])
+    return rows, time.monotonic() - started
+
+
+def read_prepared(spec, path, chunk_rows=CHUNK_ROWS):
+    """Prepared, fingerprinted chunks of one normalised table, from its columnar copy when that is up to date."""
+    if newer_format(path) == 'columnar':
+        chunks = iter_table(columnar_dir(path), chunk_rows, columns=set(spec['columns']))
+    else:
+        chunks = pd.read_csv(path, chunksize=chunk_rows)
+    for chunk in chunks:
+        yield add_fingerprints(prepare_frame(chunk, spec), spec)
+
+
+def stage_table(cur, spec, path, chunk_rows=CHUNK_ROWS):
+    """COPY a normalised table into a temporary copy of its target table; returns the staging table name."""
+    stage = f"stage_{spec['table']}"
+    cur.execute(sql.SQL("CREATE TEMP TABLE {stage} (LIKE {table}) ON COMMIT DROP").format(
+        stage=sql.Identifier(stage), table=sql.Identifier(spec['table'])))
+    for frame in read_prepared(spec, path, chunk_rows):
+        copy_frame(cur, stage, frame)
+    cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(stage)))
+    return stage
+
+
+def merge_staged(cur, spec, stage):
+    """Insert new rows and update changed ones from ``stage``; returns (inserted, updated).
+
+    Rows whose fingerprint is unchanged are skipped by the ON CONFLICT
+    clause, so an unchanged listing is neither rewritten nor locked.
+    """
+    columns = list(spec['columns'].values()) + [FINGERPRINT_COLUMN]
+    target, key = sql.Identifier(spec['table']), sql.Identifier(spec['key'])
+    cur.execute(sql.SQL("""
+        WITH upserted AS (
+            INSERT INTO {target} AS t ({columns})
+            SELECT {columns} FROM {stage}
+            ON CONFLICT ({key}) DO UPDATE SET {updates}
+            WHERE t.{fingerprint} IS DISTINCT FROM EXCLUDED.{fingerprint}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM upserted
+    """).format(
+        target=target,
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in columns),
+        stage=sql.Identifier(stage),
+        key=key,
+        updates=sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+            for column in columns if column != spec['key']),
+        fingerprint=sql.Identifier(FINGERPRINT_COLUMN)))
+    return cur.fetchone()
+
+
+def delete_unstaged(cur, spec, stage):
+    """Delete the rows of a table whose key is no longer in the staged data; returns the count."""
+    cur.execute(sql.SQL(
+        "DELETE FROM {target} t WHERE NOT EXISTS (SELECT 1 FROM {stage} s WHERE s.{key} = t.{key})"
+    ).format(target=sql.Identifier(spec['table']), stage=sql.Identifier(stage),
+             key=sql.Identifier(spec['key'])))
+    return cur.rowcount
+
+
+def upsert_tables(conn, specs, path_for, chunk_rows=CHUNK_ROWS):
+    """Apply a new set of normalised files to populated tables as inserts, updates and deletes.
+
+    Every table is staged with COPY, then rows are upserted parents first
+    and removed rows deleted children first, all in one transaction:
+    readers keep seeing the previous data until the commit and are never
+    blocked by a dropped table. Returns the row counts per table.
+    """
+    report = {}
+    try:
+        with conn.cursor() as cur:
+            # Tables created before fingerprints were stored get the column on their first refresh.
+            # ALTER TABLE locks out readers, so it is committed on its own before the long transaction.
+            for spec in specs:
+                cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} BIGINT").format(
+                    sql.Identifier(spec['table']), sql.Identifier(FINGERPRINT_COLUMN)))
+            conn.commit()
+
+            stages = {}
+            for spec in specs:
+                started = time.monotonic()
+                stages[spec['table']] = stage_table(cur, spec, path_for(spec['file']), chunk_rows)
+                inserted, updated = merge_staged(cur, spec, stages[spec['table']])
+                report[spec['table']] = {'inserted': inserted, 'updated': updated,
+                                         'seconds': time.monotonic() - started}
+            for spec in reversed(specs):
+                report[spec['table']]['deleted'] = delete_unstaged(cur, spec, stages[spec['table']])
+                reset_sequence(cur, spec['table'], spec['key'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for table, counts in report.items():
+        print(f"{table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+              f"{counts['deleted']} deleted in {counts['seconds']:.2f}s")
+    return report
+
+
+def load_table(conn, spec, path, chunk_rows=CHUNK_ROWS):
+    """Load one table from its columnar copy when there is an up-to-date one, otherwise from its CSV file.
+
+    Returns the table's report entry; the caller commits.
+    """
+    source_format = newer_format(path)
+    if source_format == 'columnar':
+        rows, elapsed = load_columnar(conn, spec, columnar_dir(path), chunk_rows)
+    else:
+        rows, elapsed = load_csv(conn, spec, path, chunk_rows)
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f"{spec['table']}: {rows} rows from {source_format} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rate, 'format': source_format}
+
+
+def load_tables(conn, specs, path_for, chunk_rows=CHUNK_ROWS):
+    """Load every table spec in order (parents before children) in one transaction and report throughput."""
+    report = {}
+    try:
+        for spec in specs:
+            report[spec['table']] = load_table(conn, spec, path_for(spec['file']), chunk_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return report
+
+
+def load_tables_parallel(connect, specs, path_for, chunk_rows=CHUNK_ROWS, workers=None):
+    """Load every table spec at the same time, each over its own connection from ``connect()``.
+
+    Only for freshly created tables without foreign keys (add them
+    afterwards with add_foreign_keys): each table commits on its own, so a
+    failed load leaves the others in place and the database must be
+    recreated before retrying.
+    """
+    def load(spec):
+        conn = connect()
+        try:
+            entry = load_table(conn, spec, path_for(spec['file']), chunk_rows)
+            conn.commit()
+            return entry
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers or len(specs)) as executor:
+        entries = list(executor.map(load, specs))
+    return {spec['table']: entry for spec, entry in zip(specs, entries)}
+
+
+def add_foreign_keys(conn, foreign_keys):
+    """Add foreign key constraints to loaded tables, skipping those that already exist.
+
+    Constraints get PostgreSQL's default name (<table>_<column>_fkey), so
+    ones declared inline by older schemas are recognised too.
+    """
+    with conn.cursor() as cur:
+        for foreign_key in foreign_keys:
+            name = f"{foreign_key['table']}_{foreign_key['column']}_fkey"
+            cur.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (name,))
+            if cur.fetchone():
+                continue
+            started = time.monotonic()
+            cur.execute(sql.SQL(
+                "ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {parent} ({key})"
+            ).format(table=sql.Identifier(foreign_key['table']), name=sql.Identifier(name),
+                     column=sql.Identifier(foreign_key['column']),
+                     parent=sql.Identifier(foreign_key['parent']), key=sql.Identifier(foreign_key['key'])))
+            print(f"Foreign key {name} validated in {time.monotonic() - started:.2f}s")
+    conn.commit()
@@ -0,0 +1,234 @@
+# sources/cache.py
+
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a cached result stays valid, per source. A combined result lives as
+# long as the shortest TTL among the sources it was built from.
+DEFAULT_TTL = 60
+SOURCE_TTLS = {
+    'source_2': 300,
+    'source_3': 120
+}
+
+# Bounds on the whole cache; the least recently used entries go first
+MAX_ENTRIES = 512
+MAX_BYTES = 64 * 1024 * 1024
+
+# Directory for state files shared by the processes of one host (key maps, linkage
+# index, logs, profiles)
+STATE_DIR = os.environ.get(
+    'RESULT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache'))
+
+# One generation marker per source, kept in a table of this source's database.
+# Bumping a marker (for example from populate.py after a reload) invalidates every
+# entry built from that source in every process, on every host that reaches the
+# database: System A's loader and the mediator need not share a disk.
+GENERATION_STORE = 'source_3'
+
+# Seconds a process reuses its snapshot of the markers before reading them again,
+# so cache lookups do not query the database each time
+GENERATION_TTL = float(os.environ.get('RESULT_CACHE_GENERATION_TTL', '2'))
+
+_snapshot = {'generations': None, 'fetched_at': 0.0}
+_refresh_lock = threading.Lock()
+
+
+def _store_pool():
+    # Imported here, so scripts that only need STATE_DIR do not pull in psycopg2
+    from sources.pool import get_pool
+    return get_pool(GENERATION_STORE)
+
+
+def _read_generations():
+    with _store_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('cache_generations') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return {}
+            cur.execute("SELECT source, generation FROM cache_generations")
+            return dict(cur.fetchall())
+
+
+def _refresh_generations():
+    try:
+        generations = _read_generations()
+    except Exception as e:
+        # Keep serving with the last snapshot; the next refresh retries
+        print(f"Cache generations not refreshed: {e}")
+        generations = _snapshot['generations'] or {}
+    _snapshot['generations'] = generations
+    _snapshot['fetched_at'] = time.monotonic()
+    return generations
+
+
+def source_generation(source_name, fresh=False):
+    """Current generation marker of ``source_name`` ('' before its first invalidation).
+
+    Reads a snapshot at most GENERATION_TTL seconds old; ``fresh=True``
+    reads the database. While one thread refreshes a stale snapshot, the
+    others keep using the previous one instead of waiting for it.
+    """
+    generations = _snapshot['generations']
+    stale = time.monotonic() - _snapshot['fetched_at'] > GENERATION_TTL
+    if generations is None or fresh:
+        with _refresh_lock:
+            generations = _refresh_generations()
+    elif stale and _refresh_lock.acquire(blocking=False):
+        try:
+            generations = _refresh_generations()
+        finally:
+            _refresh_lock.release()
+    return generations.get(source_name, '')
+
+
+def invalidate_source(source_name):
+    """Mark every cached result built from ``source_name`` as stale, across processes and hosts.
+
+    Best-effort: a host that cannot reach the generation store (System A's
+    loader, for one) logs it and carries on, and the cached results expire
+    with their TTL instead. Returns whether the marker was bumped.
+    """
+    generation = f"{time.time_ns()}-{os.getpid()}"
+    try:
+        with _store_pool().connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS cache_generations (
+                        source TEXT PRIMARY KEY,
+                        generation TEXT NOT NULL
+                    )
+                """)
+                cur.execute("""
+                    INSERT INTO cache_generations (source, generation) VALUES (%s, %s)
+                    ON CONFLICT (source) DO UPDATE SET generation = EXCLUDED.generation
+                """, (source_name, generation))
+            conn.commit()
+    except Exception as e:
+        print(f"Cached results for {source_name} not invalidated, they expire with their TTL: {e}")
+        return False
+    # This process sees its own invalidation at once
+    with _refresh_lock:
+        _refresh_generations()
+    print(f"Cached results for {source_name} invalidated.")
+    return True
+
+
+def canonical_search(filters, hide_duplicates=False):
+    """Canonical, hashable form of a search: ILIKE filters are case-insensitive, so text is lowercased."""
+    canonical = {
+        field: value.lower() if isinstance(value, str) else value
+        for field, value in filters.items()
+    }
+    canonical['hide_duplicates'] = bool(hide_duplicates)
+    return json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+
+
+# Rows pickled to estimate the size of a cached result, whatever its row count
+SIZE_SAMPLE_ROWS = 8
+ENTRY_OVERHEAD = 512
+
+
+def estimate_size(value):
+    """Approximate bytes held by a cached result: its row count times the size of a few sampled rows.
+
+    ``value`` is a list of rows or a tuple whose first item is one, as cached
+    by the mediator; anything else is measured whole.
+    """
+    rows = value[0] if isinstance(value, tuple) and value and isinstance(value[0], list) else value
+    if not isinstance(rows, list):
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    if not rows:
+        return ENTRY_OVERHEAD
+    sample = rows[:SIZE_SAMPLE_ROWS]
+    per_row = len(pickle.dumps(sample, pickle.HIGHEST_PROTOCOL)) / len(sample)
+    return ENTRY_OVERHEAD + int(per_row * len(rows))
+
+
+class ResultCache:
+    """Thread-safe LRU cache of search results with per-entry TTLs and a memory bound."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0, 'evicted': 0}
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            if entry['expires_at'] <= time.monotonic():
+                self._drop(key)
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+        # Checked outside the lock: refreshing the generations may query the database
+        if any(source_generation(source_name) != generation
+               for source_name, generation in entry['generations'].items()):
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._drop(key)
+                self._counters['invalidated'] += 1
+                self._counters['misses'] += 1
+            return None
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+        return entry['value']
+
+    def generations(self, sources):
+        """Snapshot source generations; take it before fetching so a reload during the fetch is not missed."""
+        return {source_name: source_generation(source_name) for source_name in sources}
+
+    def put(self, key, value, sources, ttl=None, generations=None):
+        if ttl is None:
+            ttl = min(SOURCE_TTLS.get(source_name, DEFAULT_TTL) for source_name in sources)
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        entry = {
+            'value': value,
+            'size': size,
+            'expires_at': time.monotonic() + ttl,
+            'generations': generations if generations is not None else self.generations(sources)
+        }
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters['evicted'] += 1
+
+    def invalidate(self, source_name=None):
+        """Drop entries built from ``source_name`` (or everything) in this process."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if source_name is None or source_name in entry['generations']]
+            for key in stale:
+                self._drop(key)
+            self._counters['invalidated'] += len(stale)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), bytes=self._bytes,
+                         max_entries=self.max_entries, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,146 @@
+# sources/columnar.py
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Name of the file describing a table's columns; written last, so its presence marks a complete table
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+def columnar_dir(csv_path):
+    """Columnar counterpart of a normalised CSV: normalized/properties.csv -> normalized/columnar/properties/."""
+    csv_path = Path(csv_path)
+    return csv_path.parent / 'columnar' / csv_path.stem
+
+
+def has_table(directory):
+    return (Path(directory) / MANIFEST).exists()
+
+
+def _write_strings(values, directory, stem):
+    """utf-8 blob plus int64 offsets (n + 1) and a null mask."""
+    mask = pd.isna(values)
+    encoded = [b'' if missing else str(value).encode('utf-8') for value, missing in zip(values, mask)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    with open(directory / f'{stem}.bin', 'wb') as blob:
+        blob.write(b''.join(encoded))
+    np.save(directory / f'{stem}.offsets.npy', offsets)
+    np.save(directory / f'{stem}.mask.npy', np.asarray(mask, dtype=bool))
+
+
+def _read_strings(directory, stem, start, stop, mmap_mode):
+    offsets = np.load(directory / f'{stem}.offsets.npy', mmap_mode=mmap_mode)
+    if stop is None:
+        stop = len(offsets) - 1
+    offsets = offsets[start:stop + 1]
+    mask = np.load(directory / f'{stem}.mask.npy', mmap_mode=mmap_mode)[start:stop]
+    blob_path = directory / f'{stem}.bin'
+    if os.path.getsize(blob_path):
+        blob = np.memmap(blob_path, dtype=np.uint8, mode='r')[offsets[0]:offsets[-1]].tobytes()
+    else:
+        blob = b''
+    relative = (offsets - offsets[0]).tolist()
+    return np.array([
+        None if missing else blob[relative[i]:relative[i + 1]].decode('utf-8')
+        for i, missing in enumerate(mask.tolist())
+    ], dtype=object)
+
+
+def write_table(frame, directory):
+    """Write ``frame`` as one typed file set per column plus a manifest, replacing any previous copy.
+
+    Numpy-typed columns are saved as-is, nullable pandas columns as values
+    plus a null mask, text as a utf-8 blob with offsets, and categoricals as
+    their codes plus the category strings.
+    """
+    directory = Path(directory)
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+
+    columns = []
+    for position, (name, series) in enumerate(frame.items()):
+        stem = f'c{position}'
+        column = {'name': name, 'stem': stem, 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            column['kind'] = 'category'
+            np.save(directory / f'{stem}.codes.npy', series.cat.codes.to_numpy())
+            _write_strings(np.asarray(series.cat.categories, dtype=object), directory, f'{stem}.categories')
+        elif isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and series.dtype.kind in 'biuf':
+            column['kind'] = 'masked'
+            numpy_dtype = np.dtype(series.dtype.numpy_dtype)
+            np.save(directory / f'{stem}.npy', series.to_numpy(dtype=numpy_dtype, na_value=numpy_dtype.type(0)))
+            np.save(directory / f'{stem}.mask.npy', series.isna().to_numpy())
+        elif series.dtype.kind in 'biuf':
+            column['kind'] = 'numeric'
+            np.save(directory / f'{stem}.npy', series.to_numpy())
+        else:
+            column['kind'] = 'string'
+            _write_strings(series.to_numpy(dtype=object), directory, stem)
+        columns.append(column)
+
+    manifest = {'version': FORMAT_VERSION, 'rows': len(frame), 'columns': columns}
+    with open(directory / (MANIFEST + '.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(directory / (MANIFEST + '.tmp'), directory / MANIFEST)
+
+
+def newer_format(path):
+    """'columnar' when a complete columnar copy of the CSV ``path`` exists and is not older than it, else 'csv'."""
+    directory = columnar_dir(path)
+    if not has_table(directory):
+        return 'csv'
+    if os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(directory / MANIFEST):
+        return 'csv'
+    return 'columnar'
+
+
+def read_manifest(directory):
+    with open(Path(directory) / MANIFEST) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_table(directory, columns=None, start=0, stop=None, mmap=True):
+    """Read rows ``start:stop`` of a columnar table with their exact dtypes.
+
+    Column files are memory-mapped, so only the pages of the requested rows
+    and columns are read from disk.
+    """
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    stop = manifest['rows'] if stop is None else min(stop, manifest['rows'])
+    mmap_mode = 'r' if mmap else None
+    data = {}
+    for column in manifest['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        stem, kind = column['stem'], column['kind']
+        if kind == 'category':
+            codes = np.load(directory / f'{stem}.codes.npy', mmap_mode=mmap_mode)[start:stop]
+            categories = _read_strings(directory, f'{stem}.categories', 0, None, mmap_mode)
+            values = pd.Categorical.from_codes(np.asarray(codes), categories=categories)
+        elif kind == 'masked':
+            raw = np.asarray(np.load(directory / f'{stem}.npy', mmap_mode=mmap_mode)[start:stop])
+            mask = np.asarray(np.load(directory / f'{stem}.mask.npy', mmap_mode=mmap_mode)[start:stop])
+            values = pd.array(raw, dtype=column['dtype'])
+            values[mask] = pd.NA
+        elif kind == 'numeric':
+            values = np.load(directory / f'{stem}.npy', mmap_mode=mmap_mode)[start:stop]
+        else:
+            values = _read_strings(directory, stem, start, stop, mmap_mode)
+        data[column['name']] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(start, stop))
+
+
+def iter_table(directory, chunk_rows, columns=None):
+    """Read a columnar table in row chunks; memory is bounded by ``chunk_rows``."""
+    rows = read_manifest(directory)['rows']
+    for start in range(0, rows, chunk_rows):
+        yield read_table(directory, columns, start, start + chunk_rows)
@@ -0,0 +1,197 @@
+# sources/comparison.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from sources.blocking import normalise_text
+
+# Strings are compared on at most this many characters / tokens
+MAX_CHARS = 64
+MAX_TOKENS = 16
+
+# Candidate pairs scored per block; each block is one task for the process pool
+BATCH_SIZE = 20000
+
+# Worker processes for the comparison; 1 keeps everything in-process
+WORKERS = int(os.environ.get('LINKAGE_WORKERS', os.cpu_count() or 1))
+
+STRING_FIELDS = ['name', 'location']
+NUMERIC_FIELDS = ['price', 'total_area', 'price_per_sqft']
+
+
+def encode_strings(values, max_chars=MAX_CHARS):
+    """Pack strings into a zero-padded (n, max_len) array of code points plus their lengths."""
+    texts = [value[:max_chars] for value in values]
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    width = max(int(lengths.max()) if len(texts) else 0, 1)
+    codes = np.zeros((len(texts), width), dtype=np.uint32)
+    for row, text in enumerate(texts):
+        if text:
+            codes[row, :len(text)] = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    return codes, lengths
+
+
+def encode_tokens(values, vocabulary, max_tokens=MAX_TOKENS):
+    """Pack each string's distinct tokens into a -1 padded (n, max_tokens) array of token ids."""
+    tokens = np.full((len(values), max_tokens), -1, dtype=np.int64)
+    for row, text in enumerate(values):
+        ids = sorted({vocabulary.setdefault(token, len(vocabulary)) for token in text.split()})[:max_tokens]
+        tokens[row, :len(ids)] = ids
+    return tokens
+
+
+def levenshtein_similarity(a, len_a, b, len_b):
+    """1 - edit distance / longer length, for every row pair of two code-point arrays at once."""
+    pairs, width_a = a.shape
+    width_b = b.shape[1]
+    distance = np.zeros(pairs, dtype=np.int64)
+    previous = np.tile(np.arange(width_b + 1, dtype=np.int64), (pairs, 1))
+    distance[len_a == 0] = len_b[len_a == 0]
+    for i in range(width_a):
+        current = np.empty_like(previous)
+        current[:, 0] = i + 1
+        for j in range(width_b):
+            cost = (a[:, i] != b[:, j]).astype(np.int64)
+            current[:, j + 1] = np.minimum(np.minimum(previous[:, j + 1] + 1, current[:, j] + 1),
+                                           previous[:, j] + cost)
+        done = len_a == i + 1
+        distance[done] = current[done, len_b[done]]
+        previous = current
+    longest = np.maximum(len_a, len_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(longest == 0, 1.0, 1.0 - distance / longest)
+
+
+def jaro_winkler_similarity(a, len_a, b, len_b, prefix_scale=0.1):
+    """Jaro-Winkler similarity for every row pair of two code-point arrays at once."""
+    pairs, width_a = a.shape
+    width_b = b.shape[1]
+    window = np.maximum(np.maximum(len_a, len_b) // 2 - 1, 0)
+    matched_a = np.zeros((pairs, width_a), dtype=bool)
+    matched_b = np.zeros((pairs, width_b), dtype=bool)
+
+    # Greedy matching: each character of a takes the first free equal character of b in the window
+    for i in range(width_a):
+        valid_i = i < len_a
+        for j in range(max(0, i - int(window.max())), min(width_b, i + int(window.max()) + 1)):
+            match = (valid_i & (j < len_b) & (np.abs(i - j) <= window)
+                     & ~matched_a[:, i] & ~matched_b[:, j] & (a[:, i] == b[:, j]))
+            matched_a[:, i] |= match
+            matched_b[:, j] |= match
+
+    matches = matched_a.sum(axis=1)
+    # Matched characters in order, to count transpositions
+    width = max(width_a, width_b)
+    ordered_a = np.full((pairs, width), -1, dtype=np.int64)
+    ordered_b = np.full((pairs, width), -1, dtype=np.int64)
+    rows_a, cols_a = np.nonzero(matched_a)
+    ordered_a[rows_a, (np.cumsum(matched_a, axis=1) - 1)[rows_a, cols_a]] = a[rows_a, cols_a]
+    rows_b, cols_b = np.nonzero(matched_b)
+    ordered_b[rows_b, (np.cumsum(matched_b, axis=1) - 1)[rows_b, cols_b]] = b[rows_b, cols_b]
+    transpositions = (ordered_a != ordered_b).sum(axis=1) // 2
+
+    # No matches scores 0, including two empty strings, as in jellyfish and recordlinkage
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jaro = np.where(
+            matches == 0, 0.0,
+            (matches / len_a + matches / len_b + (matches - transpositions) / matches) / 3.0)
+
+    # Winkler boost for a common prefix of up to four characters
+    prefix_width = min(4, width_a, width_b)
+    same = (a[:, :prefix_width] == b[:, :prefix_width]) & (np.arange(prefix_width) < np.minimum(len_a, len_b)[:, None])
+    prefix = np.cumprod(same, axis=1).sum(axis=1)
+    return np.where(jaro > 0.7, jaro + prefix * prefix_scale * (1.0 - jaro), jaro)
+
+
+def token_set_similarity(tokens_a, tokens_b):
+    """Jaccard similarity of the token sets of every row pair."""
+    shared = ((tokens_a[:, :, None] == tokens_b[:, None, :]) & (tokens_a[:, :, None] >= 0)).sum(axis=(1, 2))
+    union = (tokens_a >= 0).sum(axis=1) + (tokens_b >= 0).sum(axis=1) - shared
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union == 0, 1.0, shared / union)
+
+
+def numeric_similarity(a, b):
+    """1 - relative difference; 1 when both are zero and 0 when either is missing."""
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    largest = np.maximum(np.abs(a), np.abs(b))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = np.where(largest == 0, 1.0, 1.0 - np.abs(a - b) / largest)
+    return np.where(np.isnan(similarity), 0.0, np.clip(similarity, 0.0, 1.0))
+
+
+def compare_block(block):
+    """Score one block of pairs; runs inside a worker process."""
+    features = {}
+    for field in block['string_fields']:
+        left, right = block['left'][field], block['right'][field]
+        codes_a, len_a = encode_strings(left)
+        codes_b, len_b = encode_strings(right)
+        features[f'{field}_jw'] = jaro_winkler_similarity(codes_a, len_a, codes_b, len_b)
+        features[f'{field}_lev'] = levenshtein_similarity(codes_a, len_a, codes_b, len_b)
+        vocabulary = {}
+        features[f'{field}_tokens'] = token_set_similarity(encode_tokens(left, vocabulary),
+                                                           encode_tokens(right, vocabulary))
+    for field in block['numeric_fields']:
+        features[f'{field}_sim'] = numeric_similarity(block['left'][field], block['right'][field])
+    return features
+
+
+class ComparisonEngine:
+    """Vectorised pairwise comparison of candidate record pairs.
+
+    String fields get Jaro-Winkler, normalised Levenshtein and token-set
+    similarities, numeric fields a relative-difference similarity. Pairs are
+    cut into blocks of ``batch_size`` and scored across ``workers``
+    processes.
+    """
+
+    def __init__(self, string_fields=None, numeric_fields=None, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.string_fields = list(STRING_FIELDS if string_fields is None else string_fields)
+        self.numeric_fields = list(NUMERIC_FIELDS if numeric_fields is None else numeric_fields)
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+
+    def _blocks(self, records, first, second):
+        strings = {field: np.array([normalise_text(value) for value in records[field]], dtype=object)
+                   for field in self.string_fields}
+        numbers = {field: pd.to_numeric(pd.Series(list(records[field]), dtype=object), errors='coerce')
+                   .to_numpy(dtype=float) for field in self.numeric_fields}
+        for start in range(0, len(first), self.batch_size):
+            left = first[start:start + self.batch_size]
+            right = second[start:start + self.batch_size]
+            columns = {**strings, **numbers}
+            yield {
+                'string_fields': self.string_fields,
+                'numeric_fields': self.numeric_fields,
+                # Only the values this block needs are shipped to the worker
+                'left': {field: values[left] for field, values in columns.items()},
+                'right': {field: values[right] for field, values in columns.items()}
+            }
+
+    def compute(self, records, pairs):
+        """Score ``pairs`` of positional indexes into ``records``; returns one feature row per pair.
+
+        ``records`` is a DataFrame or any mapping of field name to a sequence of values.
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        first, second = pairs[:, 0], pairs[:, 1]
+        blocks = self._blocks(records, first, second)
+        if self.workers == 1 or len(pairs) <= self.batch_size:
+            results = [compare_block(block) for block in blocks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(compare_block, blocks))
+
+        columns = ([f'{field}_{kind}' for field in self.string_fields for kind in ('jw', 'lev', 'tokens')]
+                   + [f'{field}_sim' for field in self.numeric_fields])
+        features = {
+            column: np.concatenate([result[column] for result in results]) if results else np.empty(0)
+            for column in columns
+        }
+        index = pd.MultiIndex.from_arrays([first, second])
+        return pd.DataFrame(features, index=index)
@@ -0,0 +1,202 @@
+# sources/compiler.py
+
+import math
+
+from psycopg2 import sql
+
+from sources import QUERY_FUNCTIONS, RESULT_LIMIT, SORT_KEYS, SOURCE_3_PRICE
+
+# Search form fields and how each one is turned into a predicate
+TEXT_FILTERS = {
+    'property_name': 'property_name',
+    'city': 'city',
+    'location': 'location',
+    'property_type': 'property_type'
+}
+RANGE_FILTERS = {
+    'min_price': ('price', '>='),
+    'max_price': ('price', '<='),
+    'min_area': ('area', '>='),
+    'max_area': ('area', '<='),
+    'min_rooms': ('rooms', '>=')
+}
+NUMERIC_FIELDS = {
+    'min_price': float,
+    'max_price': float,
+    'min_area': float,
+    'max_area': float,
+    'min_rooms': int
+}
+FLAG_FILTERS = {
+    'has_balcony': 'balcony'
+}
+
+# Column (or expression) holding each logical attribute in each source.
+# None means the source does not record the attribute, so any filter on it
+# matches nothing in that source.
+COLUMN_MAPPINGS = {
+    'source_2': {
+        'property_name': sql.Identifier('p', 'property_name'),
+        'city': sql.Identifier('c', 'city'),
+        'location': sql.Identifier('l', 'location'),
+        'property_type': sql.Identifier('pt', 'property_type'),
+        'price': sql.Identifier('p', 'price'),
+        'area': sql.Identifier('p', 'total_area_sqft'),
+        'rooms': sql.Identifier('r', 'total_rooms'),
+        'balcony': sql.Identifier('p', 'balcony')
+    },
+    'source_3': {
+        'property_name': sql.Identifier('p', 'name'),
+        'city': None,
+        'location': sql.Identifier('l', 'location'),
+        'property_type': None,
+        'price': SOURCE_3_PRICE,
+        'area': sql.Identifier('p', 'total_area'),
+        'rooms': sql.Identifier('f', 'baths'),
+        'balcony': sql.Identifier('f', 'balcony')
+    }
+}
+
+
+# Values a flag field may take, as sent by a form checkbox, a query string or JSON
+FLAG_VALUES = {
+    'true': True, 'false': False,
+    'yes': True, 'no': False,
+    'on': True, 'off': False,
+    '1': True, '0': False,
+    '': False
+}
+
+
+def _text(field, value):
+    # JSON filters may carry numbers for text fields ("city": 5); objects and lists are rejected
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"{field} must be a string, not {type(value).__name__}")
+    return str(value).strip()
+
+
+def _flag(field, value):
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    flag = FLAG_VALUES.get(_text(field, value).lower())
+    if flag is None:
+        raise ValueError(f"{field} must be true or false, not {value!r}")
+    return flag
+
+
+def _number(field, cast, value):
+    # Unparseable numbers are ignored; NaN, infinities and booleans are not numbers here
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    try:
+        number = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def parse_search_form(form_data):
+    """Turn the raw search form into a structured filter.
+
+    Blank fields are dropped, numbers are converted and unparseable numbers
+    are ignored, so the result only holds filters that should be applied.
+    Text fields may be strings or numbers and flags booleans or their usual
+    spellings ('true'/'false', 'on', '1'/'0'); other values raise
+    ValueError, as does a form that is not a mapping.
+    """
+    if not hasattr(form_data, 'get'):
+        raise ValueError("search filters must be an object")
+    filters = {}
+    for field in TEXT_FILTERS:
+        value = _text(field, form_data.get(field))
+        if value:
+            filters[field] = value
+    for field, cast in NUMERIC_FIELDS.items():
+        value = form_data.get(field)
+        if value in (None, ''):
+            continue
+        number = _number(field, cast, value)
+        if number is None:
+            print(f"Ignoring invalid value for {field}: {value!r}")
+        else:
+            filters[field] = number
+    for field in FLAG_FILTERS:
+        if _flag(field, form_data.get(field)):
+            filters[field] = True
+    return filters
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def compile_predicate(source_name, filters):
+    """Compile a structured filter into a WHERE predicate for one source.
+
+    Returns ``(predicate, params)`` where ``predicate`` is a
+    ``psycopg2.sql.Composed`` using ``%s`` placeholders and ``params`` the
+    values to bind. Columns are compared directly (no COALESCE) so that
+    Postgres can use their indexes; rows with a NULL in a filtered column
+    do not match.
+    """
+    mapping = COLUMN_MAPPINGS[source_name]
+    clauses = []
+    params = []
+
+    for field, attribute in TEXT_FILTERS.items():
+        if field not in filters:
+            continue
+        column = mapping.get(attribute)
+        if column is None:
+            clauses.append(sql.SQL("FALSE"))
+            continue
+        clauses.append(sql.SQL("{} ILIKE %s").format(column))
+        params.append(f"%{_escape_like(filters[field])}%")
+
+    for field, (attribute, operator) in RANGE_FILTERS.items():
+        if field not in filters:
+            continue
+        column = mapping.get(attribute)
+        if column is None:
+            clauses.append(sql.SQL("FALSE"))
+            continue
+        clauses.append(sql.SQL("{} {} %s").format(column, sql.SQL(operator)))
+        params.append(filters[field])
+
+    for field, attribute in FLAG_FILTERS.items():
+        if not filters.get(field):
+            continue
+        column = mapping.get(attribute)
+        if column is None:
+            clauses.append(sql.SQL("FALSE"))
+            continue
+        clauses.append(sql.SQL("{} IS TRUE").format(column))
+
+    if not clauses:
+        return sql.Composed([sql.SQL("TRUE")]), params
+    return sql.SQL(" AND ").join(clauses), params
+
+
+def compile_query(source_name, filters, limit=None):
+    """Build the full source query with the filter pushed into its WHERE clause."""
+    predicate, params = compile_predicate(source_name, filters)
+    query = QUERY_FUNCTIONS[source_name](predicate, limit or RESULT_LIMIT)
+    return query, params
+
+
+def compile_page_query(source_name, filters, page_size, after=None):
+    """Build one keyset page of a source: rows ordered by its sort key, strictly after ``after``.
+
+    ``after`` is the ``(price, key)`` of the last row already seen from this
+    source, or None for the first page.
+    """
+    predicate, params = compile_predicate(source_name, filters)
+    if after is not None:
+        price, key = SORT_KEYS[source_name]
+        keyset = sql.SQL("({}, {}) > (%s::numeric, %s)").format(price, key)
+        predicate = sql.SQL("({}) AND {}").format(predicate, keyset)
+        params = params + [str(after[0]), after[1]]
+    query = QUERY_FUNCTIONS[source_name](predicate, page_size, paged=True)
+    return query, params
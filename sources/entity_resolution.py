@@ -0,0 +1,526 @@
+# sources/entity_resolution.py
+
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+import psycopg2
+
+from sources import CONNECTION_PARAMS, QUERY_FUNCTIONS
+from sources.blocking import BlockingIndex
+from sources.bulk_load import copy_frame
+from sources.cache import STATE_DIR, invalidate_source, source_generation
+from sources.comparison import ComparisonEngine
+
+# Database (local to the mediator) that stores the linkage result
+ENTITY_STORE = 'source_3'
+
+# Generation marker bumped whenever the cluster table is rewritten
+CLUSTER_MARKER = 'entity_clusters'
+
+# Blocking index of every linked listing, kept between runs so new listings
+# can be linked without re-indexing the whole corpus
+INDEX_PATH = os.path.join(STATE_DIR, 'linkage_index.pickle')
+
+# Layout of the pickled index; an index saved in another layout is rebuilt by a full run
+INDEX_FORMAT = 3
+
+# Jaro-Winkler similarity both name and location must reach for two listings to match
+MATCH_THRESHOLD = 0.85
+
+# Identifier, name, location and numeric attributes of every listing, per source
+LINKAGE_COLUMNS = ['source_id', 'name', 'location', 'price', 'total_area', 'price_per_sqft']
+LINKAGE_QUERIES = {
+    'source_2': """
+        SELECT p.property_id, p.property_name, l.location,
+               p.price, p.total_area_sqft, p.price_per_sqft
+        FROM properties p
+        LEFT JOIN locations l ON p.location_id = l.location_id
+    """,
+    'source_3': """
+        SELECT p.propertyid, p.name, l.location,
+               pr.price_inr, p.total_area, pr.price_per_sqft
+        FROM properties p
+        LEFT JOIN location l ON p.locationid = l.locationid
+        LEFT JOIN pricing pr ON p.propertyid = pr.propertyid
+    """
+}
+LINKAGE_KEYS = {
+    'source_2': 'p.property_id',
+    'source_3': 'p.propertyid'
+}
+# Content fingerprint of each listing: its properties row and its location row (see
+# sources.bulk_load.add_fingerprints); a listing whose fingerprint changed is re-linked
+FINGERPRINT_QUERIES = {
+    'source_2': """
+        SELECT p.property_id, p.row_hash, l.row_hash
+        FROM properties p
+        LEFT JOIN locations l ON p.location_id = l.location_id
+    """,
+    'source_3': """
+        SELECT p.propertyid, p.row_hash, l.row_hash
+        FROM properties p
+        LEFT JOIN location l ON p.locationid = l.locationid
+    """
+}
+
+# Cluster assignments the mediator keeps in memory; past this many it starts over
+CLUSTER_CACHE_SIZE = 100000
+
+# A stored match between two listings; (source_a, source_id_a) is the earlier one in the index
+LINK_COLUMNS = ['source_a', 'source_id_a', 'source_b', 'source_id_b', 'score']
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self.rank[first] < self.rank[second]:
+            first, second = second, first
+        self.parent[second] = first
+        if self.rank[first] == self.rank[second]:
+            self.rank[first] += 1
+
+
+def listing_keys(listings):
+    return [(source, int(source_id)) for source, source_id in zip(listings['source'], listings['source_id'])]
+
+
+def listing_fingerprints():
+    """(source, source_id) -> content fingerprint of every listing currently in the sources."""
+    fingerprints = {}
+    for source_name in QUERY_FUNCTIONS:
+        conn = psycopg2.connect(**CONNECTION_PARAMS[source_name])
+        try:
+            with conn.cursor() as cur:
+                cur.execute(FINGERPRINT_QUERIES[source_name])
+                fingerprints.update(((source_name, source_id), (row_hash, location_hash))
+                                    for source_id, row_hash, location_hash in cur.fetchall())
+        finally:
+            conn.close()
+    return fingerprints
+
+
+def load_listings(keys=None):
+    """Read listings' identifier, name, location and numeric attributes from all sources.
+
+    With ``keys`` only those (source, source_id) listings are read.
+    """
+    frames = []
+    for source_name in QUERY_FUNCTIONS:
+        query, params = LINKAGE_QUERIES[source_name], None
+        if keys is not None:
+            ids = sorted(source_id for source, source_id in keys if source == source_name)
+            if not ids:
+                continue
+            query += f" WHERE {LINKAGE_KEYS[source_name]} = ANY(%s)"
+            params = (ids,)
+        conn = psycopg2.connect(**CONNECTION_PARAMS[source_name])
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                frame = pd.DataFrame(cur.fetchall(), columns=LINKAGE_COLUMNS)
+        finally:
+            conn.close()
+        # A listing with several pricing rows is linked once
+        frame = frame.drop_duplicates('source_id')
+        frame.insert(0, 'source', source_name)
+        frames.append(frame)
+        print(f"{source_name}: {len(frame)} listings")
+    if not frames:
+        return pd.DataFrame(columns=['source'] + LINKAGE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def match_pairs(listings, key_pairs, threshold=MATCH_THRESHOLD, engine=None):
+    """Score candidate pairs of (source, source_id) keys and return the matching ones as links.
+
+    Two listings match when both their names and their locations reach
+    ``threshold`` Jaro-Winkler similarity.
+    """
+    if not key_pairs:
+        return pd.DataFrame(columns=LINK_COLUMNS)
+    listings = listings.reset_index(drop=True)
+    position = {key: offset for offset, key in enumerate(listing_keys(listings))}
+    # A listing deleted after it was indexed is missing from ``listings``; its pairs are skipped
+    pairs = [(position[first], position[second]) for first, second in sorted(key_pairs)
+             if first in position and second in position]
+    print(f"Candidate pairs: {len(pairs)} ({len(key_pairs) - len(pairs)} with a deleted listing skipped)")
+    if not pairs:
+        return pd.DataFrame(columns=LINK_COLUMNS)
+
+    engine = engine or ComparisonEngine()
+    started = time.monotonic()
+    features = engine.compute(listings, pairs)
+    elapsed = time.monotonic() - started
+    print(f"Compared {len(features)} pairs in {elapsed:.2f}s "
+          f"({len(features) / elapsed if elapsed else 0:.0f} pairs/s, {engine.workers} workers)")
+
+    matched = features[(features['name_jw'] >= threshold) & (features['location_jw'] >= threshold)]
+    first = listings.iloc[matched.index.get_level_values(0)]
+    second = listings.iloc[matched.index.get_level_values(1)]
+    return pd.DataFrame({
+        'source_a': first['source'].values,
+        'source_id_a': first['source_id'].values,
+        'source_b': second['source'].values,
+        'source_id_b': second['source_id'].values,
+        'score': ((matched['name_jw'] + matched['location_jw']) / 2).round(4).values
+    })
+
+
+def cluster_listings(listings, links, cluster_ids=None, next_cluster_id=1):
+    """Transitively cluster ``listings`` over the matched ``links``.
+
+    Returns a DataFrame of source, source_id, cluster_id and canonical. The
+    canonical representative of a cluster is its first listing in source
+    order (QUERY_FUNCTIONS) and then by id. A cluster keeps the id its
+    canonical listing had in ``cluster_ids``, so clusters survive
+    incremental runs under the same id; other clusters get fresh ids
+    counting from ``next_cluster_id``.
+    """
+    source_order = {source_name: order for order, source_name in enumerate(QUERY_FUNCTIONS)}
+    keys = sorted(listing_keys(listings), key=lambda key: (source_order[key[0]], key[1]))
+    position = {key: offset for offset, key in enumerate(keys)}
+    clusters = UnionFind(len(keys))
+    for first, second in zip(listing_keys(links.rename(columns={'source_a': 'source', 'source_id_a': 'source_id'})),
+                             listing_keys(links.rename(columns={'source_b': 'source', 'source_id_b': 'source_id'}))):
+        if first in position and second in position:
+            clusters.union(position[first], position[second])
+
+    cluster_ids = cluster_ids or {}
+    roots = [clusters.find(offset) for offset in range(len(keys))]
+    assigned = {}   # root -> (cluster id, offset of the canonical listing)
+    claimed = set()
+    for offset, root in enumerate(roots):
+        if root in assigned:
+            continue
+        # Keys are in canonical order, so the first listing seen for a root is its canonical one
+        cluster_id = cluster_ids.get(keys[offset])
+        if cluster_id is None or cluster_id in claimed:
+            cluster_id = next_cluster_id
+            next_cluster_id += 1
+        claimed.add(cluster_id)
+        assigned[root] = (cluster_id, offset)
+    return pd.DataFrame({
+        'source': [key[0] for key in keys],
+        'source_id': [key[1] for key in keys],
+        'cluster_id': [assigned[root][0] for root in roots],
+        'canonical': [assigned[root][1] == offset for offset, root in enumerate(roots)]
+    }, columns=['source', 'source_id', 'cluster_id', 'canonical'])
+
+
+def create_linkage_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS entity_clusters (
+            source VARCHAR(32),
+            source_id INT,
+            cluster_id INT,
+            canonical BOOLEAN,
+            PRIMARY KEY (source, source_id)
+        );
+        CREATE TABLE IF NOT EXISTS entity_links (
+            source_a VARCHAR(32),
+            source_id_a INT,
+            source_b VARCHAR(32),
+            source_id_b INT,
+            score REAL,
+            PRIMARY KEY (source_a, source_id_a, source_b, source_id_b)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entity_clusters_cluster_id ON entity_clusters (cluster_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entity_links_b ON entity_links (source_b, source_id_b)")
+
+
+def save_linkage(conn, clusters, links):
+    """Replace the stored clusters and links in one transaction."""
+    with conn.cursor() as cur:
+        create_linkage_tables(cur)
+        cur.execute("TRUNCATE entity_clusters, entity_links")
+        copy_frame(cur, 'entity_clusters', clusters)
+        copy_frame(cur, 'entity_links', links)
+    conn.commit()
+
+
+def _temp_listings(cur, table, keys):
+    cur.execute(f"CREATE TEMP TABLE {table} (source VARCHAR(32), source_id INT) ON COMMIT DROP")
+    copy_frame(cur, table, pd.DataFrame(sorted(keys), columns=['source', 'source_id']))
+
+
+def update_clusters(conn, added, removed, links):
+    """Store new links and re-cluster only the clusters they touch, in one transaction.
+
+    ``added`` and ``removed`` are the listing keys that entered and left the
+    sources; a changed listing is in both, so its old links are dropped and
+    it is linked again. Links only disappear together with a listing, so the clusters
+    of removed listings, of new listings' link partners and the new listings
+    themselves are closed under links: nothing outside them can change.
+    Returns the rebuilt clusters.
+    """
+    partners = set(listing_keys(links.rename(columns={'source_a': 'source', 'source_id_a': 'source_id'})))
+    partners |= set(listing_keys(links.rename(columns={'source_b': 'source', 'source_id_b': 'source_id'})))
+    with conn.cursor() as cur:
+        create_linkage_tables(cur)
+        _temp_listings(cur, 'removed_listings', removed)
+        cur.execute("""
+            DELETE FROM entity_links l USING removed_listings r
+            WHERE (l.source_a = r.source AND l.source_id_a = r.source_id)
+               OR (l.source_b = r.source AND l.source_id_b = r.source_id)
+        """)
+        copy_frame(cur, 'entity_links', links)
+
+        _temp_listings(cur, 'touched_listings', set(removed) | set(added) | partners)
+        cur.execute("""
+            SELECT c.source, c.source_id, c.cluster_id
+            FROM entity_clusters c
+            WHERE c.cluster_id IN (
+                SELECT e.cluster_id
+                FROM entity_clusters e
+                JOIN touched_listings t ON e.source = t.source AND e.source_id = t.source_id
+            )
+        """)
+        members = cur.fetchall()
+        previous = {(source, source_id): cluster_id for source, source_id, cluster_id in members}
+        nodes = (set(previous) - set(removed)) | set(added)
+
+        _temp_listings(cur, 'affected_listings', nodes)
+        cur.execute("""
+            SELECT l.source_a, l.source_id_a, l.source_b, l.source_id_b, l.score
+            FROM entity_links l
+            JOIN affected_listings a ON l.source_a = a.source AND l.source_id_a = a.source_id
+            JOIN affected_listings b ON l.source_b = b.source AND l.source_id_b = b.source_id
+        """)
+        edges = pd.DataFrame(cur.fetchall(), columns=LINK_COLUMNS)
+        cur.execute("SELECT COALESCE(MAX(cluster_id), 0) + 1 FROM entity_clusters")
+        next_cluster_id = cur.fetchone()[0]
+
+        clusters = cluster_listings(pd.DataFrame(sorted(nodes), columns=['source', 'source_id']), edges,
+                                    cluster_ids=previous, next_cluster_id=next_cluster_id)
+        cur.execute("""
+            DELETE FROM entity_clusters c USING touched_listings t
+            WHERE c.source = t.source AND c.source_id = t.source_id
+        """)
+        cur.execute("DELETE FROM entity_clusters WHERE cluster_id = ANY(%s)", (sorted(set(previous.values())),))
+        copy_frame(cur, 'entity_clusters', clusters)
+    conn.commit()
+    return clusters
+
+
+def save_index(index, fingerprints, generation, path=INDEX_PATH):
+    """Write a full snapshot of the index and the fingerprints of the listings in it,
+    and start an empty journal after it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as state:
+        pickle.dump({'format': INDEX_FORMAT, 'generation': generation, 'index': index,
+                     'fingerprints': fingerprints}, state, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    if os.path.exists(path + '.journal'):
+        os.remove(path + '.journal')
+
+
+def journal_index(changes, generation, path=INDEX_PATH):
+    """Append one incremental run's changes to the index journal.
+
+    ``changes`` holds the ``removed`` keys and the ``added`` keys with their
+    ``names``, ``locations`` and ``fingerprints``, in the order they were
+    applied. Each entry costs what changed, not the size of the index.
+    """
+    with open(path + '.journal', 'ab') as journal:
+        pickle.dump(dict(changes, generation=generation), journal, pickle.HIGHEST_PROTOCOL)
+
+
+def load_index(path=INDEX_PATH):
+    """The persisted blocking index and the fingerprints of the listings in it, as a pair,
+    or None if missing or not in step with the stored clusters.
+
+    The snapshot is read and the journal replayed on top of it; the last
+    generation written must match the stored clusters.
+    """
+    try:
+        with open(path, 'rb') as state:
+            state = pickle.load(state)
+        if state.get('format') != INDEX_FORMAT:
+            return None
+        index, fingerprints, generation = state['index'], state['fingerprints'], state['generation']
+        if os.path.exists(path + '.journal'):
+            with open(path + '.journal', 'rb') as journal:
+                while journal.peek(1):
+                    changes = pickle.load(journal)
+                    for key in changes['removed']:
+                        index.remove(key)
+                        fingerprints.pop(key, None)
+                    index.add(changes['added'], changes['names'], changes['locations'])
+                    fingerprints.update(zip(changes['added'], changes['fingerprints']))
+                    generation = changes['generation']
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, KeyError):
+        return None
+    if generation != source_generation(CLUSTER_MARKER, fresh=True):
+        return None
+    return index, fingerprints
+
+
+def _publish(index, fingerprints, changes=None, path=INDEX_PATH):
+    # The mediator reloads its cluster map, and cached de-duplicated results go stale
+    invalidate_source(CLUSTER_MARKER)
+    for source_name in QUERY_FUNCTIONS:
+        invalidate_source(source_name)
+    # Stamp the index with the new generation; a run that wrote clusters without it forces a full
+    # relink. Incremental runs only journal their changes until the journal outgrows a quarter of
+    # the snapshot, which is then rewritten
+    generation = source_generation(CLUSTER_MARKER)
+    if changes is not None and os.path.exists(path):
+        journal_index(changes, generation, path)
+        if os.path.getsize(path + '.journal') * 4 <= os.path.getsize(path):
+            return
+    save_index(index, fingerprints, generation, path)
+
+
+def run_linkage(engine=None):
+    """Offline job: link all listings across sources and persist their clusters, links and index."""
+    started = time.monotonic()
+    # Fingerprinted before reading, so a listing changed in between is re-linked by the next update
+    fingerprints = listing_fingerprints()
+    listings = load_listings()
+    index = BlockingIndex()
+    key_pairs = index.add(listing_keys(listings), listings['name'], listings['location'])
+    links = match_pairs(listings, key_pairs, engine=engine)
+    clusters = cluster_listings(listings, links)
+
+    conn = psycopg2.connect(**CONNECTION_PARAMS[ENTITY_STORE])
+    try:
+        save_linkage(conn, clusters, links)
+    finally:
+        conn.close()
+    _publish(index, {key: fingerprints.get(key) for key in index})
+
+    duplicates = len(clusters) - clusters['cluster_id'].nunique()
+    print(f"Linked {len(clusters)} listings into {clusters['cluster_id'].nunique()} clusters "
+          f"({duplicates} duplicates) in {time.monotonic() - started:.2f}s")
+    return clusters
+
+
+def update_linkage(engine=None):
+    """Offline job: re-link only the listings added, changed or removed since the last run.
+
+    A listing is changed when its content fingerprint differs from the one
+    it was indexed with. Removed and changed listings leave the persisted
+    blocking index, new and changed ones are added back, only their
+    candidate pairs are scored, and only the clusters they belong to are
+    rebuilt. Without a usable index this falls back to a full run_linkage.
+    A listing deleted while the job runs is skipped, and dropped by the next run.
+    """
+    started = time.monotonic()
+    state = load_index()
+    if state is None:
+        print("No linkage index in step with the stored clusters, running a full linkage.")
+        return run_linkage(engine)
+    index, fingerprints = state
+
+    current = listing_fingerprints()
+    added = sorted(current.keys() - fingerprints.keys())
+    removed = sorted(fingerprints.keys() - current.keys())
+    changed = sorted(key for key in current.keys() & fingerprints.keys() if current[key] != fingerprints[key])
+    if not added and not removed and not changed:
+        print("No new, changed or removed listings, clusters unchanged.")
+        return None
+
+    # A changed listing is re-linked as if it had been removed and added again
+    for key in removed + changed:
+        index.remove(key)
+        del fingerprints[key]
+    new_listings = load_listings(added + changed)
+    changes = {'removed': removed + changed, 'added': listing_keys(new_listings),
+               'names': list(new_listings['name']), 'locations': list(new_listings['location'])}
+    changes['fingerprints'] = [current[key] for key in changes['added']]
+    fingerprints.update(zip(changes['added'], changes['fingerprints']))
+    key_pairs = index.add(changes['added'], changes['names'], changes['locations'])
+    # Existing listings are only read when they are candidates for a new or changed one
+    partners = {key for pair in key_pairs for key in pair} - set(changes['added'])
+    listings = pd.concat([new_listings, load_listings(partners)], ignore_index=True)
+    links = match_pairs(listings, key_pairs, engine=engine)
+
+    conn = psycopg2.connect(**CONNECTION_PARAMS[ENTITY_STORE])
+    try:
+        # Only the listings actually read are clustered; one deleted since fingerprinting is not
+        clusters = update_clusters(conn, changes['added'], removed + changed, links)
+    finally:
+        conn.close()
+    _publish(index, fingerprints, changes)
+
+    print(f"Linked {len(added)} new and {len(changed)} changed listings and dropped {len(removed)} "
+          f"removed ones: {len(links)} new links, {clusters['cluster_id'].nunique()} clusters rebuilt "
+          f"in {time.monotonic() - started:.2f}s")
+    return clusters
+
+
+class ClusterMap:
+    """(source, source_id) -> (cluster_id, canonical) lookups, cached until the job reruns.
+
+    Only the clusters of the listings asked for are read, so a rerun costs
+    the listings the next requests return, not the whole cluster table.
+    """
+
+    def __init__(self, get_connection, max_size=CLUSTER_CACHE_SIZE):
+        self._get_connection = get_connection
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._cached = {}       # key -> (cluster_id, canonical), or None for an unclustered listing
+        self._generation = None
+
+    def _fetch(self, keys):
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.source, c.source_id, c.cluster_id, c.canonical
+                    FROM entity_clusters c
+                    JOIN unnest(%s::varchar[], %s::int[]) AS k(source, source_id)
+                      ON c.source = k.source AND c.source_id = k.source_id
+                """, ([source for source, _ in keys], [source_id for _, source_id in keys]))
+                found = {(source, source_id): (cluster_id, canonical)
+                         for source, source_id, cluster_id, canonical in cur.fetchall()}
+        return {key: found.get(key) for key in keys}
+
+    def mapping(self, keys):
+        """Cluster and canonical flag of every clustered listing among ``keys``."""
+        # Only integer ids are clustered; any other key maps to no cluster
+        keys = {key for key in keys if isinstance(key[1], int) and not isinstance(key[1], bool)}
+        generation = source_generation(CLUSTER_MARKER)
+        with self._lock:
+            if generation != self._generation or len(self._cached) > self.max_size:
+                self._cached = {}
+                self._generation = generation
+            found = {key: self._cached[key] for key in keys if key in self._cached}
+        missing = sorted(keys - found.keys())
+        if missing:
+            # Read outside the lock, so one slow lookup does not hold up the other requests
+            fetched = self._fetch(missing)
+            with self._lock:
+                if generation == self._generation:
+                    self._cached.update(fetched)
+            found.update(fetched)
+        return {key: value for key, value in found.items() if value is not None}
+
+
+def dedupe_by_cluster(records, mapping):
+    """Keep one record per cluster, preferring the canonical listing; order follows first appearance."""
+    chosen = {}
+    for record in records:
+        cluster, canonical = mapping.get(record.key, (record.key, True))
+        if canonical or cluster not in chosen:
+            chosen[cluster] = record
+    return list(chosen.values())
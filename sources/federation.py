@@ -0,0 +1,135 @@
+# sources/federation.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from queue import Empty, Queue
+
+from sources import metrics
+
+# Seconds each source may take to answer a search before its results are dropped
+DEFAULT_DEADLINE = 15.0
+SOURCE_DEADLINES = {
+    'source_2': 15.0,
+    'source_3': 10.0
+}
+
+# Shared worker pool, so every registered source is queried at the same time
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='source-fetch')
+
+FETCH_SECONDS = metrics.histogram('source_fetch_seconds', "Time for a source to answer a search", ['source'])
+FETCH_ROWS = metrics.counter('source_rows_total', "Rows returned by each source", ['source'])
+FETCH_FAILURES = metrics.counter('source_fetch_failures_total',
+                                 "Source fetches that timed out or failed", ['source', 'reason'])
+
+
+def _timed_fetch(fetch, filters):
+    started = time.monotonic()
+    rows = fetch(filters)
+    return rows, time.monotonic() - started
+
+
+# Queued by a stream's reader thread once every row has been read
+_END = object()
+
+
+def _read_stream(rows, queue, stop):
+    # Reader thread of a streamed source: queues every row, then _END or the exception that ended
+    # the stream. Stops reading, and closes the stream, once the consumer has given up on it
+    try:
+        for row in rows:
+            if stop.is_set():
+                return
+            queue.put(row)
+        queue.put(_END)
+    except Exception as e:
+        queue.put(e)
+    finally:
+        close = getattr(rows, 'close', None)
+        if close is not None:
+            close()
+
+
+def _streamed(source_name, rows, info, deadline):
+    # Rows of a source that answered with a stream, read on a thread of their own so the source's
+    # deadline (a time.monotonic() value) bounds its body too. The source is 'ok' once the stream
+    # ends; a stream still running at the deadline is cut off and marked 'late', and one that fails
+    # part-way is marked 'error'. Rows that arrived in time are passed on either way
+    queue, stop = Queue(), threading.Event()
+    threading.Thread(target=_read_stream, args=(rows, queue, stop), daemon=True,
+                     name=f'source-stream-{source_name}').start()
+    try:
+        while True:
+            try:
+                row = queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                info['state'] = 'late'
+                FETCH_FAILURES.inc(source=source_name, reason='timeout')
+                print(f"Source {source_name} missed its deadline after {info['rows']} rows")
+                return
+            if row is _END:
+                info['state'] = 'ok'
+                return
+            if isinstance(row, Exception):
+                info.update(state='error', error=str(row))
+                FETCH_FAILURES.inc(source=source_name, reason='error')
+                print(f"Error streaming data from {source_name}:", row)
+                return
+            info['rows'] += 1
+            FETCH_ROWS.inc(source=source_name)
+            yield row
+    finally:
+        stop.set()
+
+
+def dispatch(fetchers, filters, deadlines=None):
+    """Run every source fetcher concurrently and collect what arrives in time.
+
+    Returns a ``(results, status)`` pair: ``results`` maps each source that
+    answered before its deadline to its rows, and ``status`` maps every
+    source to a dict with its state ('ok', 'late' or 'error'), row count,
+    elapsed seconds and error message, if any. A fetcher may answer with an
+    iterator instead of a list; its rows are passed on as they are consumed,
+    its state stays 'streaming' until the iterator is exhausted, and reading
+    it stops at the source's deadline too (see _streamed). Its final state
+    is only known once the rows have been consumed, so render it after them.
+    """
+    deadlines = deadlines or SOURCE_DEADLINES
+    started = time.monotonic()
+    futures = {
+        source_name: _executor.submit(_timed_fetch, fetch, filters)
+        for source_name, fetch in fetchers.items()
+    }
+
+    results = {}
+    status = {}
+    for source_name, future in futures.items():
+        # Deadlines are measured from dispatch, so waiting on one source
+        # does not extend the budget of the next
+        deadline = deadlines.get(source_name, DEFAULT_DEADLINE)
+        remaining = max(0.0, started + deadline - time.monotonic())
+        try:
+            rows, elapsed = future.result(timeout=remaining)
+            FETCH_SECONDS.observe(elapsed, source=source_name)
+            if isinstance(rows, list):
+                results[source_name] = rows
+                status[source_name] = {'state': 'ok', 'rows': len(rows), 'elapsed': elapsed, 'error': None}
+                FETCH_ROWS.inc(len(rows), source=source_name)
+            else:
+                status[source_name] = {'state': 'streaming', 'rows': 0, 'elapsed': elapsed, 'error': None}
+                results[source_name] = _streamed(source_name, rows, status[source_name], started + deadline)
+        except FutureTimeoutError:
+            future.cancel()
+            status[source_name] = {'state': 'late', 'rows': 0, 'elapsed': deadline, 'error': None}
+            FETCH_FAILURES.inc(source=source_name, reason='timeout')
+            print(f"Source {source_name} missed its {deadline}s deadline")
+        except Exception as e:
+            status[source_name] = {'state': 'error', 'rows': 0,
+                                   'elapsed': time.monotonic() - started, 'error': str(e)}
+            FETCH_FAILURES.inc(source=source_name, reason='error')
+            print(f"Error fetching data from {source_name}:", e)
+    return results, status
+
+
+def late_sources(status):
+    return [source_name for source_name, info in status.items() if info['state'] == 'late']
@@ -0,0 +1,43 @@
+# sources/field_types.py
+
+import numpy as np
+import pandas as pd
+
+from sources.keymaps import smallest_int_dtype
+
+BOOLEAN_VALUES = {
+    'yes': True, 'no': False,
+    'true': True, 'false': False,
+    '1': True, '0': False,
+    '1.0': True, '0.0': False
+}
+
+
+def to_nullable_bool(series):
+    """Map Yes/No, True/False and 1/0 (any case) to a nullable boolean; anything else becomes NULL."""
+    text = series.astype('string').str.strip().str.lower()
+    return text.map(BOOLEAN_VALUES, na_action='ignore').astype('boolean')
+
+
+def to_small_int(series):
+    """Whole counts in the smallest nullable integer dtype that holds them (Int8 for baths).
+
+    Non-numeric and fractional values become <NA>.
+    """
+    values = pd.to_numeric(series, errors='coerce')
+    values = values.where(np.trunc(values) == values)
+    largest = int(np.abs(values).max()) if values.notna().any() else 0
+    return values.astype(np.dtype(smallest_int_dtype(largest)).name.capitalize())
+
+
+def parse_failures(raw, parsed, column):
+    """Rows whose raw value is present but did not parse, as (Row, Column, Value) records.
+
+    ``Row`` is the position of the row in ``raw``.
+    """
+    failed = raw.notna().to_numpy() & parsed.isna().to_numpy()
+    return pd.DataFrame({
+        'Row': np.flatnonzero(failed),
+        'Column': column,
+        'Value': raw.to_numpy()[failed]
+    })
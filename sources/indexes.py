@@ -0,0 +1,153 @@
+# sources/indexes.py
+
+import json
+
+from psycopg2 import sql
+
+from sources import RESULT_LIMIT
+from sources.compiler import compile_page_query, compile_query
+
+# Extensions the index suite relies on (pg_trgm backs the ILIKE '%x%' searches)
+EXTENSIONS = ['pg_trgm']
+
+# Secondary indexes per source, created after the data is loaded.
+# 'method' defaults to btree; 'opclass' applies to every column; 'expression'
+# replaces the column list for expression indexes.
+INDEXES = {
+    'source_2': [
+        # Join columns
+        {'name': 'idx_properties_location_id', 'table': 'properties', 'columns': ['location_id']},
+        {'name': 'idx_properties_property_type_id', 'table': 'properties', 'columns': ['property_type_id']},
+        {'name': 'idx_properties_room_config_id', 'table': 'properties', 'columns': ['room_config_id']},
+        {'name': 'idx_locations_city_id', 'table': 'locations', 'columns': ['city_id']},
+        # Range filters
+        {'name': 'idx_properties_price', 'table': 'properties', 'columns': ['price']},
+        {'name': 'idx_properties_total_area_sqft', 'table': 'properties', 'columns': ['total_area_sqft']},
+        {'name': 'idx_properties_price_per_sqft', 'table': 'properties', 'columns': ['price_per_sqft']},
+        # Keyset pagination order (see sources.SORT_KEYS)
+        {'name': 'idx_properties_price_keyset', 'table': 'properties', 'columns': ['price', 'property_id'],
+         'expression': 'COALESCE(price, 0), property_id'},
+        # Substring searches
+        {'name': 'idx_properties_property_name_trgm', 'table': 'properties', 'columns': ['property_name'],
+         'method': 'gin', 'opclass': 'gin_trgm_ops'},
+        {'name': 'idx_locations_location_trgm', 'table': 'locations', 'columns': ['location'],
+         'method': 'gin', 'opclass': 'gin_trgm_ops'},
+        {'name': 'idx_cities_city_trgm', 'table': 'cities', 'columns': ['city'],
+         'method': 'gin', 'opclass': 'gin_trgm_ops'}
+    ],
+    'source_3': [
+        # Join columns
+        {'name': 'idx_properties_locationid', 'table': 'properties', 'columns': ['locationid']},
+        {'name': 'idx_features_propertyid', 'table': 'features', 'columns': ['propertyid']},
+        {'name': 'idx_pricing_propertyid', 'table': 'pricing', 'columns': ['propertyid']},
+        # Range filters
+        {'name': 'idx_pricing_price_inr', 'table': 'pricing', 'columns': ['price_inr']},
+        {'name': 'idx_pricing_price_per_sqft', 'table': 'pricing', 'columns': ['price_per_sqft']},
+        {'name': 'idx_properties_total_area', 'table': 'properties', 'columns': ['total_area']},
+        {'name': 'idx_features_baths', 'table': 'features', 'columns': ['baths']},
+        # Keyset pagination order (see sources.SORT_KEYS)
+        {'name': 'idx_pricing_price_keyset', 'table': 'pricing', 'columns': ['price_inr', 'propertyid'],
+         'expression': 'COALESCE(price_inr, 0), propertyid'},
+        # Substring searches
+        {'name': 'idx_properties_name_trgm', 'table': 'properties', 'columns': ['name'],
+         'method': 'gin', 'opclass': 'gin_trgm_ops'},
+        {'name': 'idx_location_location_trgm', 'table': 'location', 'columns': ['location'],
+         'method': 'gin', 'opclass': 'gin_trgm_ops'}
+    ]
+}
+
+# Index a keyset page of each source must be read through (see sources.SORT_KEYS)
+KEYSET_INDEXES = {
+    'source_2': 'idx_properties_price_keyset',
+    'source_3': 'idx_pricing_price_keyset'
+}
+
+# Representative searches used to check which indexes the planner picks
+QUERY_SHAPES = {
+    'name_search': {'property_name': 'prestige'},
+    'location_search': {'location': 'nagar'},
+    'city_search': {'city': 'chennai'},
+    'price_range': {'min_price': 5000000, 'max_price': 7500000},
+    'area_range': {'min_area': 1200, 'max_area': 1500},
+    'min_rooms': {'min_rooms': 5},
+    'combined': {'location': 'nagar', 'min_price': 5000000, 'max_price': 10000000, 'has_balcony': True},
+    'keyset_page': {'min_price': 5000000}
+}
+
+
+def index_statement(index):
+    opclass = sql.SQL(' ' + index['opclass']) if index.get('opclass') else sql.SQL('')
+    if index.get('expression'):
+        columns = sql.SQL(index['expression'])
+    else:
+        columns = sql.SQL(', ').join(
+            sql.SQL('{}{}').format(sql.Identifier(column), opclass) for column in index['columns'])
+    return sql.SQL("CREATE INDEX IF NOT EXISTS {name} ON {table} USING {method} ({columns})").format(
+        name=sql.Identifier(index['name']),
+        table=sql.Identifier(index['table']),
+        method=sql.SQL(index.get('method', 'btree')),
+        columns=columns)
+
+
+def create_indexes(conn, source_name):
+    """Create the extensions and every index of a source, then refresh planner statistics."""
+    with conn.cursor() as cur:
+        for extension in EXTENSIONS:
+            cur.execute(sql.SQL("CREATE EXTENSION IF NOT EXISTS {}").format(sql.Identifier(extension)))
+        for index in INDEXES[source_name]:
+            cur.execute(index_statement(index))
+            print(f"Index '{index['name']}' ready on {index['table']}({', '.join(index['columns'])}).")
+        tables = sorted({index['table'] for index in INDEXES[source_name]})
+        for table in tables:
+            cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+    conn.commit()
+
+
+def drop_indexes(conn, source_name):
+    with conn.cursor() as cur:
+        for index in INDEXES[source_name]:
+            cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index['name'])))
+    conn.commit()
+
+
+def walk_plan(node, used, seq_scans):
+    """Collect the index names and the relations read by sequential scan in an EXPLAIN JSON plan."""
+    if 'Index Name' in node:
+        used.append(node['Index Name'])
+    if node.get('Node Type') == 'Seq Scan':
+        seq_scans.append(node.get('Relation Name'))
+    for child in node.get('Plans', []):
+        walk_plan(child, used, seq_scans)
+
+
+def explain_query_shapes(conn, source_name, shapes=None):
+    """EXPLAIN each query shape and report the indexes and sequential scans in its plan."""
+    report = {}
+    with conn.cursor() as cur:
+        for shape_name, filters in (shapes or QUERY_SHAPES).items():
+            if shape_name == 'keyset_page':
+                query, params = compile_page_query(source_name, filters, RESULT_LIMIT, after=(5000000, 0))
+            else:
+                query, params = compile_query(source_name, filters)
+            cur.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used, seq_scans = [], []
+            walk_plan(plan[0]['Plan'], used, seq_scans)
+            report[shape_name] = {'indexes': used, 'seq_scans': seq_scans}
+    conn.rollback()
+    return report
+
+
+def verify_indexes(conn, source_name):
+    """Report indexes that are missing from the database, the plan of every query shape and
+    whether keyset pages are read through the source's keyset index."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+        existing = {row[0] for row in cur.fetchall()}
+    missing = [index['name'] for index in INDEXES[source_name] if index['name'] not in existing]
+    query_shapes = explain_query_shapes(conn, source_name)
+    keyset_plan = query_shapes.get('keyset_page', {'indexes': []})
+    return {'missing': missing, 'query_shapes': query_shapes,
+            'keyset_index_used': KEYSET_INDEXES[source_name] in keyset_plan['indexes']}
@@ -0,0 +1,236 @@
+# sources/keymaps.py
+
+import hashlib
+import os
+import pickle
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# Raw rows read per chunk by the streaming normalisers. Their memory is bounded by this plus the
+# dimension key maps (one entry per distinct location, city, ...), not by the size of the file
+CHUNK_ROWS = 100000
+
+
+def factorize_keys(frame):
+    """Codes for the (possibly composite) key rows of ``frame`` in one vectorised pass.
+
+    Returns ``(codes, uniques)``: ``codes[i]`` is the position in ``uniques``
+    (a DataFrame of the distinct keys, in order of first appearance) of row
+    ``i``. Missing values are a key value of their own.
+    """
+    codes = np.zeros(len(frame), dtype=np.int64)
+    for column in frame.columns:
+        column_codes, uniques = pd.factorize(frame[column], use_na_sentinel=False)
+        # Re-factorizing after every column keeps the combined codes below the row count
+        codes, _ = pd.factorize(codes * (len(uniques) + 1) + column_codes)
+    _, first = np.unique(codes, return_index=True)
+    return codes, frame.iloc[first].reset_index(drop=True)
+
+
+def smallest_int_dtype(max_value):
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def sequential_ids(count):
+    """Ids 1..count in the smallest integer dtype that holds them."""
+    return np.arange(1, count + 1, dtype=smallest_int_dtype(count))
+
+
+def build_dimension(frame, key_columns, id_column):
+    """Dimension table and per-row surrogate ids for a (composite) natural key in one factorize pass.
+
+    Returns ``(ids, dimension)``. Ids are 1-based in order of first
+    appearance, so they match a drop_duplicates numbering, and use the
+    smallest integer dtype that holds them; no merge back onto ``frame`` is
+    needed.
+    """
+    codes, dimension = factorize_keys(frame[key_columns])
+    dtype = smallest_int_dtype(len(dimension))
+    dimension[id_column] = sequential_ids(len(dimension)).astype(dtype)
+    return (codes + 1).astype(dtype), dimension
+
+
+def _natural_key(values):
+    # NaN != NaN, so missing values are keyed as None
+    return tuple(None if pd.isna(value) else value for value in values)
+
+
+class KeyMap:
+    """Natural key -> surrogate id map for one dimension that persists across chunks.
+
+    Only the distinct keys of a chunk are looked up in the dict; rows are
+    mapped to ids through their factorized codes.
+    """
+
+    def __init__(self, key_columns, id_column):
+        self.key_columns = list(key_columns)
+        self.id_column = id_column
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def assign(self, frame):
+        """Ids for every row of ``frame`` and the dimension rows first seen in it.
+
+        Returns ``(ids, new_rows)``; ``new_rows`` holds the key columns plus
+        the id column for keys that were not in the map before.
+        """
+        codes, uniques = factorize_keys(frame[self.key_columns])
+        unique_ids = np.empty(len(uniques), dtype=np.int64)
+        new = []
+        for position, values in enumerate(uniques.itertuples(index=False, name=None)):
+            key = _natural_key(values)
+            surrogate = self.ids.get(key)
+            if surrogate is None:
+                surrogate = len(self.ids) + 1
+                self.ids[key] = surrogate
+                new.append(position)
+            unique_ids[position] = surrogate
+        new_rows = uniques.iloc[new].reset_index(drop=True)
+        new_rows[self.id_column] = unique_ids[new]
+        return unique_ids[codes], new_rows
+
+
+def key_hashes(frame):
+    """Stable signed 64-bit hash of every distinct key row of ``frame``, with the rows' codes.
+
+    Returns ``(codes, hashes)`` as factorize_keys does. The hash is of the
+    key's text, so it does not depend on dtypes or the pandas version and
+    can be kept on disk.
+    """
+    codes, uniques = factorize_keys(frame)
+    hashes = np.empty(len(uniques), dtype=np.int64)
+    for position, values in enumerate(uniques.itertuples(index=False, name=None)):
+        text = '\x1f'.join('\x00' if value is None else str(value) for value in _natural_key(values))
+        hashes[position] = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(),
+                                          'little', signed=True)
+    return codes, hashes
+
+
+class RowIdStore:
+    """Surrogate ids for the rows of a feed, e.g. listings keyed on name and location, kept in sqlite.
+
+    Rows repeating a natural key within one feed are told apart by their
+    occurrence: the n-th row of a key keeps the id the n-th row of that key
+    had in the previous feed. Ids therefore follow the row's identity, not
+    its position, and survive rows being reordered, added or dropped
+    elsewhere in the feed. Keys are stored as hashes in a sqlite file and
+    looked up one chunk at a time, so memory is bounded by the chunk, not
+    by the number of rows ever seen. Call ``start_feed`` before assigning a
+    new feed; a feed appended to the previous one continues its occurrence
+    counts.
+    """
+
+    def __init__(self, path, key_columns):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.key_columns = list(key_columns)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ids (
+                key_hash INTEGER, occurrence INTEGER, id INTEGER,
+                PRIMARY KEY (key_hash, occurrence)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS feed (key_hash INTEGER PRIMARY KEY, rows INTEGER) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS last_id (id INTEGER);
+            CREATE TEMP TABLE chunk_keys (position INTEGER PRIMARY KEY, key_hash INTEGER, rows INTEGER);
+            CREATE TEMP TABLE chunk_rows (position INTEGER PRIMARY KEY, key_hash INTEGER, occurrence INTEGER);
+        """)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def start_feed(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM feed")
+
+    def assign(self, frame):
+        """Ids of every row of ``frame``; rows not seen before get new ones, counting up."""
+        codes, hashes = key_hashes(frame[self.key_columns])
+        # Occurrence of each row within this frame, then offset by the rows of the feed so far
+        within = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+        counts = np.bincount(codes, minlength=len(hashes))
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM chunk_keys")
+            cur.executemany("INSERT INTO chunk_keys VALUES (?, ?, ?)",
+                            zip(range(len(hashes)), hashes.tolist(), counts.tolist()))
+            cur.execute("""
+                SELECT COALESCE(f.rows, 0) FROM chunk_keys c
+                LEFT JOIN feed f ON f.key_hash = c.key_hash ORDER BY c.position
+            """)
+            offsets = np.fromiter((rows for rows, in cur), dtype=np.int64, count=len(hashes))
+            cur.execute("""
+                INSERT INTO feed (key_hash, rows) SELECT key_hash, rows FROM chunk_keys WHERE true
+                ON CONFLICT (key_hash) DO UPDATE SET rows = rows + excluded.rows
+            """)
+
+            occurrences = offsets[codes] + within
+            cur.execute("DELETE FROM chunk_rows")
+            cur.executemany("INSERT INTO chunk_rows VALUES (?, ?, ?)",
+                            zip(range(len(codes)), hashes[codes].tolist(), occurrences.tolist()))
+            cur.execute("""
+                SELECT i.id FROM chunk_rows r
+                LEFT JOIN ids i ON i.key_hash = r.key_hash AND i.occurrence = r.occurrence
+                ORDER BY r.position
+            """)
+            ids = np.array([-1 if found is None else found for found, in cur], dtype=np.int64)
+
+            new = np.flatnonzero(ids < 0)
+            if len(new):
+                last = cur.execute("SELECT id FROM last_id").fetchone()
+                start = (last[0] if last else 0) + 1
+                ids[new] = np.arange(start, start + len(new))
+                cur.executemany("INSERT INTO ids VALUES (?, ?, ?)",
+                                zip(hashes[codes[new]].tolist(), occurrences[new].tolist(), ids[new].tolist()))
+                cur.execute("DELETE FROM last_id")
+                cur.execute("INSERT INTO last_id VALUES (?)", (int(ids[new].max()),))
+        return ids
+
+    def close(self):
+        self.conn.close()
+
+
+class KeyMapStore:
+    """Key maps and row counters of one normaliser, pickled between runs so later feeds append."""
+
+    def __init__(self, path):
+        self.path = path
+        self.maps = {}
+        self.counters = {}
+
+    @classmethod
+    def load(cls, path):
+        store = cls(path)
+        if os.path.exists(path):
+            with open(path, 'rb') as state:
+                saved = pickle.load(state)
+            store.maps, store.counters = saved['maps'], saved['counters']
+        return store
+
+    def keymap(self, name, key_columns, id_column):
+        if name not in self.maps:
+            self.maps[name] = KeyMap(key_columns, id_column)
+        return self.maps[name]
+
+    def next_ids(self, name, count):
+        """Reserve ``count`` consecutive surrogate ids for rows of table ``name``."""
+        start = self.counters.get(name, 0) + 1
+        self.counters[name] = start + count - 1
+        return np.arange(start, start + count, dtype=np.int64)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as state:
+            pickle.dump({'maps': self.maps, 'counters': self.counters}, state, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def append_csv(frame, path):
+    """Append rows to a CSV file, writing the header only when the file is new."""
+    frame.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
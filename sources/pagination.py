@@ -0,0 +1,109 @@
+# sources/pagination.py
+
+import base64
+import hashlib
+import heapq
+import json
+from decimal import Decimal, InvalidOperation
+
+# Largest page the search API will serve
+MAX_PAGE_SIZE = 100
+DEFAULT_PAGE_SIZE = 25
+
+# Cursor state for a source that has no rows left; None means it has not been read yet
+EXHAUSTED = 'done'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def filters_fingerprint(filters):
+    canonical = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(filters, positions):
+    """Pack each source's last-seen (price, key) into an opaque, URL-safe token."""
+    payload = {
+        'f': filters_fingerprint(filters),
+        'p': {
+            source_name: position if position in (None, EXHAUSTED) else [str(position[0]), position[1]]
+            for source_name, position in positions.items()
+        }
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _key(value):
+    # Source ids are integers; anything else (a string, null, a float) would only fail in SQL
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f"row key {value!r} is not an integer")
+    return int(value)
+
+
+def decode_cursor(token, filters):
+    """Unpack a cursor, refusing ones issued for a different search."""
+    if not token:
+        return {}
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        fingerprint = payload.get('f')
+        positions = {
+            source_name: position if position in (None, EXHAUSTED) else (Decimal(position[0]), _key(position[1]))
+            for source_name, position in payload['p'].items()
+        }
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError, InvalidOperation) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if any(position not in (None, EXHAUSTED) and not position[0].is_finite() for position in positions.values()):
+        raise InvalidCursor("Malformed cursor: price is not a number")
+    if fingerprint != filters_fingerprint(filters):
+        raise InvalidCursor("Cursor belongs to a different search")
+    return positions
+
+
+def sort_key(source_name, record):
+    return (Decimal(str(record.price)), source_name, record.source_id)
+
+
+def _keyed(source_name, records):
+    for record in records:
+        yield sort_key(source_name, record), record
+
+
+def merge_pages(source_rows, positions, page_size):
+    """k-way merge per-source keyset pages into one globally ordered page.
+
+    ``source_rows`` maps each source that answered to its records (already
+    in its own keyset order, at most ``page_size`` of them). Returns the page
+    records, the positions to encode in the next cursor and whether any source
+    may still have rows.
+
+    A source missing from ``source_rows`` (late or failed) keeps its old
+    position while the others advance, so its rows that sort before the
+    page's last row are served on a later page: pages stay ordered within
+    each source, but not globally, after a source misses one. The search
+    response lists such sources in ``late_sources`` and ``sources``.
+    """
+    streams = [_keyed(source_name, rows) for source_name, rows in source_rows.items()]
+    page = []
+    last_seen = {}
+    for key, row in heapq.merge(*streams, key=lambda item: item[0]):
+        if len(page) == page_size:
+            break
+        page.append(row)
+        last_seen[key[1]] = (key[0], key[2])
+
+    next_positions = dict(positions)
+    for source_name, rows in source_rows.items():
+        # A short page that was fully merged means the source has nothing further
+        last_key = sort_key(source_name, rows[-1]) if rows else None
+        consumed_all = not rows or last_seen.get(source_name) == (last_key[0], last_key[2])
+        if len(rows) < page_size and consumed_all:
+            next_positions[source_name] = EXHAUSTED
+        elif source_name in last_seen:
+            next_positions[source_name] = last_seen[source_name]
+    has_more = any(position != EXHAUSTED for position in next_positions.values())
+    return page, next_positions, has_more
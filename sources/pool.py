@@ -0,0 +1,247 @@
+# sources/pool.py
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from sources import CONNECTION_PARAMS
+
+# Default sizing for every pool; override per pool through get_pool(**settings)
+POOL_SETTINGS = {
+    'min_size': 1,
+    'max_size': 10,
+    'max_age': 1800,       # seconds before a connection is retired and replaced
+    'wait_timeout': 5.0    # seconds a checkout waits for a free connection
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are health-checked on checkout, retired once they are older
+    than ``max_age`` and a checkout waits at most ``wait_timeout`` seconds
+    when all ``max_size`` connections are in use.
+    """
+
+    def __init__(self, conn_params, name='default', min_size=1, max_size=10,
+                 max_age=1800, wait_timeout=5.0, fill=True):
+        if min_size > max_size:
+            raise ValueError("min_size cannot be larger than max_size")
+        self.name = name
+        self.conn_params = conn_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.wait_timeout = wait_timeout
+
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._waiting = 0
+        # Reentrant, so helpers that update counters can run with or without it held
+        self._cond = threading.Condition(threading.RLock())
+        self._counters = {'checkouts': 0, 'timeouts': 0, 'created': 0, 'discarded': 0, 'failed_health_checks': 0}
+
+        if fill:
+            self.fill()
+
+    def fill(self):
+        """Open connections until the pool holds ``min_size``, connecting outside the lock."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                # Reserve the slot before connecting outside the lock
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def _count(self, counter):
+        with self._cond:
+            self._counters[counter] += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.conn_params)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._counters['created'] += 1
+        return conn
+
+    def _expired(self, conn):
+        with self._cond:
+            created = self._created_at.get(id(conn), 0)
+        return conn.closed or time.monotonic() - created > self.max_age
+
+    def _discard(self, conn):
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._counters['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            self._count('failed_health_checks')
+            return False
+
+    def getconn(self):
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No connection available in pool '{self.name}' after {self.wait_timeout}s")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif self._expired(conn) or not self._healthy(conn):
+                self._discard(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                continue
+
+            self._count('checkouts')
+            return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        with self._cond:
+            if discard or self._expired(conn) or self._size > self.max_size:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection itself is suspect, do not hand it out again
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            # Includes GeneratorExit, when a streaming response is abandoned mid-way
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            stats = {
+                'name': self.name,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'utilisation': (self._size - idle) / self.max_size
+            }
+            stats.update(self._counters)
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn = self._idle.pop()
+                self._discard(conn)
+                self._size -= 1
+            self._cond.notify_all()
+
+
+# One pool per source, shared by every request handled in this process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(source_name, conn_params=None, **settings):
+    """Return the process-wide pool for a source, creating it on first use.
+
+    ``conn_params`` defaults to the entry for ``source_name`` in
+    ``CONNECTION_PARAMS``. The pool's first connections are opened after
+    the registry lock is released, so a slow or unreachable database does
+    not hold up requests for the other sources.
+    """
+    with _pools_lock:
+        pool = _pools.get(source_name)
+        if pool is not None:
+            return pool
+        if conn_params is None:
+            conn_params = CONNECTION_PARAMS[source_name]
+        options = dict(POOL_SETTINGS, **settings)
+        pool = ConnectionPool(conn_params, name=source_name, fill=False, **options)
+        _pools[source_name] = pool
+    pool.fill()
+    return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.stats() for pool in pools}
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.closeall()
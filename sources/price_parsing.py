@@ -0,0 +1,47 @@
+# sources/price_parsing.py
+
+import pandas as pd
+
+# Multipliers for the Indian price notation used by source 3 ('₹1.99 Cr', '45 L', '45 Lacs', '800k')
+PRICE_UNITS = {
+    'cr': 10000000,
+    'crore': 10000000,
+    'crores': 10000000,
+    'l': 100000,
+    'lac': 100000,
+    'lacs': 100000,
+    'lakh': 100000,
+    'lakhs': 100000,
+    'k': 1000
+}
+
+# Listing suffixes after a price ('₹1.5 Cr onwards', '1.5 Cr+', '₹85 L*'), which do not change it
+_SUFFIX = r'(?:\s*(?:\+|\*|(?i:onwards)))?'
+
+_AMOUNT = r'(?P<{0}>\d+(?:\.\d+)?)\s*(?P<{0}_unit>(?!(?i:onwards))[A-Za-z]+)?'
+
+# A single amount or a range ('₹80 L - 1.2 Cr', '1.2-1.5 Cr'); the lower bound carries
+# the upper bound's unit when it has none of its own
+PRICE_PATTERN = (r'^' + _AMOUNT.format('low') +
+                 r'(?:\s*(?:-|–|to)\s*' + _AMOUNT.format('high') + r')?' + _SUFFIX + r'$')
+
+
+def _rupees(amount, unit):
+    # A missing unit means plain rupees; an unknown one stays NaN, i.e. a parse failure
+    multiplier = unit.str.lower().map(PRICE_UNITS).astype('float64').mask(unit.isna(), 1.0)
+    return pd.to_numeric(amount, errors='coerce').astype('float64') * multiplier
+
+
+def parse_price_inr(prices):
+    """Parse a Series of price strings into whole rupees (nullable Int64), vectorised.
+
+    Ranges are parsed to their lower bound. Values that are not a price in
+    this notation come back as <NA>.
+    """
+    text = (prices.astype('string')
+            .str.replace('₹', '', regex=False)
+            .str.replace(',', '', regex=False)
+            .str.strip())
+    parts = text.str.extract(PRICE_PATTERN)
+    low_unit = parts['low_unit'].fillna(parts['high_unit'])
+    return _rupees(parts['low'], low_unit).round().astype('Int64')
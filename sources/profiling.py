@@ -0,0 +1,143 @@
+# sources/profiling.py
+
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+from flask import g, request
+
+from sources.cache import STATE_DIR
+
+# Off unless REQUEST_PROFILING=1. When on, only requests that ask for it with
+# an "X-Profile: 1" header or a "?profile=1" parameter are profiled.
+ENABLED = os.environ.get('REQUEST_PROFILING', '').lower() in ('1', 'true', 'yes')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(STATE_DIR, 'profiles'))
+
+# Allocation sites listed in each request's memory summary
+TOP_ALLOCATIONS = 15
+
+_UNSAFE = re.compile(r'[^0-9A-Za-z_.-]+')
+
+# Held while a request is profiled: only one profiler can be active per process
+# (a second enable() raises ValueError on Python 3.12+), and the memory peak is process-wide
+_profiling = threading.Lock()
+
+
+def _requested():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)
+    return (flag or '').lower() in ('1', 'true', 'yes')
+
+
+def _start():
+    if not _profiling.acquire(blocking=False):
+        print(f"Not profiling {request.path}: another request is being profiled")
+        return
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler is active outside this module
+        _profiling.release()
+        print(f"Not profiling {request.path}: {e}")
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    g.request_profile = {
+        'profiler': profiler,
+        'started_tracing': not tracing,
+        'started': time.perf_counter()
+    }
+
+
+def _finish(state, base_path, endpoint):
+    try:
+        _write_profile(state, base_path, endpoint)
+    finally:
+        _profiling.release()
+
+
+def _write_profile(state, base_path, endpoint):
+    profiler = state['profiler']
+    profiler.disable()
+    elapsed = time.perf_counter() - state['started']
+    current, peak = tracemalloc.get_traced_memory()
+    top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+    if state['started_tracing']:
+        tracemalloc.stop()
+
+    # pstats call graph: view with snakeviz, or convert with gprof2dot / flameprof
+    profiler.dump_stats(base_path + '.prof')
+    summary = {
+        'endpoint': endpoint,
+        'elapsed_s': round(elapsed, 4),
+        'peak_memory_bytes': peak,
+        'current_memory_bytes': current,
+        'top_allocations': [
+            {'site': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count} for stat in top
+        ]
+    }
+    with open(base_path + '.json', 'w') as memory_file:
+        json.dump(summary, memory_file, indent=2)
+    print(f"Profiled {endpoint} in {elapsed:.3f}s, peak memory {peak / 1024 / 1024:.1f} MiB: {base_path}.prof")
+
+
+def install(app, name, enabled=None):
+    """Profile individual requests of ``app`` on demand.
+
+    A profiled request runs under cProfile, and tracemalloc records its peak
+    memory. ``<PROFILE_DIR>/<name>-<time>-<endpoint>.prof`` holds the call
+    graph and a ``.json`` next to it holds the peak memory and top
+    allocation sites. Profiling of a streamed response ends when it is
+    closed, so streamed pages are measured in full; a request whose view
+    raises is finished in teardown_request. Work done on other threads (the
+    federation's source fetches) is not in the call graph, and the memory
+    peak is process-wide, so only one request is profiled at a time; one
+    that asks while another is being profiled runs unprofiled.
+    """
+    if not (ENABLED if enabled is None else enabled):
+        return
+
+    @app.before_request
+    def start_profile():
+        if _requested():
+            _start()
+
+    def output_path():
+        endpoint = _UNSAFE.sub('_', request.endpoint or request.path)
+        base_path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-"
+                                              f"{int(time.time() * 1000) % 1000:03d}-{endpoint}")
+        return base_path, endpoint
+
+    @app.after_request
+    def finish_profile(response):
+        state = g.pop('request_profile', None)
+        if state is None:
+            return response
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path, endpoint = output_path()
+        response.headers['X-Profile-File'] = base_path + '.prof'
+        if response.is_streamed:
+            # The body is generated after this point, so profiling ends when it is closed
+            response.call_on_close(lambda: _finish(state, base_path, endpoint))
+        else:
+            _finish(state, base_path, endpoint)
+        return response
+
+    @app.teardown_request
+    def abort_profile(error):
+        # after_request is skipped when the view raises, which would leave the profiler
+        # and tracemalloc running for every later request
+        state = g.pop('request_profile', None)
+        if state is None:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path, endpoint = output_path()
+        _finish(state, base_path, endpoint)
@@ -0,0 +1,106 @@
+# sources/query_log.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from psycopg2 import sql
+
+from sources.cache import STATE_DIR
+
+# Opt-in: with SLOW_QUERY_LOG=1 every source query is logged with its bound
+# parameters, wall time and row count, and queries slower than the threshold
+# also get their EXPLAIN (ANALYZE, BUFFERS) plan. ANALYZE runs the query a
+# second time, so leave this off in production.
+ENABLED = os.environ.get('SLOW_QUERY_LOG', '').lower() in ('1', 'true', 'yes')
+THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 250))
+
+# One JSON object per line, rotated at MAX_BYTES with BACKUP_COUNT old files kept
+LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH', os.path.join(STATE_DIR, 'slow_queries.log'))
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_WHITESPACE = re.compile(r'\s+')
+_LIMIT = re.compile(r'\bLIMIT\s+\d+', re.IGNORECASE)
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+            handler = RotatingFileHandler(LOG_PATH, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('slow_queries')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def query_text(conn, query):
+    return query.as_string(conn) if isinstance(query, sql.Composable) else str(query)
+
+
+def query_shape(text):
+    """Whitespace-collapsed query text with the LIMIT abstracted, and a short hash of it."""
+    shape = _LIMIT.sub('LIMIT ?', _WHITESPACE.sub(' ', text).strip())
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:12], shape
+
+
+def explain(conn, query, params):
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) a query in a savepoint, so a failure leaves the transaction usable."""
+    statement = sql.SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ") + (
+        query if isinstance(query, sql.Composable) else sql.SQL(query))
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT query_log_explain")
+        try:
+            cur.execute(statement, params)
+            plan = cur.fetchone()[0]
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT query_log_explain")
+            raise
+        cur.execute("RELEASE SAVEPOINT query_log_explain")
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def record(conn, source_name, query, params, elapsed, rows):
+    """Log one executed source query; above the threshold, with its plan."""
+    if not ENABLED:
+        return
+    shape_id, shape = query_shape(query_text(conn, query))
+    elapsed_ms = elapsed * 1000
+    entry = {
+        'ts': time.time(),
+        'source': source_name,
+        'shape_id': shape_id,
+        'shape': shape,
+        'params': list(params or []),
+        'elapsed_ms': round(elapsed_ms, 3),
+        'rows': rows
+    }
+    if elapsed_ms >= THRESHOLD_MS:
+        try:
+            entry['plan'] = explain(conn, query, params)
+        except Exception as e:
+            entry['plan_error'] = str(e)
+    _get_logger().info(json.dumps(entry, default=str))
+
+
+def execute(cur, source_name, query, params=None):
+    """cur.execute, recording the query in the slow-query log when it is enabled."""
+    if not ENABLED:
+        cur.execute(query, params)
+        return
+    started = time.perf_counter()
+    cur.execute(query, params)
+    record(cur.connection, source_name, query, params, time.perf_counter() - started, cur.rowcount)
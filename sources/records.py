@@ -0,0 +1,82 @@
+# sources/records.py
+
+from itertools import starmap
+
+from sources import ROW_COLUMNS
+
+# Attribute names of a record: the row columns, lowercased and in the same order
+FIELDS = tuple(column.lower() for column in ROW_COLUMNS)
+
+
+class PropertyRecord:
+    """One listing in the global schema.
+
+    Source adapters build records straight from their rows (cursor tuples
+    and System A's arrays both arrive in ROW_COLUMNS order); de-duplication,
+    pagination, the JSON API and the templates read attributes. With
+    ``__slots__`` a record has no per-instance dict, and it pickles (for the
+    result cache) as a plain tuple of its values.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, property_name, property_title, property_type, price, total_area, city, location,
+                 price_per_sqft, description, number_of_rooms, number_of_balconies, source, source_id=None):
+        self.property_name = property_name
+        self.property_title = property_title
+        self.property_type = property_type
+        self.price = price
+        self.total_area = total_area
+        self.city = city
+        self.location = location
+        self.price_per_sqft = price_per_sqft
+        self.description = description
+        self.number_of_rooms = number_of_rooms
+        self.number_of_balconies = number_of_balconies
+        self.source = source
+        self.source_id = source_id
+
+    def __iter__(self):
+        for field in FIELDS:
+            yield getattr(self, field)
+
+    def __reduce__(self):
+        return PropertyRecord, tuple(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, PropertyRecord):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f"PropertyRecord({self.source!r}, {self.source_id!r}, {self.property_name!r})"
+
+    @property
+    def key(self):
+        """(source, source_id) identifies a listing across the mediator."""
+        return self.source, self.source_id
+
+    def as_dict(self, columns=ROW_COLUMNS):
+        """The record keyed by row column name, optionally restricted to ``columns``."""
+        return {column: getattr(self, column.lower()) for column in columns}
+
+
+def select_columns(requested):
+    """Validate a list of requested column names (any case) against ROW_COLUMNS.
+
+    Returns them in their canonical spelling; raises ValueError for unknown ones.
+    """
+    canonical = {column.lower(): column for column in ROW_COLUMNS}
+    columns = []
+    for name in requested:
+        column = canonical.get(str(name).strip().lower())
+        if column is None:
+            raise ValueError(f"Unknown field: {name}")
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+
+def records_from_rows(rows):
+    """Build records from an iterable of ROW_COLUMNS-ordered rows, e.g. a cursor."""
+    return list(starmap(PropertyRecord, rows))
@@ -0,0 +1,314 @@
+# sources/verification.py
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from sources.columnar import columnar_dir, iter_table, newer_format
+from sources.field_types import to_nullable_bool
+from sources.keymaps import CHUNK_ROWS
+
+# Significant digits floats are compared on, so a value that lost its last bits
+# on a CSV round trip still hashes the same
+SIGNIFICANT_DIGITS = 12
+
+# Offending keys reported per check and kind of failure
+SAMPLE_ROWS = 5
+
+# One spilled record: a row key and a 64-bit value (a row fingerprint, or a count)
+RECORD = np.dtype([('key', np.int64), ('value', np.uint64)])
+
+
+class Partitions:
+    """(key, value) records spilled to disk, then hash-partitioned on key.
+
+    Records are appended to a single spill file as they arrive, so nothing
+    needs to know the number of rows up front. ``partition`` then splits
+    the spill file into partition files. Both sides of a join are
+    partitioned the same way (see partition_together), so matching keys end
+    up in the same partition and can be joined one partition at a time.
+    """
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(directory, name)
+        self.rows = 0
+        self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, keys, values=0):
+        records = np.empty(len(keys), dtype=RECORD)
+        records['key'] = keys
+        records['value'] = values
+        with open(self.path, 'ab') as spill:
+            records.tofile(spill)
+        self.rows += len(records)
+
+    def partition(self, partitions, chunk_rows):
+        """Split the spill file into ``partitions`` files, ``chunk_rows`` records at a time."""
+        self.paths = [f'{self.path}.{number}' for number in range(partitions)]
+        if not self.rows:
+            return
+        spilled = np.memmap(self.path, dtype=RECORD, mode='r')
+        for start in range(0, self.rows, chunk_rows):
+            records = np.array(spilled[start:start + chunk_rows])
+            partition = records['key'] % partitions
+            order = np.argsort(partition, kind='stable')
+            records, partition = records[order], partition[order]
+            bounds = np.searchsorted(partition, np.arange(partitions + 1))
+            for number, path in enumerate(self.paths):
+                if bounds[number] < bounds[number + 1]:
+                    with open(path, 'ab') as spill:
+                        records[bounds[number]:bounds[number + 1]].tofile(spill)
+        del spilled
+        os.remove(self.path)
+
+    def read(self, number):
+        if not os.path.exists(self.paths[number]):
+            return np.empty(0, dtype=RECORD)
+        return np.fromfile(self.paths[number], dtype=RECORD)
+
+
+def partition_together(sides, chunk_rows):
+    """Partition every side of a join alike, into as many partitions as keep each near chunk_rows records."""
+    partitions = max(1, -(-max(side.rows for side in sides) // chunk_rows))
+    for side in sides:
+        side.partition(partitions, chunk_rows)
+    return partitions
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Rows of a normalised table in chunks, from its columnar copy when that is up to date."""
+    if newer_format(path) == 'columnar':
+        return iter_table(columnar_dir(path), chunk_rows)
+    return pd.read_csv(path, chunksize=chunk_rows, float_precision='round_trip')
+
+
+def _round_significant(values, digits=SIGNIFICANT_DIGITS):
+    # Scale every value to an integer of ``digits`` digits, round and scale back;
+    # zeros, NaN and infinities pass through
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = np.floor(np.log10(np.abs(values))) - (digits - 1)
+        scale = np.where(np.isfinite(exponent), 10.0 ** exponent, 1.0)
+        return np.where(np.isfinite(values) & (values != 0), np.round(values / scale) * scale, values)
+
+
+def _canonical(values, kind):
+    # The same value must hash the same whether it came from the raw feed, a CSV or a typed column
+    if kind == 'numeric':
+        values = pd.Series(pd.to_numeric(values, errors='coerce'), dtype='Float64')
+        return _round_significant(values.to_numpy(dtype='float64', na_value=np.nan))
+    if kind == 'boolean':
+        return to_nullable_bool(values).astype('Float64').to_numpy(dtype='float64', na_value=np.nan)
+    return pd.Series(values).astype('string').to_numpy()
+
+
+def fingerprints(frame, kinds):
+    """64-bit content fingerprint of every row of ``frame``; ``kinds[i]`` types column ``i``."""
+    canonical = pd.DataFrame({
+        position: _canonical(frame.iloc[:, position], kind) for position, kind in enumerate(kinds)
+    })
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy()
+
+
+def _kinds(spec):
+    raw_columns = [raw for raw, _ in spec['compare']]
+    return [
+        'numeric' if column in spec.get('numeric', ()) else
+        'boolean' if column in spec.get('boolean', ()) else 'string'
+        for column in raw_columns
+    ]
+
+
+def _joined_chunks(spec, path_for, chunk_rows):
+    """Output rows with their dimension attributes, joined against in-memory hash tables.
+
+    Each join matches the row's ``on`` column with the dimension's ``key``
+    column (``on`` by default) and adds its ``columns`` under new names.
+    Dimensions are bounded by their distinct keys, not by the number of rows.
+    """
+    lookups = []
+    for join in spec.get('joins', ()):
+        dimension = pd.concat(read_chunks(path_for(join['file']), chunk_rows), ignore_index=True)
+        key = join.get('key', join['on'])
+        dimension = dimension.drop_duplicates(key).set_index(key)
+        lookups.append((join, dimension))
+    for chunk in read_chunks(path_for(spec['file']), chunk_rows):
+        for join, dimension in lookups:
+            keys = chunk[join['on']].to_numpy()
+            for column, name in join['columns'].items():
+                chunk[name] = dimension[column].reindex(keys).to_numpy()
+        yield chunk
+
+
+def _sample(keys, found, limit=SAMPLE_ROWS):
+    return (keys + [int(key) for key in found[:limit - len(keys)]])[:limit]
+
+
+def _raw_keys(spec, chunk, offset):
+    # Key each raw row is expected under: its raw_key column, or its 1-based position in the feed
+    if 'raw_key' in spec:
+        return chunk[spec['raw_key']].to_numpy(dtype=np.int64)
+    return np.arange(offset + 1, offset + len(chunk) + 1)
+
+
+def check_table(spec, raw_chunks, path_for, chunk_rows, workdir):
+    """Compare every row of one normalised table with the raw feed by content fingerprint.
+
+    Raw row ``i`` (1-based) is expected as the output row whose ``spec['key']``
+    is ``i``, or, with ``spec['raw_key']``, the value of that column of the
+    raw row. Returns counts of missing, extra, duplicated and mismatched
+    rows with sample keys of each.
+    """
+    raw_columns = [raw for raw, _ in spec['compare']]
+    output_columns = [output for _, output in spec['compare']]
+    kinds = _kinds(spec)
+
+    expected = Partitions(workdir, spec['table'] + '.raw')
+    actual = Partitions(workdir, spec['table'] + '.out')
+    raw_rows = output_rows = 0
+    for chunk in raw_chunks():
+        keys = _raw_keys(spec, chunk, raw_rows)
+        expected.add(keys, fingerprints(chunk[raw_columns], kinds))
+        raw_rows += len(chunk)
+    for chunk in _joined_chunks(spec, path_for, chunk_rows):
+        actual.add(chunk[spec['key']].to_numpy(dtype=np.int64), fingerprints(chunk[output_columns], kinds))
+        output_rows += len(chunk)
+    partitions = partition_together([expected, actual], chunk_rows)
+
+    result = {'raw_rows': raw_rows, 'rows': output_rows}
+    samples = {'missing': [], 'extra': [], 'duplicated': [], 'mismatched': []}
+    counts = dict.fromkeys(samples, 0)
+    for number in range(partitions):
+        raw, output = expected.read(number), actual.read(number)
+        raw = raw[np.argsort(raw['key'])]
+        keys, repeats = np.unique(output['key'], return_counts=True)
+        if len(raw):
+            position = np.minimum(np.searchsorted(raw['key'], output['key']), len(raw) - 1)
+            found = raw['key'][position] == output['key']
+            differs = found & (raw['value'][position] != output['value'])
+        else:
+            found = differs = np.zeros(len(output), dtype=bool)
+        failures = {
+            'missing': np.setdiff1d(raw['key'], keys),
+            'extra': np.unique(output['key'][~found]),
+            'duplicated': keys[repeats > 1],
+            'mismatched': np.unique(output['key'][differs])
+        }
+        for kind, failed in failures.items():
+            counts[kind] += len(failed)
+            samples[kind] = _sample(samples[kind], failed)
+    result.update(counts)
+    result['samples'] = samples
+    return result
+
+
+def check_foreign_key(spec, path_for, chunk_rows, workdir):
+    """Count child rows whose foreign key has no parent row, with a hash-partitioned join.
+
+    Also counts NULL foreign keys and parent keys that are not unique.
+    Children are spilled as (key, rows) per chunk, so a key shared by many
+    rows does not crowd one partition.
+    """
+    name = f"{spec['table']}.{spec['column']}"
+    children = Partitions(workdir, name + '.child')
+    parents = Partitions(workdir, name + '.parent')
+    rows = nulls = 0
+    for chunk in read_chunks(path_for(spec['file']), chunk_rows):
+        values = pd.to_numeric(chunk[spec['column']], errors='coerce')
+        present = values.notna().to_numpy()
+        keys, counts = np.unique(values.to_numpy()[present].astype(np.int64), return_counts=True)
+        children.add(keys, counts)
+        rows += len(chunk)
+        nulls += int((~present).sum())
+    for chunk in read_chunks(path_for(spec['parent']), chunk_rows):
+        parents.add(pd.to_numeric(chunk[spec['key']], errors='coerce').dropna().to_numpy().astype(np.int64))
+
+    orphans = duplicate_parents = 0
+    samples = []
+    for number in range(partition_together([children, parents], chunk_rows)):
+        parent_keys, repeats = np.unique(parents.read(number)['key'], return_counts=True)
+        child = children.read(number)
+        orphaned = ~np.isin(child['key'], parent_keys)
+        missing = child['key'][orphaned]
+        orphans += int(child['value'][orphaned].sum())
+        duplicate_parents += int((repeats > 1).sum())
+        samples = _sample(samples, np.unique(missing))
+    return {'rows': rows, 'null': nulls, 'orphans': orphans,
+            'duplicate_parent_keys': duplicate_parents, 'samples': samples}
+
+
+def sample_rows(spec, keys, raw_chunks, path_for, chunk_rows):
+    """The raw and the normalised rows of a few keys, found with one more streaming pass."""
+    raw_columns = [raw for raw, _ in spec['compare']]
+    output_columns = [output for _, output in spec['compare']]
+    wanted = np.array(sorted(keys), dtype=np.int64)
+    raw_parts, output_parts = [], []
+    offset = 0
+    for chunk in raw_chunks():
+        keys = _raw_keys(spec, chunk, offset)
+        selected = np.isin(keys, wanted)
+        raw_parts.append(chunk[raw_columns][selected].set_axis(keys[selected]))
+        offset += len(chunk)
+    for chunk in _joined_chunks(spec, path_for, chunk_rows):
+        selected = chunk[chunk[spec['key']].isin(wanted)]
+        output_parts.append(selected.set_index(spec['key'])[output_columns])
+    return pd.concat(raw_parts), pd.concat(output_parts)
+
+
+def verify(checks, raw_chunks, path_for, chunk_rows=CHUNK_ROWS):
+    """Verify normalised tables against the raw feed they were built from, in bounded memory.
+
+    ``checks['tables']`` lists content checks (see check_table) and
+    ``checks['foreign_keys']`` foreign key checks (see check_foreign_key).
+    ``raw_chunks`` returns a fresh iterator of raw feed chunks each time it
+    is called, and ``path_for`` maps a file name to its normalised path.
+    Memory is bounded by the chunk size, one spill partition (about
+    chunk_rows records, whatever the size of the feed) and the dimension
+    tables; spill files go to a temporary directory.
+    """
+    report = {'tables': {}, 'foreign_keys': {}}
+    with tempfile.TemporaryDirectory(prefix='verify-') as workdir:
+        for spec in checks['tables']:
+            result = check_table(spec, raw_chunks, path_for, chunk_rows, workdir)
+            offending = sorted({key for keys in result['samples'].values() for key in keys})[:SAMPLE_ROWS]
+            if offending:
+                result['sample_rows'] = sample_rows(spec, offending, raw_chunks, path_for, chunk_rows)
+            report['tables'][spec['table']] = result
+        for spec in checks['foreign_keys']:
+            report['foreign_keys'][f"{spec['table']}.{spec['column']}"] = \
+                check_foreign_key(spec, path_for, chunk_rows, workdir)
+    return report
+
+
+def print_report(report):
+    """Print a verification report; returns True when every check passed."""
+    passed = True
+    print("\nVerification:")
+    print("-" * 30)
+    for table, result in report['tables'].items():
+        failures = {kind: result[kind] for kind in ('missing', 'extra', 'duplicated', 'mismatched') if result[kind]}
+        ok = not failures and result['raw_rows'] == result['rows']
+        passed = passed and ok
+        print(f"{table}: {result['rows']} of {result['raw_rows']} rows "
+              f"{'✓ match' if ok else '✗ ' + ', '.join(f'{count} {kind}' for kind, count in failures.items())}")
+        for kind, keys in result['samples'].items():
+            if keys:
+                print(f"  {kind}: {keys}")
+        if 'sample_rows' in result:
+            raw, output = result['sample_rows']
+            print("  Raw rows:")
+            print(raw.to_string())
+            print("  Normalised rows:")
+            print(output.to_string())
+    for name, result in report['foreign_keys'].items():
+        ok = not (result['orphans'] or result['duplicate_parent_keys'])
+        passed = passed and ok
+        print(f"{name}: {result['rows']} rows, {result['null']} null, {result['orphans']} orphans, "
+              f"{result['duplicate_parent_keys']} duplicate parent keys {'✓' if ok else '✗'}")
+        if result['samples']:
+            print(f"  orphan keys: {result['samples']}")
+    return passed
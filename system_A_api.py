@@ -1,11 +1,19 @@
 # System A: Flask API to Expose Source 2 Data
 
-from flask import Flask, jsonify, request
-import psycopg2
+import json
+import time
+from decimal import Decimal
+from flask import Flask, Response, jsonify, request, stream_with_context
 from psycopg2.extras import RealDictCursor
+from sources import RESULT_LIMIT, metrics, profiling, query_log
+from sources.compiler import compile_page_query, compile_query, parse_search_form
+from sources.pool import get_pool, pool_stats
 
 app = Flask(__name__)
 
+# REQUEST_PROFILING=1 lets a request ask for a profile with "X-Profile: 1" or "?profile=1"
+profiling.install(app, 'system_a')
+
 # Database connection parameters
 CONNECTION_PARAMS = {
     'dbname': 'real_estate_db_source_2',
@@ -15,48 +23,110 @@ CONNECTION_PARAMS = {
     'port': '5432'
 }
 
+# Streaming responses (?format=ndjson) read the result through a server-side
+# cursor STREAM_ITERSIZE rows at a time and may return up to STREAM_MAX_ROWS rows
+STREAM_ITERSIZE = 500
+STREAM_MAX_ROWS = 10000
+
+# Latency of each stage of a request, rows served and failures, exposed on /metrics
+STAGE_SECONDS = metrics.histogram('system_a_stage_seconds', "Time spent in each stage of a request", ['stage'])
+ROWS_SERVED = metrics.counter('system_a_rows_total', "Rows returned to callers", ['format'])
+ERRORS = metrics.counter('system_a_errors_total', "Requests that failed", ['reason'])
+metrics.track_pools()
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def stream_rows(query, params):
+    # First line names the columns, then one compact JSON array per row
+    with get_pool('source_2', CONNECTION_PARAMS).connection() as conn:
+        with conn.cursor(name='get_properties_stream') as cur:
+            cur.itersize = STREAM_ITERSIZE
+            executed = time.perf_counter()
+            with STAGE_SECONDS.time(stage='query'):
+                cur.execute(query, params)
+                rows = cur.fetchmany(STREAM_ITERSIZE)
+            yield json.dumps({'columns': [column.name for column in cur.description]}) + '\n'
+            sent = 0
+            started = time.perf_counter()
+            while rows:
+                for row in rows:
+                    yield json.dumps(row, default=_json_default, separators=(',', ':')) + '\n'
+                sent += len(rows)
+                ROWS_SERVED.inc(len(rows), format='ndjson')
+                rows = cur.fetchmany(STREAM_ITERSIZE)
+            # Includes time the client took to read the stream
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='stream')
+            print(f"Streamed {sent} rows")
+            # A named cursor's row count is only known once it has been drained
+            query_log.record(conn, 'source_2', query, params, time.perf_counter() - executed, sent)
+
+def ndjson_response(query, params):
+    def generate():
+        try:
+            yield from stream_rows(query, params)
+        except Exception as e:
+            # Headers are already sent, so the error travels as the last line
+            ERRORS.inc(reason='stream')
+            yield json.dumps({'error': str(e)}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/get_properties', methods=['GET'])
 def get_properties():
-    conditions = request.args.get('conditions', '1=1')  # Default to return all if no conditions
+    # Structured filter as JSON in ?filters=, or the search form fields as plain query parameters
+    raw_filters = request.args.get('filters')
     try:
-        # Connect to the database
-        conn = psycopg2.connect(**CONNECTION_PARAMS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Define your query here (using source 2 schema)
-        query = f"""
-            SELECT 
-                COALESCE(p.property_name, 'Unknown') AS Property_Name,
-                p.property_title AS Property_Title,
-                COALESCE(pt.property_type, 'Not Specified') AS Property_Type,
-                COALESCE(p.price, 0) AS Price,
-                COALESCE(p.total_area_sqft, 0) AS Total_Area,
-                COALESCE(c.city, 'Unknown') AS City,
-                COALESCE(l.location, 'Unknown') AS Location,
-                COALESCE(p.price_per_sqft, 0) AS Price_per_SQFT,
-                COALESCE(p.description, 'No description available') AS Description,
-                COALESCE(r.total_rooms, 0) AS Number_Of_Rooms,
-                COALESCE(p.balcony, false) AS Number_Of_Balconies,
-                'source_2' as source
-            FROM properties p
-            LEFT JOIN locations l ON p.location_id = l.location_id
-            LEFT JOIN cities c ON l.city_id = c.city_id
-            LEFT JOIN property_types pt ON p.property_type_id = pt.property_type_id
-            LEFT JOIN rooms r ON p.room_config_id = r.room_config_id
-            WHERE {conditions}
-            LIMIT 100
-        """
-        cur.execute(query)
-        results = cur.fetchall()
-
-        print(results)
-
-        return jsonify(results)
+        with STAGE_SECONDS.time(stage='parse'):
+            form = json.loads(raw_filters) if raw_filters else request.args
+            if not hasattr(form, 'get'):
+                raise ValueError("expected a JSON object")
+            filters = parse_search_form(form)
+    except ValueError as e:
+        ERRORS.inc(reason='bad_request')
+        return jsonify({"error": f"Invalid filters: {e}"}), 400
+    # Keyset paging: ?paged=1&limit=n&after=["<price>", <property_id>]
+    paged = bool(request.args.get('paged'))
+    streaming = request.args.get('format') == 'ndjson'
+    max_rows = STREAM_MAX_ROWS if streaming else RESULT_LIMIT
+    try:
+        limit = min(int(request.args.get('limit', RESULT_LIMIT)), max_rows)
+        after = json.loads(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        ERRORS.inc(reason='bad_request')
+        return jsonify({"error": f"Invalid paging parameters: {e}"}), 400
+    # Source 2 query with the filter compiled into its WHERE clause
+    if paged:
+        query, params = compile_page_query('source_2', filters, limit, after)
+    else:
+        query, params = compile_query('source_2', filters, limit)
+    if streaming:
+        return ndjson_response(query, params)
+    try:
+        # Borrow a pooled connection to the database
+        with get_pool('source_2', CONNECTION_PARAMS).connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                with STAGE_SECONDS.time(stage='query'):
+                    query_log.execute(cur, 'source_2', query, params)
+                    results = cur.fetchall()
+
+                print(f"Returning {len(results)} rows")
+
+        ROWS_SERVED.inc(len(results), format='json')
+        with STAGE_SECONDS.time(stage='serialise'):
+            return jsonify(results)
     except Exception as e:
+        ERRORS.inc(reason='query')
         return jsonify({"error": str(e)})
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
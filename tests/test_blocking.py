@@ -0,0 +1,34 @@
+import pytest
+
+from sources.blocking import BlockingIndex, candidate_pairs, compact_text, normalise_text
+
+
+def test_text_normalisation():
+    assert normalise_text('Prestige  Lake-Side') == 'prestige lake side'
+    assert normalise_text(None) == ''
+    assert compact_text('Lake Side') == compact_text('lakeside')
+
+
+def test_candidate_pairs_are_positional_and_ordered():
+    pairs = candidate_pairs(['Prestige Lakeside', 'Sobha City', 'Prestige Lake Side'],
+                            ['Whitefield', 'Hebbal', 'Whitefield'], window=2)
+    assert (0, 2) in pairs
+    assert all(first < second for first, second in pairs)
+
+
+def test_incremental_add_and_remove():
+    index = BlockingIndex(window=2)
+    assert index.add(['a', 'b'], ['Prestige Lakeside', 'Prestige Lake-Side'], ['Whitefield'] * 2) == {('a', 'b')}
+    # Only pairs involving the new record, earlier record first
+    assert index.add(['c'], ['Prestige Lakeside'], ['Whitefield']) == {('a', 'c'), ('b', 'c')}
+
+    index.remove('a')
+    assert 'a' not in index and len(index) == 2
+    assert index.add(['d'], ['Prestige Lakeside'], ['Whitefield']) == {('b', 'd'), ('c', 'd')}
+
+
+def test_adding_an_indexed_record_again_fails():
+    index = BlockingIndex()
+    index.add(['a'], ['Prestige Lakeside'], ['Whitefield'])
+    with pytest.raises(ValueError):
+        index.add(['a'], ['Prestige Lakeside'], ['Whitefield'])
@@ -0,0 +1,41 @@
+import io
+
+import pandas as pd
+
+from sources.bulk_load import FINGERPRINT_COLUMN, add_fingerprints, prepare_frame
+
+SPEC = {
+    'table': 'locations', 'file': 'locations.csv', 'key': 'location_id',
+    'columns': {'location_id': 'location_id', 'Location': 'location', 'pincode': 'pincode', 'Price': 'price'},
+    'integer': ['location_id'],
+    'numeric': ['price']
+}
+
+
+def fingerprints(raw):
+    return add_fingerprints(prepare_frame(raw, SPEC), SPEC)[FINGERPRINT_COLUMN].tolist()
+
+
+def test_fingerprints_do_not_depend_on_how_the_file_was_read():
+    # The normaliser's typed frame, as the columnar copy holds it
+    typed = pd.DataFrame({
+        'location_id': [1, 2],
+        'Location': ['Baner', None],
+        'pincode': pd.array([411045, None], dtype='Int64'),
+        'Price': [4500000.0, 2.5]
+    })
+    # The same rows read back from CSV: the untyped pincode column comes back as float64
+    buffer = io.StringIO()
+    typed.to_csv(buffer, index=False)
+    buffer.seek(0)
+    from_csv = pd.read_csv(buffer)
+    assert from_csv['pincode'].dtype == 'float64'
+    assert fingerprints(from_csv) == fingerprints(typed)
+
+
+def test_fingerprints_cover_content_but_not_the_key():
+    raw = pd.DataFrame({'location_id': [1, 2, 3], 'Location': ['Baner', 'Baner', 'Aundh'],
+                        'pincode': ['411045', '411045', '411045'], 'Price': [1.0, 1.0, 1.0]})
+    first, second, third = fingerprints(raw)
+    assert first == second
+    assert first != third
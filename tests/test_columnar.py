@@ -0,0 +1,37 @@
+import pandas as pd
+
+from sources.columnar import columnar_dir, iter_table, newer_format, read_table, write_table
+
+
+def sample_frame():
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'rooms': pd.array([2, None, 3, 1], dtype='Int64'),
+        'price': [1.5, 2.0, float('nan'), 4.25],
+        'name': ['Prestige', None, 'Sobha Déjà', ''],
+        'city': pd.Categorical(['Pune', 'Goa', 'Pune', None])
+    })
+
+
+def test_round_trip_keeps_dtypes(tmp_path):
+    frame = sample_frame()
+    write_table(frame, tmp_path / 'properties')
+    pd.testing.assert_frame_equal(read_table(tmp_path / 'properties'), frame)
+    pd.testing.assert_frame_equal(read_table(tmp_path / 'properties', columns=['name'], start=1, stop=3),
+                                  frame[['name']].iloc[1:3])
+
+
+def test_chunks_cover_the_table(tmp_path):
+    frame = sample_frame()
+    write_table(frame, tmp_path / 'properties')
+    chunks = list(iter_table(tmp_path / 'properties', chunk_rows=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks), frame)
+
+
+def test_newer_format(tmp_path):
+    path = tmp_path / 'properties.csv'
+    sample_frame().to_csv(path, index=False)
+    assert newer_format(path) == 'csv'
+    write_table(sample_frame(), columnar_dir(path))
+    assert newer_format(path) == 'columnar'
@@ -0,0 +1,20 @@
+import numpy as np
+
+from sources.comparison import encode_strings, jaro_winkler_similarity
+
+
+def jaro_winkler(left, right):
+    codes_a, len_a = encode_strings(left)
+    codes_b, len_b = encode_strings(right)
+    return jaro_winkler_similarity(codes_a, len_a, codes_b, len_b)
+
+
+def test_jaro_winkler_empty_strings_do_not_match():
+    # jellyfish and recordlinkage score an empty pair 0, so two missing names are never a match
+    assert jaro_winkler([''], ['']).tolist() == [0.0]
+    assert jaro_winkler(['', 'prestige'], ['prestige', '']).tolist() == [0.0, 0.0]
+
+
+def test_jaro_winkler_known_values():
+    scores = jaro_winkler(['martha', 'dwayne', 'prestige'], ['marhta', 'duane', 'prestige'])
+    assert np.allclose(scores, [0.961111, 0.84, 1.0], atol=1e-6)
@@ -0,0 +1,52 @@
+import pytest
+from psycopg2 import sql
+
+from sources.compiler import compile_predicate, parse_search_form
+
+
+def identifiers(composable):
+    # Qualified column names a compiled predicate refers to, in order
+    if isinstance(composable, sql.Identifier):
+        return ['.'.join(composable.strings)]
+    if isinstance(composable, sql.Composed):
+        return [name for part in composable.seq for name in identifiers(part)]
+    return []
+
+
+def test_parse_form_fields():
+    form = {'property_name': '  Prestige ', 'city': '', 'min_price': '1e6', 'max_price': 'abc',
+            'min_rooms': '3', 'max_area': 'inf', 'has_balcony': 'on'}
+    assert parse_search_form(form) == \
+        {'property_name': 'Prestige', 'min_price': 1000000.0, 'min_rooms': 3, 'has_balcony': True}
+
+
+def test_parse_json_filters():
+    filters = {'city': 5, 'min_area': 100, 'max_area': float('nan'), 'min_price': True, 'has_balcony': False}
+    assert parse_search_form(filters) == {'city': '5', 'min_area': 100.0}
+    assert parse_search_form({'has_balcony': 'false'}) == {}
+    assert parse_search_form({'has_balcony': '0'}) == {}
+    assert parse_search_form({'has_balcony': True}) == {'has_balcony': True}
+
+
+@pytest.mark.parametrize('filters', [{'city': ['Pune']}, {'location': {'near': 'x'}}, {'has_balcony': 'maybe'},
+                                     {'has_balcony': 2}, ['city']])
+def test_parse_rejects_malformed_filters(filters):
+    with pytest.raises(ValueError):
+        parse_search_form(filters)
+
+
+def test_compile_binds_values_and_escapes_like_patterns():
+    predicate, params = compile_predicate('source_2', {'city': '50%_off', 'min_price': 10.0, 'has_balcony': True})
+    assert identifiers(predicate) == ['c.city', 'p.price', 'p.balcony']
+    assert params == ['%50\\%\\_off%', 10.0]
+
+
+def test_compile_without_filters_matches_everything():
+    assert compile_predicate('source_3', {}) == (sql.Composed([sql.SQL("TRUE")]), [])
+
+
+def test_compile_filter_on_unrecorded_attribute_matches_nothing():
+    # Source 3 records no city, so a city filter excludes all of its rows
+    predicate, params = compile_predicate('source_3', {'city': 'Pune'})
+    assert predicate == sql.Composed([sql.SQL("FALSE")])
+    assert params == []
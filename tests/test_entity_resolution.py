@@ -0,0 +1,34 @@
+import pandas as pd
+
+from sources.entity_resolution import LINK_COLUMNS, UnionFind, cluster_listings, match_pairs
+
+
+def test_union_find():
+    clusters = UnionFind(5)
+    clusters.union(0, 1)
+    clusters.union(3, 4)
+    clusters.union(1, 4)
+    assert len({clusters.find(item) for item in (0, 1, 3, 4)}) == 1
+    assert clusters.find(2) == 2
+
+
+def test_cluster_listings_keeps_known_cluster_ids():
+    listings = pd.DataFrame({'source': ['source_3', 'source_2', 'source_2', 'source_3'], 'source_id': [7, 4, 9, 1]})
+    links = pd.DataFrame([('source_2', 4, 'source_3', 7, 0.93), ('source_2', 9, 'source_3', 404, 0.9)],
+                         columns=LINK_COLUMNS)
+    clusters = cluster_listings(listings, links, cluster_ids={('source_3', 1): 5})
+    # Listings in source order then by id; a link to an unknown listing is ignored
+    assert clusters.values.tolist() == [
+        ['source_2', 4, 1, True],
+        ['source_2', 9, 2, True],
+        ['source_3', 1, 5, True],
+        ['source_3', 7, 1, False]
+    ]
+
+
+def test_match_pairs_skips_deleted_listings():
+    listings = pd.DataFrame({'source': ['source_2'], 'source_id': [4], 'name': ['Prestige'], 'location': ['Baner'],
+                             'price': [1.0], 'total_area': [1.0], 'price_per_sqft': [1.0]})
+    links = match_pairs(listings, {(('source_2', 4), ('source_3', 7))})
+    assert links.empty
+    assert list(links.columns) == LINK_COLUMNS
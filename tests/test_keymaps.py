@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from sources.keymaps import KeyMap, RowIdStore, build_dimension, factorize_keys, key_hashes
+
+
+def test_factorize_composite_keys_in_order_of_first_appearance():
+    frame = pd.DataFrame({'city': ['Pune', 'Goa', 'Pune', 'Pune', None], 'rooms': [1, 1, 1, 2, 1]})
+    codes, uniques = factorize_keys(frame)
+    assert codes.tolist() == [0, 1, 0, 2, 3]
+    assert uniques['city'].tolist()[:3] == ['Pune', 'Goa', 'Pune']
+    assert pd.isna(uniques['city'].iloc[3])
+    assert uniques['rooms'].tolist() == [1, 1, 2, 1]
+
+
+def test_build_dimension():
+    frame = pd.DataFrame({'city': ['Pune', 'Goa', 'Pune'], 'location': ['Baner', 'Calangute', 'Baner']})
+    ids, dimension = build_dimension(frame, ['city', 'location'], 'location_id')
+    assert ids.tolist() == [1, 2, 1]
+    assert ids.dtype == np.int8
+    assert dimension.to_dict('list') == \
+        {'city': ['Pune', 'Goa'], 'location': ['Baner', 'Calangute'], 'location_id': [1, 2]}
+
+
+def test_keymap_keeps_ids_across_chunks():
+    cities = KeyMap(['city'], 'city_id')
+    ids, new_rows = cities.assign(pd.DataFrame({'city': ['Pune', 'Goa', 'Pune']}))
+    assert ids.tolist() == [1, 2, 1]
+    assert new_rows.to_dict('list') == {'city': ['Pune', 'Goa'], 'city_id': [1, 2]}
+
+    ids, new_rows = cities.assign(pd.DataFrame({'city': ['Goa', 'Delhi', np.nan]}))
+    assert ids.tolist() == [2, 3, 4]
+    assert new_rows['city_id'].tolist() == [3, 4]
+    # NaN and None are the same missing key
+    ids, new_rows = cities.assign(pd.DataFrame({'city': [None]}))
+    assert ids.tolist() == [4]
+    assert new_rows.empty
+    assert len(cities) == 4
+
+
+def test_key_hashes_do_not_depend_on_dtype():
+    _, numbers = key_hashes(pd.DataFrame({'id': [1, 2]}))
+    _, text = key_hashes(pd.DataFrame({'id': ['1', '2']}))
+    assert numbers.tolist() == text.tolist()
+    assert numbers[0] != numbers[1]
+
+
+def listings(*rows):
+    return pd.DataFrame(list(rows), columns=['name', 'location'])
+
+
+def test_row_ids_survive_reordering_and_reopening(tmp_path):
+    path = str(tmp_path / 'state' / 'ids.sqlite')
+    store = RowIdStore(path, ['name', 'location'])
+    store.start_feed()
+    assert store.assign(listings(('A', 'x'), ('B', 'y'), ('A', 'x'))).tolist() == [1, 2, 3]
+    store.close()
+
+    store = RowIdStore(path, ['name', 'location'])
+    store.start_feed()
+    # A new listing gets the next id; repeated keys keep their ids by occurrence
+    assert store.assign(listings(('C', 'z'), ('A', 'x'), ('B', 'y'), ('A', 'x'))).tolist() == [4, 1, 2, 3]
+    assert len(store) == 4
+    store.close()
+
+
+def test_row_id_occurrences_continue_across_chunks(tmp_path):
+    store = RowIdStore(str(tmp_path / 'ids.sqlite'), ['name', 'location'])
+    store.start_feed()
+    assert store.assign(listings(('A', 'x'))).tolist() == [1]
+    assert store.assign(listings(('A', 'x'))).tolist() == [2]
+    store.start_feed()
+    assert store.assign(listings(('A', 'x'), ('A', 'x'))).tolist() == [1, 2]
+    store.close()
@@ -0,0 +1,68 @@
+import base64
+import json
+from collections import namedtuple
+from decimal import Decimal
+
+import pytest
+
+from sources.pagination import (EXHAUSTED, InvalidCursor, decode_cursor, encode_cursor, filters_fingerprint,
+                                merge_pages)
+
+Row = namedtuple('Row', ['price', 'source_id'])
+
+FILTERS = {'city': 'Pune', 'min_price': 1000000.0}
+
+
+def test_cursor_round_trip():
+    positions = {'source_2': (Decimal('4500000.50'), 17), 'source_3': EXHAUSTED, 'source_4': None}
+    token = encode_cursor(FILTERS, positions)
+    assert '=' not in token
+    assert decode_cursor(token, FILTERS) == positions
+    assert decode_cursor('', FILTERS) == {}
+
+
+def test_cursor_for_another_search_is_refused():
+    token = encode_cursor(FILTERS, {'source_2': (Decimal('1'), 1)})
+    with pytest.raises(InvalidCursor, match='different search'):
+        decode_cursor(token, dict(FILTERS, city='Mumbai'))
+
+
+@pytest.mark.parametrize('position', [['5', 'x'], ['5', None], ['5', 1.5], ['5', True], ['nan', 1], ['x', 1], [], 7])
+def test_malformed_cursor_positions_are_refused(position):
+    # A cursor for the right search whose position was tampered with
+    raw = json.dumps({'f': filters_fingerprint(FILTERS), 'p': {'source_2': position}}).encode('utf-8')
+    with pytest.raises(InvalidCursor):
+        decode_cursor(base64.urlsafe_b64encode(raw).decode('ascii'), FILTERS)
+
+
+def test_garbage_cursor_is_refused():
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not a cursor!', FILTERS)
+
+
+def test_merge_pages_orders_across_sources():
+    source_rows = {
+        'source_2': [Row(100, 1), Row(300, 2), Row(500, 3)],
+        'source_3': [Row(200, 9), Row(300, 1), Row(400, 5)]
+    }
+    page, positions, has_more = merge_pages(source_rows, {'source_2': None, 'source_3': None}, 3)
+    assert [(row.price, row.source_id) for row in page] == [(100, 1), (200, 9), (300, 2)]
+    # Ties on price are broken by source name, then id
+    assert positions == {'source_2': (Decimal('300'), 2), 'source_3': (Decimal('200'), 9)}
+    assert has_more
+
+
+def test_merge_pages_marks_fully_read_sources_exhausted():
+    source_rows = {'source_2': [Row(100, 1)], 'source_3': [Row(200, 4), Row(250, 6)]}
+    page, positions, has_more = merge_pages(source_rows, {'source_2': None, 'source_3': None}, 3)
+    assert len(page) == 3
+    assert positions == {'source_2': EXHAUSTED, 'source_3': EXHAUSTED}
+    assert not has_more
+
+
+def test_merge_pages_keeps_the_position_of_a_missing_source():
+    previous = {'source_2': (Decimal('100'), 1), 'source_3': (Decimal('50'), 2)}
+    page, positions, has_more = merge_pages({'source_2': [Row(150, 3), Row(160, 4)]}, previous, 2)
+    assert [row.source_id for row in page] == [3, 4]
+    assert positions == {'source_2': (Decimal('160'), 4), 'source_3': (Decimal('50'), 2)}
+    assert has_more
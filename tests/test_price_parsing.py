@@ -0,0 +1,22 @@
+import pandas as pd
+
+from sources.price_parsing import parse_price_inr
+
+
+def parse(*prices):
+    return parse_price_inr(pd.Series(prices)).tolist()
+
+
+def test_units_and_ranges():
+    assert parse('₹1.99 Cr', '45 L', '45 Lacs', '800k', '2,50,000') == \
+        [19900000, 4500000, 4500000, 800000, 250000]
+    assert parse('₹80 L - 1.2 Cr', '1.2-1.5 Cr') == [8000000, 12000000]
+
+
+def test_listing_suffixes():
+    assert parse('₹ 1.5 Cr onwards', '1.5 Cr+', '₹85 L*', '1.5 Cr Onwards', '80 L - 1.2 Cr onwards') == \
+        [15000000, 15000000, 8500000, 15000000, 8000000]
+
+
+def test_not_a_price():
+    assert parse('Price on request', '1.5 Cr negotiable', None) == [pd.NA, pd.NA, pd.NA]
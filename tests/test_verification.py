@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from sources.verification import Partitions, _round_significant, check_table
+
+SPEC = {
+    'table': 'properties',
+    'file': 'properties.csv',
+    'key': 'id',
+    'compare': [('Name', 'name'), ('Price', 'price')],
+    'numeric': ['Price']
+}
+
+
+def test_round_significant():
+    rounded = _round_significant(np.array([0.1 + 0.2, 0.3, 123456789012345.0]))
+    assert rounded[0] == rounded[1]
+    assert rounded[2] == 123456789012000.0
+    special = _round_significant(np.array([0.0, np.nan, np.inf, -np.inf]))
+    assert special[0] == 0.0 and np.isnan(special[1]) and special[2] == np.inf and special[3] == -np.inf
+
+
+def test_partitions_split_on_key(tmp_path):
+    spilled = Partitions(str(tmp_path), 'table')
+    spilled.add(np.array([1, 2, 3, 4, 5]), np.array([10, 20, 30, 40, 50]))
+    spilled.add(np.array([6]), 60)
+    assert spilled.rows == 6
+    spilled.partition(2, chunk_rows=4)
+    assert len(spilled) == 2
+    assert not os.path.exists(spilled.path)
+    assert spilled.read(0)['key'].tolist() == [2, 4, 6]
+    assert spilled.read(0)['value'].tolist() == [20, 40, 60]
+    assert spilled.read(1)['key'].tolist() == [1, 3, 5]
+
+
+def test_empty_partitions_read_empty(tmp_path):
+    spilled = Partitions(str(tmp_path), 'table')
+    spilled.partition(3, chunk_rows=4)
+    assert len(spilled) == 3
+    assert len(spilled.read(2)) == 0
+
+
+def run_check(tmp_path, spec, raw, output, chunk_rows=2):
+    output.to_csv(tmp_path / spec['file'], index=False)
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    raw_chunks = lambda: (raw.iloc[start:start + chunk_rows] for start in range(0, len(raw), chunk_rows))
+    return check_table(spec, raw_chunks, lambda name: str(tmp_path / name), chunk_rows, str(workdir))
+
+
+def test_check_table_reports_each_kind_of_failure(tmp_path):
+    raw = pd.DataFrame({'Name': ['A', 'B', 'C', 'D'], 'Price': [1.0, 2.5, 3.0, 4.0]})
+    output = pd.DataFrame({
+        'id': [1, 2, 3, 5, 5],
+        'name': ['A', 'B', 'X', 'D', 'D'],
+        # A float that lost its last bits still matches
+        'price': [1.0, 2.5000000000000004, 3.0, 4.0, 4.0]
+    })
+    result = run_check(tmp_path, SPEC, raw, output)
+    assert (result['raw_rows'], result['rows']) == (4, 5)
+    assert {kind: result[kind] for kind in ('missing', 'extra', 'duplicated', 'mismatched')} == \
+        {'missing': 1, 'extra': 1, 'duplicated': 1, 'mismatched': 1}
+    assert result['samples'] == {'missing': [4], 'extra': [5], 'duplicated': [5], 'mismatched': [3]}
+
+
+def test_check_table_matches_raw_rows_on_their_raw_key(tmp_path):
+    spec = dict(SPEC, raw_key='Raw_ID')
+    raw = pd.DataFrame({'Raw_ID': [20, 10, 30], 'Name': ['B', 'A', 'C'], 'Price': [2.0, 1.0, None]})
+    output = pd.DataFrame({'id': [10, 20, 30], 'name': ['A', 'B', 'C'], 'price': [1.0, 2.0, None]})
+    result = run_check(tmp_path, spec, raw, output)
+    assert [result[kind] for kind in ('missing', 'extra', 'duplicated', 'mismatched')] == [0, 0, 0, 0]